@@ -0,0 +1,97 @@
+"""
+ai_engine.py — Motor asíncrono persistente para las peticiones de IA.
+Un único hilo de fondo con su propio event loop de asyncio, creado una sola
+vez y propiedad de AIManager. Los trabajos (corutinas) llegan desde cualquier
+hilo a través de la cola thread-safe del loop y se devuelven como Futures,
+así no pagamos hilo + loop + executor nuevos en cada mensaje y las conexiones
+y el estado de los proveedores se mantienen calientes entre peticiones.
+
+Uso:
+    engine = AIEngine()
+    fut = engine.submit(corutina())      # concurrent.futures.Future
+    fut.add_done_callback(...)           # o fut.result(timeout=...)
+    engine.shutdown()                    # al cerrar la app
+"""
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Coroutine, Optional
+
+from utils import log_error
+
+
+class AIEngine:
+    """Hilo + event loop de larga vida que ejecuta los trabajos de IA."""
+
+    def __init__(self, nombre: str = "lune-ai-engine"):
+        self.nombre = nombre
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._listo = threading.Event()
+        self._lock = threading.Lock()
+
+    # ── Ciclo de vida ─────────────────────────────────────────────────────────
+
+    def start(self):
+        """Arranca el hilo del motor (idempotente)."""
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._listo.clear()
+            self._thread = threading.Thread(target=self._run, name=self.nombre, daemon=True)
+            self._thread.start()
+        self._listo.wait()
+
+    def _run(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        self._loop = loop
+        self._listo.set()
+        try:
+            loop.run_forever()
+        finally:
+            try:
+                pendientes = asyncio.all_tasks(loop)
+                for t in pendientes: t.cancel()
+                if pendientes:
+                    loop.run_until_complete(asyncio.gather(*pendientes, return_exceptions=True))
+                loop.run_until_complete(loop.shutdown_asyncgens())
+                loop.run_until_complete(loop.shutdown_default_executor())
+            except Exception as e:
+                log_error(f"AIEngine cierre: {e}")
+            finally:
+                loop.close()
+                self._loop = None
+
+    def shutdown(self, timeout: float = 3.0):
+        """Detiene el loop, cancela lo pendiente y espera al hilo."""
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            self._thread = None
+        if loop and loop.is_running():
+            loop.call_soon_threadsafe(loop.stop)
+        if thread and thread is not threading.current_thread():
+            thread.join(timeout)
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        self.start()
+        return self._loop
+
+    @property
+    def activo(self) -> bool:
+        return bool(self._thread and self._thread.is_alive())
+
+    def en_hilo_motor(self) -> bool:
+        return self._thread is threading.current_thread()
+
+    # ── Envío de trabajos ─────────────────────────────────────────────────────
+
+    def submit(self, coro: Coroutine) -> Future:
+        """Encola una corutina en el motor desde cualquier hilo.
+        Devuelve un concurrent.futures.Future; cancelarlo cancela la tarea."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def call_soon(self, fn: Callable[..., Any], *args):
+        """Programa una función normal dentro del hilo del motor."""
+        self.loop.call_soon_threadsafe(fn, *args)
@@ -0,0 +1,329 @@
+"""
+ai_http.py — Transporte HTTP asíncrono para los proveedores de IA.
+Usa aiohttp (si está instalado) con un pool de conexiones keep-alive por host,
+de modo que cada generación en curso es una corutina y no ocupa un hilo del
+executor: varias conversaciones y tareas de fondo pueden correr a la vez.
+
+Si aiohttp no está disponible se recurre a la sesión compartida de requests,
+leyendo el stream en un hilo del executor y pasando las líneas al loop por
+una cola (mismo comportamiento que antes, con la misma interfaz).
+
+Cancelación dura: con un ControlStream, abortar() corta el stream desde fuera
+de quien lo lee (cierra la respuesta o cancela la espera de cabeceras). Al
+cerrarse la conexión Ollama detiene la generación, y el hueco del pool queda
+libre de inmediato en lugar de esperar al siguiente fragmento o al timeout.
+
+Cada petición pide turno al Planificador (planificador.py): hueco por host,
+espera si el host avisó de límite de peticiones (429 / X-RateLimit-*) y
+reintento con backoff ante cortes o 429/5xx mientras no haya llegado nada.
+
+Uso (siempre dentro del loop del motor):
+    control = ControlStream()
+    async with aclosing(transporte.stream_chunks(url, payload, control=control)) as bloques:
+        async for bloque in bloques: ...     # bytes crudos → stream_parser
+    datos = await transporte.post_json(url, payload)
+"""
+import asyncio
+import json
+import socket
+import time
+from contextlib import aclosing
+from typing import AsyncIterator, Callable, Dict, List, Optional
+
+import requests
+
+from planificador import Planificador, REINTENTABLES
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+_FIN = object()
+
+
+class ControlStream:
+    """Permite cortar un stream en curso desde fuera del código que lo lee.
+    abortar() debe llamarse en el hilo del loop (AIEngine.call_soon)."""
+
+    def __init__(self):
+        self.abortado = False
+        self.abortado_en = 0.0                    # time.perf_counter() del corte
+        self._acciones: List[Callable] = []
+        # Medidas del transporte para la instrumentación (metricas.py)
+        self.conectado_en: Optional[float] = None # perf_counter() al llegar las cabeceras
+        self.bytes_enviados = 0
+        self.bytes_recibidos = 0
+        self.reintentos = 0
+
+    def al_abortar(self, accion: Callable):
+        # Si ya se abortó, la acción se ejecuta en el acto.
+        if self.abortado: accion()
+        else: self._acciones.append(accion)
+
+    def quitar(self, accion: Callable):
+        try: self._acciones.remove(accion)
+        except ValueError: pass
+
+    def abortar(self):
+        if self.abortado: return
+        self.abortado = True
+        self.abortado_en = time.perf_counter()
+        acciones, self._acciones = self._acciones, []
+        for accion in acciones:
+            try: accion()
+            except Exception: pass
+
+
+def _serializar(obj) -> bytes:
+    # Se serializa una sola vez aquí para conocer el tamaño exacto del payload
+    return orjson.dumps(obj) if orjson is not None else json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+
+def _status_de(error: Exception) -> Optional[int]:
+    # aiohttp.ClientResponseError.status o requests.HTTPError.response.status_code
+    status = getattr(error, "status", None)
+    if status is None: status = getattr(getattr(error, "response", None), "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def _reintentable(error: Exception) -> bool:
+    """Fallos que no llegaron a procesarse: cortes de conexión, 429 y 502/503/504.
+    Un host que rechaza la conexión está caído: no se insiste (ya lo vigila el sondeo)."""
+    if isinstance(error, ConnectionAbortedError): return False      # cancelado por el usuario
+    status = _status_de(error)
+    if status is not None: return status in REINTENTABLES
+    if isinstance(error, ConnectionRefusedError) or isinstance(getattr(error, "os_error", None), ConnectionRefusedError):
+        return False
+    if isinstance(error, requests.ConnectionError): return "refused" not in str(error).lower()
+    if aiohttp is not None and isinstance(error, aiohttp.ClientConnectionError): return True
+    return isinstance(error, ConnectionError)
+
+
+def _cortar_socket(response):
+    """Despierta al hilo bloqueado leyendo una respuesta de requests: hacer
+    shutdown del socket hace que su recv() vuelva en el acto."""
+    for ruta in (("raw", "_connection", "sock"), ("raw", "_fp", "fp", "raw", "_sock")):
+        obj = response
+        try:
+            for attr in ruta: obj = getattr(obj, attr)
+            obj.shutdown(socket.SHUT_RDWR)
+            return
+        except (AttributeError, OSError):
+            continue
+
+
+class TransporteHTTP:
+    """Cliente HTTP asíncrono con pool por host y fallback a requests."""
+
+    def __init__(self, session_sync=None, planificador: Optional[Planificador] = None):
+        self.session_sync = session_sync          # requests.Session (fallback)
+        self.planificador = planificador or Planificador()
+        self.headers: Dict[str, str] = dict(getattr(session_sync, "headers", {}) or {})
+        self._session = None                      # aiohttp.ClientSession (perezosa)
+        self._session_loop = None
+
+    @property
+    def nativo(self) -> bool:
+        """True si el transporte es realmente asíncrono (aiohttp)."""
+        return aiohttp is not None
+
+    # ── Sesión aiohttp ────────────────────────────────────────────────────────
+
+    def _get_session(self):
+        # La ClientSession queda ligada al loop que la crea: se crea perezosamente
+        # dentro del motor y se rehace si cambia el loop (p.ej. en pruebas).
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._session_loop is not loop:
+            # Sin tope propio: el hueco por host lo reparte el planificador
+            connector = aiohttp.TCPConnector(limit=0, limit_per_host=0,
+                                             keepalive_timeout=60, enable_cleanup_closed=True)
+            self._session = aiohttp.ClientSession(connector=connector, headers=self.headers)
+            self._session_loop = loop
+        return self._session
+
+    @staticmethod
+    def _timeout(segundos: float):
+        # Igual que requests: límite para conectar y entre lecturas, no total,
+        # para no cortar generaciones largas que siguen fluyendo.
+        return aiohttp.ClientTimeout(total=None, sock_connect=segundos, sock_read=segundos)
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    # ── Peticiones ────────────────────────────────────────────────────────────
+
+    async def _abortable(self, espera, control: Optional[ControlStream] = None):
+        """Espera `espera` como tarea aparte para que abortar() pueda cancelarla
+        (espera de turno, backoff o cabeceras que aún no llegan)."""
+        tarea = asyncio.ensure_future(espera)
+        if control is None: return await tarea
+        control.al_abortar(tarea.cancel)
+        try:
+            return await tarea
+        except asyncio.CancelledError:
+            if control.abortado: raise ConnectionAbortedError("Generación cancelada")
+            raise
+        finally:
+            control.quitar(tarea.cancel)
+
+    async def _antes_de_reintentar(self, url: str, error: Exception, intento: int, esperado: float,
+                                   control: Optional[ControlStream] = None) -> Optional[float]:
+        """Si el fallo admite reintento, espera el backoff y devuelve el total esperado;
+        si no, None. Un 429 con cabeceras de espera no gasta reintentos: la petición
+        queda encolada en el planificador hasta el reinicio del límite."""
+        if not _reintentable(error) or (control is not None and control.abortado): return None
+        plan = self.planificador
+        limitado = _status_de(error) == 429 and plan.estado(url).bloqueado_hasta > time.monotonic()
+        if not limitado and intento >= plan.reintentos: return None
+        espera = plan.backoff(0 if limitado else intento)
+        if esperado + espera > plan.max_espera_limite_s: return None
+        if control is not None: control.reintentos += 1
+        await self._abortable(asyncio.sleep(espera), control)
+        return esperado + espera
+
+    async def stream_chunks(self, url: str, json: dict, headers: Optional[dict] = None,
+                            timeout: float = 60, control: Optional[ControlStream] = None) -> AsyncIterator[bytes]:
+        """POST con respuesta en streaming; produce los bloques de bytes tal como
+        llegan (sin partir en líneas: eso lo hace stream_parser sin copias).
+        Si `control` se aborta, lanza ConnectionAbortedError y cierra la conexión.
+        Los fallos antes del primer bloque se reintentan (ver planificador.py)."""
+        cuerpo = _serializar(json)
+        cabeceras = {"Content-Type": "application/json", **(headers or {})}
+        if control is not None: control.bytes_enviados = len(cuerpo)
+        intento, esperado = 0, 0.0
+        while True:
+            entregado = False
+            try:
+                intento_stream = (self._stream_chunks_nativo(url, cuerpo, cabeceras, timeout, control) if self.nativo
+                                  else self._stream_chunks_sync(url, cuerpo, cabeceras, timeout, control))
+                async with aclosing(intento_stream) as bloques:
+                    async for bloque in bloques:
+                        entregado = True
+                        if control is not None: control.bytes_recibidos += len(bloque)
+                        yield bloque
+                return
+            except Exception as e:
+                if entregado: raise
+                esperado = await self._antes_de_reintentar(url, e, intento, esperado, control)
+                if esperado is None: raise
+            intento += 1
+
+    async def _stream_chunks_nativo(self, url, cuerpo, cabeceras, timeout, control=None) -> AsyncIterator[bytes]:
+        turno = await self._abortable(self.planificador.turno(url), control)
+        try:
+            session = self._get_session()
+            # Espera de cabeceras como tarea aparte: abortar() la cancela aunque el
+            # servidor aún no haya respondido (p.ej. Ollama cargando el modelo).
+            resp = await self._abortable(session.post(url, data=cuerpo, headers=cabeceras,
+                                                      timeout=self._timeout(timeout)), control)
+            if control is not None:
+                control.conectado_en = time.perf_counter()
+                control.al_abortar(resp.close)
+            try:
+                self.planificador.anotar(url, resp.status, resp.headers)
+                resp.raise_for_status()
+                async for bloque in resp.content.iter_any():
+                    yield bloque
+            except Exception as e:
+                if control is not None and control.abortado: raise ConnectionAbortedError("Generación cancelada") from e
+                raise
+            finally:
+                if control is not None: control.quitar(resp.close)
+                # Leída entera vuelve al pool keep-alive; cortada a medias se descarta
+                # la conexión (no se puede reutilizar) y se libera su hueco.
+                if control is not None and control.abortado: resp.close()
+                else: resp.release()
+        finally:
+            turno.liberar()
+
+    async def _stream_chunks_sync(self, url, cuerpo, headers, timeout, control=None) -> AsyncIterator[bytes]:
+        """Fallback: requests en un hilo del executor, bloques al loop por cola."""
+        loop = asyncio.get_running_loop()
+        cola: asyncio.Queue = asyncio.Queue()
+        estado = {"cerrar": False, "response": None}
+        turno = await self._abortable(self.planificador.turno(url), control)
+
+        def _leer():
+            try:
+                response = self.session_sync.post(url, data=cuerpo, headers=headers, timeout=timeout, stream=True)
+                estado["response"] = response
+                if control is not None: control.conectado_en = time.perf_counter()
+                loop.call_soon_threadsafe(self.planificador.anotar, url, response.status_code, response.headers)
+                if estado["cerrar"]: return
+                response.raise_for_status()
+                for bloque in response.iter_content(chunk_size=None):
+                    if estado["cerrar"]: break
+                    loop.call_soon_threadsafe(cola.put_nowait, bloque)
+            except Exception as e:
+                if not estado["cerrar"]: loop.call_soon_threadsafe(cola.put_nowait, e)
+            finally:
+                if estado["response"] is not None: estado["response"].close()
+                loop.call_soon_threadsafe(cola.put_nowait, _FIN)
+
+        def _abortar():
+            # Corre en el loop: desbloquea al consumidor ya y al hilo lector
+            # cortando el socket (el hilo cierra la respuesta al salir).
+            estado["cerrar"] = True
+            cola.put_nowait(ConnectionAbortedError("Generación cancelada"))
+            if estado["response"] is not None: _cortar_socket(estado["response"])
+
+        loop.run_in_executor(None, _leer)
+        if control is not None: control.al_abortar(_abortar)
+        try:
+            while True:
+                item = await cola.get()
+                if item is _FIN: break
+                if isinstance(item, Exception): raise item
+                yield item
+        finally:
+            estado["cerrar"] = True
+            turno.liberar()
+            if control is not None: control.quitar(_abortar)
+
+    async def post_json(self, url: str, json: dict, headers: Optional[dict] = None,
+                        timeout: float = 60) -> dict:
+        """POST sin streaming que devuelve el JSON de la respuesta (con turno y reintentos)."""
+        intento, esperado = 0, 0.0
+        while True:
+            try:
+                return await self._post_json(url, json, headers, timeout)
+            except Exception as e:
+                esperado = await self._antes_de_reintentar(url, e, intento, esperado)
+                if esperado is None: raise
+            intento += 1
+
+    async def _post_json(self, url: str, json: dict, headers: Optional[dict], timeout: float) -> dict:
+        turno = await self.planificador.turno(url)
+        try:
+            if not self.nativo:
+                def _call():
+                    r = self.session_sync.post(url, json=json, headers=headers, timeout=timeout)
+                    return r, r.status_code, r.headers
+                r, status, cabeceras = await asyncio.get_running_loop().run_in_executor(None, _call)
+                self.planificador.anotar(url, status, cabeceras)
+                r.raise_for_status(); return r.json()
+            session = self._get_session()
+            async with session.post(url, json=json, headers=headers, timeout=self._timeout(timeout)) as resp:
+                self.planificador.anotar(url, resp.status, resp.headers)
+                resp.raise_for_status()
+                return await resp.json(content_type=None)
+        finally:
+            turno.liberar()
+
+    async def get_status(self, url: str, timeout: float = 3) -> int:
+        """GET ligero; devuelve el código de estado HTTP."""
+        if not self.nativo:
+            return await asyncio.get_running_loop().run_in_executor(
+                None, lambda: self.session_sync.get(url, timeout=timeout).status_code)
+        session = self._get_session()
+        async with session.get(url, timeout=self._timeout(timeout)) as resp:
+            return resp.status
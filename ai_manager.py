@@ -1,136 +1,927 @@
 import asyncio
+import hashlib
 import json
+import re
+import time
 import requests
+from requests.adapters import HTTPAdapter
+from collections import OrderedDict, deque
 from abc import ABC, abstractmethod
-from typing import Callable, Dict, Optional
+from concurrent.futures import Future
+from contextlib import aclosing
+from pathlib import Path
+from typing import Callable, Coroutine, Deque, Dict, Optional
 import datos
+import tokens
+from ai_engine import AIEngine
+from ai_http import TransporteHTTP, ControlStream
+from stream_parser import ParserNDJSON, ParserSSE
+from historial import HistorialConversacion, estimar_tokens
+from sesiones import Conversacion, RegistroSesiones, Sesion, SESION_ESCRITORIO
+from cache_respuestas import CacheRespuestas
+from cache_semantica import CacheSemantica
+from embeddings import OllamaEmbedder, EmbedderHash, np
+from metricas import Metricas, RegistroPeticion
+from enrutador import EnrutadorLatencia, PROVEEDOR_AUTO
+from trabajos import ColaTrabajos, PRIORIDAD_EMBEDDINGS, PRIORIDAD_HECHOS, PRIORIDAD_RESUMEN, PRIORIDAD_TITULO
+from utils import log_info
 
 # Sesión HTTP compartida: reutiliza conexiones (keep-alive) en lugar de abrir
 # una nueva por cada mensaje. Reduce notablemente la latencia de respuesta.
 _session = requests.Session()
 _session.headers.update({"User-Agent": "LuneCD/8.0"})
 
+# Transporte asíncrono (aiohttp, con turnos y reintentos por host); usa _session como fallback.
+_transporte = TransporteHTTP(_session)
+
 class AIProvider(ABC):
-    def __init__(self):
-        self.cancel_flag = False
+    """Un proveedor solo guarda su configuración (url, modelo, clave). El estado
+    de cada conversación (historial, cancelación, stream en curso) va en una
+    Conversacion que se le pasa en cada chat(); `self.conv` es la de la sesión
+    de escritorio, que se usa si no se indica otra."""
+
+    def __init__(self, historial: Optional[HistorialConversacion] = None):
+        self.conv = Conversacion(historial)
+
+    # Atajos sobre la conversación de escritorio
+    @property
+    def conversation_history(self) -> HistorialConversacion: return self.conv.historial
+    @property
+    def cancel_flag(self) -> bool: return self.conv.cancelado
+    @cancel_flag.setter
+    def cancel_flag(self, valor: bool): self.conv.cancelado = valor
+    @property
+    def ultimo_ok(self) -> bool: return self.conv.ultimo_ok
+
+    def abortar(self):
+        """Cancelación dura de la conversación de escritorio. Llamar en el loop del motor."""
+        self.conv.abortar()
 
     @abstractmethod
-    async def chat(self, message: str, system_prompt: str = "", on_token: Callable = None) -> str: pass
+    async def chat(self, message: str, system_prompt: str = "", on_token: Callable = None,
+                   registro: Optional[RegistroPeticion] = None, conv: Optional[Conversacion] = None,
+                   contexto: str = "") -> str: pass
     @abstractmethod
     def is_available(self) -> bool: pass
-    @abstractmethod
-    def clear_history(self) -> None: pass
+    def clear_history(self) -> None: self.conv.historial.limpiar()
+
+    @staticmethod
+    def _con_contexto(estable: list, contexto: str) -> list:
+        """Payload: `estable` (system + historial, ya con el mensaje nuevo al final)
+        con `contexto` (recuerdos para este mensaje) como turno aparte justo antes
+        del mensaje. No se guarda en el historial: el prefijo system + historial
+        no cambia de un turno a otro."""
+        if not contexto: return estable
+        return estable[:-1] + [{"role": "system", "content": contexto}] + estable[-1:]
 
 # ── Ollama (Local / Offline) ──────────────────────────────────────────────────
 class OllamaProvider(AIProvider):
-    def __init__(self, url: str, model: str):
-        super().__init__()
+    def __init__(self, url: str, model: str, historial: Optional[HistorialConversacion] = None, keep_alive_min: int = 30):
+        super().__init__(historial)
         self.url = url
         self.model = model
-        self.conversation_history = []
+        # Estado de salud cacheado: is_available() no hace red, lo refresca AIManager
+        self.keep_alive_min = keep_alive_min
+        self._disponible: Optional[bool] = None
+        self.sondeado_en = 0.0
+        self.cargado_hasta = 0.0       # hasta cuándo el modelo sigue en memoria (keep_alive)
+
+    @property
+    def keep_alive(self) -> str:
+        return f"{self.keep_alive_min}m"
 
-    async def chat(self, message: str, system_prompt: str = "", on_token: Callable = None) -> str:
+    def _marcar_cargado(self):
+        self.cargado_hasta = time.time() + self.keep_alive_min * 60
+
+    @property
+    def caliente(self) -> bool:
+        return time.time() < self.cargado_hasta
+
+    def _estado_prefijo(self, conv: Conversacion, messages: list) -> str:
+        """Cuánto del prompt puede reutilizar Ollama de su caché (prefijo idéntico
+        al de la petición anterior + su respuesta): reutilizado | parcial | nuevo.
+        Se compara sin el turno de recuerdos, que no forma parte del historial:
+        "reutilizado" significa que system + historial siguen intactos y Ollama
+        solo reprocesa la cola desde los recuerdos del turno anterior."""
+        previo = conv.ultimo_envio
+        if not previo or not self.caliente: return "nuevo"
+        if messages[:len(previo)] == previo: return "reutilizado"
+        if messages[0] == previo[0]: return "parcial"     # se movió la ventana o el resumen
+        log_info("Ollama: cambió el personaje o la memoria, se reprocesa el prompt completo")
+        return "nuevo"
+
+    async def chat(self, message: str, system_prompt: str = "", on_token: Callable = None,
+                   registro: Optional[RegistroPeticion] = None, conv: Optional[Conversacion] = None,
+                   contexto: str = "") -> str:
+        conv = conv or self.conv
+        conv.ultimo_ok = False
         if not message or not message.strip(): return "El mensaje está vacío"
-        self.conversation_history.append({"role": "user", "content": message})
-        messages = self.conversation_history.copy()
-        if system_prompt: messages.insert(0, {"role": "system", "content": system_prompt})
+        conv.historial.append({"role": "user", "content": message})
+        estable = conv.historial.payload(system_prompt)
+        messages = self._con_contexto(estable, contexto)
+        prefijo = self._estado_prefijo(conv, estable)
+        if registro is not None: registro.prefijo = prefijo
 
-        def _call():
-            try:
-                response = _session.post(f"{self.url}/api/chat", json={"model": self.model, "messages": messages, "stream": True}, timeout=120, stream=True)
-                response.raise_for_status()
-                full_response = ""
-                for line in response.iter_lines():
-                    if self.cancel_flag: break 
-                    if line:
-                        chunk = json.loads(line.decode("utf-8"))
-                        token = chunk.get("message", {}).get("content", "")
-                        full_response += token
-                        if on_token: on_token(token)
-                        if chunk.get("done"): break
-                return full_response
-            except Exception as e: return f"Error Ollama: {str(e)}"
-
-        loop = asyncio.get_event_loop()
-        result = await loop.run_in_executor(None, _call)
-        if not result.startswith("Error Ollama:") and not self.cancel_flag:
-            self.conversation_history.append({"role": "assistant", "content": result})
+        full_response = ""
+        conv.control = ControlStream()
+        parser = ParserNDJSON()
+
+        def _procesar(chunks):
+            nonlocal full_response
+            for chunk in chunks:
+                token = chunk.get("message", {}).get("content", "")
+                full_response += token
+                if on_token and token: on_token(token)
+                if chunk.get("done"):
+                    # Cuánto prompt tuvo que procesar de verdad (lo cacheado no cuenta)
+                    if registro is not None: registro.anotar_prompt(chunk.get("prompt_eval_count"),
+                                                                    chunk.get("prompt_eval_duration"))
+                    parser.terminado = True; break
+
+        try:
+            payload = {"model": self.model, "messages": messages, "stream": True, "keep_alive": self.keep_alive}
+            async with aclosing(_transporte.stream_chunks(f"{self.url}/api/chat", payload, timeout=120,
+                                                          control=conv.control)) as bloques:
+                async for bloque in bloques:
+                    if conv.cancelado: break
+                    _procesar(parser.feed(bloque))
+                    if parser.terminado: break
+            # Último objeto sin salto de línea final (p.ej. el de "done")
+            if not conv.cancelado and not parser.terminado: _procesar(parser.cerrar())
+            result = full_response
+        except Exception as e: result = full_response if conv.cancelado else f"Error Ollama: {str(e)}"
+        finally:
+            if registro is not None: registro.anotar_stream(conv.control)
+            conv.control = None
+
+        conv.ultimo_ok = not result.startswith("Error Ollama:") and not conv.cancelado
+        if not result.startswith("Error Ollama:"): self._marcar_cargado()
+        conv.ultimo_envio = None
+        if conv.ultimo_ok:
+            respuesta = {"role": "assistant", "content": result}
+            conv.historial.append(respuesta)
+            conv.ultimo_envio = estable + [respuesta]
         return result
 
-    def is_available(self) -> bool:
-        try: return _session.get(f"{self.url}/api/tags", timeout=3).status_code == 200
-        except: return False
+    async def completar(self, messages: list, timeout: float = 120) -> str:
+        """Petición sin streaming ni historial (para tareas de fondo como resúmenes)."""
+        payload = {"model": self.model, "messages": messages, "stream": False, "keep_alive": self.keep_alive}
+        data = await _transporte.post_json(f"{self.url}/api/chat", payload, timeout=timeout)
+        self._marcar_cargado()
+        return data.get("message", {}).get("content", "").strip()
 
-    def clear_history(self): self.conversation_history = []
+    async def sondear(self) -> bool:
+        """Comprueba si Ollama responde y guarda el resultado en caché."""
+        try: self._disponible = (await _transporte.get_status(f"{self.url}/api/tags", timeout=3)) == 200
+        except Exception: self._disponible = False
+        if not self._disponible: self.cargado_hasta = 0.0   # si Ollama cae, el modelo ya no está en memoria
+        self.sondeado_en = time.time()
+        return self._disponible
+
+    async def precalentar(self) -> bool:
+        """Carga el modelo en memoria (prompt vacío) y renueva su keep_alive,
+        para que el primer mensaje real no pague el tiempo de carga."""
+        if not await self.sondear(): return False
+        try:
+            await _transporte.post_json(f"{self.url}/api/generate",
+                                        {"model": self.model, "prompt": "", "stream": False, "keep_alive": self.keep_alive},
+                                        timeout=300)
+            self._marcar_cargado()
+            return True
+        except Exception:
+            return False
+
+    def is_available(self) -> bool:
+        # No bloquea: devuelve el último sondeo (lo mantiene al día AIManager)
+        return bool(self._disponible)
 
 # ── OpenRouter (Nube / Automático) ────────────────────────────────────────────
 class OpenRouterProvider(AIProvider):
     BASE_URL = "https://openrouter.ai/api/v1/chat/completions"
 
-    def __init__(self, api_key: str, model: str):
-        super().__init__()
+    def __init__(self, api_key: str, model: str, historial: Optional[HistorialConversacion] = None):
+        super().__init__(historial)
         self.api_key = api_key
         self.model = model
-        self.conversation_history = []
 
-    async def chat(self, message: str, system_prompt: str = "", on_token: Callable = None) -> str:
+    async def chat(self, message: str, system_prompt: str = "", on_token: Callable = None,
+                   registro: Optional[RegistroPeticion] = None, conv: Optional[Conversacion] = None,
+                   contexto: str = "") -> str:
+        conv = conv or self.conv
+        conv.ultimo_ok = False
         if not self.api_key: return "API key de OpenRouter no configurada."
-        self.conversation_history.append({"role": "user", "content": message})
-        messages = self.conversation_history.copy()
-        if system_prompt: messages.insert(0, {"role": "system", "content": system_prompt})
+        conv.historial.append({"role": "user", "content": message})
+        messages = self._con_contexto(conv.historial.payload(system_prompt), contexto)
 
-        def _call():
-            try:
-                response = _session.post(self.BASE_URL, headers={"Authorization": f"Bearer {self.api_key}", "Content-Type": "application/json", "HTTP-Referer": "https://lunecd.local", "X-Title": "Lune CD"}, json={"model": self.model, "messages": messages, "stream": True}, timeout=60, stream=True)
-                response.raise_for_status()
-                full_response = ""
-                for line in response.iter_lines():
-                    if self.cancel_flag: break 
-                    if line:
-                        decoded = line.decode("utf-8")
-                        if decoded.startswith("data: "):
-                            data_str = decoded[6:]
-                            if data_str.strip() == "[DONE]": break
-                            try:
-                                chunk = json.loads(data_str)
-                                if "choices" in chunk and len(chunk["choices"]) > 0:
-                                    token = chunk["choices"][0].get("delta", {}).get("content", "")
-                                    if token:
-                                        full_response += token
-                                        if on_token: on_token(token)
-                            except json.JSONDecodeError: pass
-                return full_response
-            except Exception as e: return f"Error OpenRouter: {str(e)}"
-
-        loop = asyncio.get_event_loop()
-        result = await loop.run_in_executor(None, _call)
-        if not result.startswith("Error OpenRouter:") and not self.cancel_flag:
-            self.conversation_history.append({"role": "assistant", "content": result})
+        headers = {"Authorization": f"Bearer {self.api_key}", "Content-Type": "application/json", "HTTP-Referer": "https://lunecd.local", "X-Title": "Lune CD"}
+        full_response = ""
+        conv.control = ControlStream()
+        parser = ParserSSE()
+
+        def _procesar(chunks):
+            nonlocal full_response
+            for chunk in chunks:
+                choices = chunk.get("choices")
+                if choices:
+                    token = (choices[0].get("delta") or {}).get("content") or ""
+                    if token:
+                        full_response += token
+                        if on_token: on_token(token)
+
+        try:
+            payload = {"model": self.model, "messages": messages, "stream": True}
+            async with aclosing(_transporte.stream_chunks(self.BASE_URL, payload, headers=headers, timeout=60,
+                                                          control=conv.control)) as bloques:
+                async for bloque in bloques:
+                    if conv.cancelado: break
+                    _procesar(parser.feed(bloque))
+                    if parser.terminado: break
+            # Evento cortado sin línea en blanco final
+            if not conv.cancelado and not parser.terminado: _procesar(parser.cerrar())
+            result = full_response
+        except Exception as e: result = full_response if conv.cancelado else f"Error OpenRouter: {str(e)}"
+        finally:
+            if registro is not None: registro.anotar_stream(conv.control)
+            conv.control = None
+
+        conv.ultimo_ok = not result.startswith("Error OpenRouter:") and not conv.cancelado
+        if conv.ultimo_ok:
+            conv.historial.append({"role": "assistant", "content": result})
         return result
 
     def is_available(self) -> bool: return bool(self.api_key and self.api_key.strip())
-    def clear_history(self): self.conversation_history = []
+
+# ── Resumen rodante ───────────────────────────────────────────────────────────
+PROMPT_RESUMEN = (
+    "Resume en español y en pocas frases la conversación entre el usuario y el asistente. "
+    "Conserva nombres, datos concretos, preferencias y decisiones. Si hay un resumen previo, "
+    "intégralo en uno solo. Responde únicamente con el resumen."
+)
+MAX_RESUMEN = 1200  # caracteres: mantiene acotado el prefijo que se reenvía
+
+PROMPT_HECHOS = (
+    "Lee estos intercambios entre el usuario y la asistente Lune. Extrae solo hechos duraderos "
+    "sobre el usuario (gustos, datos personales, planes, proyectos, preferencias). Nada de lo que "
+    "dijo Lune ni de temas pasajeros. Responde únicamente con una lista JSON de frases cortas en "
+    "español, en tercera persona; [] si no hay ninguno."
+)
+
+PROMPT_TITULOS = (
+    "Para cada conversación numerada, escribe un título de 3 a 6 palabras en español. Responde "
+    "únicamente con una línea por conversación con el formato `n: título`."
+)
+
+
+def _id_embedder(embedder) -> str:
+    """Identifica el espacio de los vectores de un embedder (modelo o hashing + dimensión)."""
+    return getattr(embedder, "modelo", None) or f"hash-{getattr(embedder, 'dim', 0)}"
+
+
+def _lista_json(texto: str) -> list:
+    """Lista de frases de una respuesta del modelo (tolera texto alrededor del JSON)."""
+    inicio, fin = texto.find("["), texto.rfind("]")
+    if inicio < 0 or fin <= inicio: return []
+    try:
+        datos = json.loads(texto[inicio:fin + 1])
+    except ValueError:
+        return []
+    return [str(d).strip() for d in datos if isinstance(d, str) and d.strip()] if isinstance(datos, list) else []
+
+
+def _resumen_extractivo(previo: str, mensajes: list) -> str:
+    """Plan B sin modelo: conserva lo dicho por el usuario, recortado."""
+    lineas = [previo] if previo else []
+    lineas += [f"El usuario dijo: {m['content'][:160]}" for m in mensajes if m.get("role") == "user"]
+    return " ".join(lineas)[-MAX_RESUMEN:]
+
 
 # ── Manager ───────────────────────────────────────────────────────────────────
 class AIManager:
-    def __init__(self):
+    # Presupuesto de tokens del historial si config.json no indica otro
+    PRESUPUESTO_HISTORIAL = {"ollama": 2048, "openrouter": 6000}
+
+    def __init__(self, config=None):
+        self.config = config
         self.providers: Dict[str, AIProvider] = {}
+        # Motor asíncrono persistente: un solo hilo + loop para todas las peticiones
+        self.engine = AIEngine()
+        self._activas = 0            # peticiones interactivas en curso
+        self._inactivo = None        # asyncio.Event (se crea dentro del loop)
+        self.latencias_cancelacion: Deque[float] = deque(maxlen=100)
+        self.metricas = Metricas(int((self._cfg("ia", "metricas", {}) or {}).get("max_registros", 2000)))
+        self.enrutador = self._crear_enrutador()
+        self.trabajos = self._crear_cola_trabajos()
+        self.cache_respuestas = self._crear_cache()
+        self.cache_semantica, self.embedder = self._crear_cache_semantica()
+        self._embedder_pausa_hasta = 0.0
+        # Últimos vectores de mensajes: la memoria y la caché semántica embeben el mismo texto
+        self._vectores_recientes: "OrderedDict[str, object]" = OrderedDict()
+        # contexto_memoria(mensaje, vector) → turno de recuerdos para el mensaje
+        # (MemoriaManager.contexto_para_mensaje); se llama en el motor, nunca en la UI
+        self.contexto_memoria: Optional[Callable[[str, object], str]] = None
+        self._configurar_red()
+        tokens.configurar(self._cfg("ia", "tokenizadores", {}))
         self._init_providers()
+        # Sesiones por conversación; la de escritorio usa la Conversacion propia de
+        # cada proveedor (p.conversation_history) y nunca se desaloja.
+        opciones = self._cfg("ia", "sesiones", {}) or {}
+        self.sesiones = RegistroSesiones(
+            self._nueva_conversacion, max_vivas=int(opciones.get("max_vivas", 32)),
+            inactividad_s=float(opciones.get("inactividad_s", 1800)),
+            directorio=Path(self._cfg("paths", "cache", "./cache")) / "sesiones" if self.config is not None else None)
+        self.sesiones.fijar(SESION_ESCRITORIO)
 
     def _init_providers(self):
-        try: self.providers["ollama"] = OllamaProvider(datos.ollama_url(), datos.ollama_model())
+        # Si el proveedor ya existe solo se actualiza su configuración: así se
+        # conserva su historial y el estado caliente al guardar los ajustes.
+        try:
+            if "ollama" in self.providers:
+                p = self.providers["ollama"]
+                if (p.url, p.model) != (datos.ollama_url(), datos.ollama_model()): p.cargado_hasta = 0.0
+                p.url = datos.ollama_url(); p.model = datos.ollama_model()
+            else: self.providers["ollama"] = OllamaProvider(datos.ollama_url(), datos.ollama_model(),
+                                                            keep_alive_min=int(self._cfg("ia", "ollama_keep_alive_min", 30)))
+            if isinstance(self.embedder, OllamaEmbedder): self.embedder.url = datos.ollama_url()
         except Exception as e: print(f"Error Ollama: {e}")
-        try: self.providers["openrouter"] = OpenRouterProvider(datos.openrouter_key(), datos.openrouter_model())
+        try:
+            if "openrouter" in self.providers:
+                p = self.providers["openrouter"]; p.api_key = datos.openrouter_key(); p.model = datos.openrouter_model()
+            else: self.providers["openrouter"] = OpenRouterProvider(datos.openrouter_key(), datos.openrouter_model())
         except Exception as e: print(f"Error OpenRouter: {e}")
+        for pid in self.providers: self._configurar_historial(pid)
+
+    def _cfg(self, seccion: str, clave: str, default=None):
+        return self.config.get(seccion, clave, default) if self.config is not None else default
+
+    def _crear_cola_trabajos(self) -> ColaTrabajos:
+        opciones = self._cfg("ia", "trabajos", {}) or {}
+        cola = ColaTrabajos(self._esperar_inactivo, lambda: self._activas > 0,
+                            max_concurrentes=int(opciones.get("max_concurrentes", 1)),
+                            retardo_inactivo_s=float(opciones.get("retardo_inactivo_s", 1.5)),
+                            max_lote=int(opciones.get("max_lote", 8)))
+        cola.registrar("resumen", self._resumir_lote)
+        cola.registrar("hechos", self._extraer_hechos_lote)
+        cola.registrar("titulo", self._titular_lote)
+        cola.registrar("embeddings", self._embeber_lote)
+        return cola
+
+    def _crear_enrutador(self) -> EnrutadorLatencia:
+        opciones = self._cfg("ia", "auto", {}) or {}
+        ruta = Path(self._cfg("paths", "cache", "./cache")) / "enrutador.json" if self.config is not None else None
+        return EnrutadorLatencia(ruta, alfa=float(opciones.get("alfa", 0.2)),
+                                 penalizacion_frio_ms=float(opciones.get("penalizacion_frio_ms", 8000)),
+                                 penalizacion_fallo_ms=float(opciones.get("penalizacion_fallo_ms", 20000)),
+                                 explorar_cada=int(opciones.get("explorar_cada", 20)))
+
+    def _crear_cache(self) -> Optional[CacheRespuestas]:
+        opciones = self._cfg("ia", "cache_respuestas", {}) or {}
+        if not opciones.get("activa", True): return None
+        directorio = None
+        if opciones.get("disco", True) and self.config is not None:
+            directorio = Path(self._cfg("paths", "cache", "./cache")) / "respuestas"
+        return CacheRespuestas(max_entradas=int(opciones.get("max_entradas", 256)),
+                               ttl=float(opciones.get("ttl_segundos", 86400)), directorio=directorio,
+                               max_disco=int(opciones.get("max_disco", 2000)))
+
+    def _crear_cache_semantica(self):
+        # El embedder lo comparten la caché semántica y los vectores de la memoria
+        opciones = self._cfg("ia", "cache_semantica", {}) or {}
+        memoria = (self._cfg("ia", "memoria_vectores", {}) or {}).get("activa", True)
+        if np is None or not (opciones.get("activa", True) or memoria): return None, None
+        if opciones.get("embedder", "ollama") == "hash": embedder = EmbedderHash()
+        else: embedder = OllamaEmbedder(_transporte, datos.ollama_url(), opciones.get("modelo_embeddings", "nomic-embed-text"))
+        if not opciones.get("activa", True): return None, embedder
+        directorio = Path(self._cfg("paths", "cache", "./cache")) / "semantica" if self.config is not None else None
+        cache = CacheSemantica(umbral=float(opciones.get("umbral", 0.95)),
+                               max_entradas=int(opciones.get("max_entradas", 20000)),
+                               ttl=float(opciones.get("ttl_segundos", 7 * 86400)), directorio=directorio,
+                               modelo=_id_embedder(embedder))
+        return cache, embedder
+
+    async def _embeber(self, texto: str):
+        """Vector del mensaje, o None si el embedder falla/tarda (se pausa 60 s)."""
+        if self.embedder is None or time.monotonic() < self._embedder_pausa_hasta: return None
+        if texto in self._vectores_recientes: return self._vectores_recientes[texto]
+        try:
+            vector = (await asyncio.wait_for(self.embedder.embed([texto]), timeout=1.5))[0]
+        except Exception:
+            self._embedder_pausa_hasta = time.monotonic() + 60
+            return None
+        self._vectores_recientes[texto] = vector
+        if len(self._vectores_recientes) > 16: self._vectores_recientes.popitem(last=False)
+        return vector
+
+    def _ambito_semantico(self, provider: str, p: AIProvider, system_prompt: str, previos: list) -> str:
+        """Ámbito de la caché semántica: proveedor, modelo y embedder, una huella del
+        system prompt (personaje) y si el mensaje abre la conversación o sigue una.
+        El mismo parafraseo con otro personaje pide otra respuesta; el historial
+        exacto no entra (cada turno sería un ámbito nuevo y casi nunca acertaría)."""
+        huella = hashlib.blake2b(system_prompt.encode("utf-8"), digest_size=8).hexdigest()
+        momento = "seguimiento" if previos else "inicio"
+        return f"{provider}:{getattr(p, 'model', '')}:{_id_embedder(self.embedder)}:{huella}:{momento}"
+
+    def _modelo_embeddings(self) -> str:
+        # Identifica el espacio de los vectores: si cambia, el índice de la memoria se rehace
+        return _id_embedder(self.embedder)
+
+    def _nueva_conversacion(self, sesion: str, provider_id: str) -> Conversacion:
+        # Escritorio: la conversación propia del proveedor; resto: una nueva configurada
+        if sesion == SESION_ESCRITORIO and provider_id in self.providers: return self.providers[provider_id].conv
+        conv = Conversacion()
+        if provider_id in self.providers: self._configurar_historial(provider_id, conv.historial)
+        return conv
+
+    def _configurar_historial(self, provider_id: str, historial: Optional[HistorialConversacion] = None):
+        """Aplica el presupuesto de tokens (por modelo o por proveedor) y el
+        límite de mensajes de behavior.history_limit al historial del proveedor
+        (por defecto, al de escritorio)."""
+        p = self.providers[provider_id]
+        historial = historial or p.conversation_history
+        por_modelo = self._cfg("ia", "historial_tokens_modelo", {}) or {}
+        por_proveedor = self._cfg("ia", "historial_tokens", {}) or {}
+        presupuesto = por_modelo.get(getattr(p, "model", ""), por_proveedor.get(provider_id, self.PRESUPUESTO_HISTORIAL.get(provider_id, 4000)))
+        limite = self._cfg("behavior", "history_limit", 100)
+        # Prefijo estable (Ollama): recorte por lotes para que la caché de prompt sirva
+        prefijo = self._cfg("ia", "prefijo_estable", {}) or {}
+        holgura = float(prefijo.get("holgura", 0.25)) if provider_id == "ollama" and prefijo.get("activa", True) else 0.0
+        historial.configurar(presupuesto_tokens=int(presupuesto), max_mensajes=int(limite), holgura=holgura,
+                             modelo=getattr(p, "model", None))
+
+    def _configurar_red(self):
+        """Huecos por host, reintentos y esperas por límite (ia.red) en el
+        planificador del transporte y en el pool de la sesión de requests."""
+        red = self._cfg("ia", "red", {}) or {}
+        plan = _transporte.planificador
+        plan.configurar(conexiones_por_host=red.get("conexiones_por_host", 8),
+                        conexiones_host=red.get("conexiones_host", {}),
+                        reintentos=red.get("reintentos", 3), backoff_base_ms=red.get("backoff_base_ms", 250),
+                        backoff_max_ms=red.get("backoff_max_ms", 4000),
+                        max_espera_limite_s=red.get("max_espera_limite_s", 60))
+        # Fallback sin aiohttp: el pool de urllib3 debe admitir tantas conexiones
+        # por host como turnos reparte el planificador (por defecto son 10).
+        tam = max([plan.conexiones_por_host, *plan.conexiones_host.values()])
+        adaptador = HTTPAdapter(pool_connections=10, pool_maxsize=tam, max_retries=0)
+        _session.mount("http://", adaptador); _session.mount("https://", adaptador)
+
+    def estado_red(self) -> Dict[str, dict]:
+        """Huecos en uso, cola y límite de peticiones por host."""
+        return _transporte.planificador.stats()
 
     def reload_provider(self, provider_id: str = None):
+        self._configurar_red()
+        tokens.configurar(self._cfg("ia", "tokenizadores", {}))
         self._init_providers()
+        for sesion in self.sesiones.vivas():
+            for pid, conv in sesion.conversaciones.items():
+                if pid in self.providers: self._configurar_historial(pid, conv.historial)
+
+    # ── Salud y precalentamiento (Ollama) ─────────────────────────────────────
+
+    def iniciar_servicios(self, precalentar: bool = False):
+        """Arranca en el motor el sondeo periódico de salud y, si se pide,
+        precarga el modelo local."""
+        if getattr(self, "_vigilancia", None) is None:
+            self._vigilancia = self.submit(self._vigilar_salud())
+        if precalentar: self.calentar("ollama")
+
+    async def _vigilar_salud(self):
+        intervalo = float(self._cfg("ia", "salud_intervalo_s", 30))
+        while True:
+            ollama = self.providers.get("ollama")
+            if ollama is not None: await ollama.sondear()
+            # De paso, las sesiones inactivas pasan a disco
+            if n := self.sesiones.desalojar_inactivas(): log_info(f"{n} sesiones inactivas guardadas en disco")
+            await asyncio.sleep(intervalo)
 
-    async def chat(self, message: str, system_prompt: str = "", provider: Optional[str] = "openrouter", on_token: Callable = None) -> str:
+    def calentar(self, provider_id: str = "ollama") -> Optional[Future]:
+        """Precarga el modelo en segundo plano (no bloquea a quien llama)."""
+        p = self.providers.get(provider_id)
+        if not isinstance(p, OllamaProvider) or p.caliente: return None
+        return self.submit(p.precalentar())
+
+    def estado_proveedores(self) -> Dict[str, dict]:
+        """Estado cacheado de cada proveedor, sin hacer red (apto para la UI)."""
+        estado = {}
+        for pid, p in self.providers.items():
+            estado[pid] = {"disponible": p.is_available(),
+                           "caliente": getattr(p, "caliente", True),
+                           "sondeado_en": getattr(p, "sondeado_en", 0.0)}
+        return estado
+
+    async def chat(self, message: str, system_prompt: str = "", provider: Optional[str] = "openrouter",
+                   on_token: Callable = None, encolado: Optional[float] = None,
+                   sesion: str = SESION_ESCRITORIO, contexto: Optional[str] = None) -> str:
+        """`encolado` es el perf_counter() de cuando se pidió (para medir la espera en cola).
+        `sesion` identifica la conversación (escritorio, un chat de Telegram...).
+        `contexto`: recuerdos para este mensaje, como turno aparte antes de él; con
+        None, en el escritorio lo arma contexto_memoria aquí mismo, en el motor.
+        Con provider="auto" el enrutador elige por latencia medida (enrutador.py)."""
+        ses = self.sesiones.obtener(sesion)
+        auto = provider == PROVEEDOR_AUTO
+        if auto: provider = self._enrutar(ses, message, system_prompt, contexto or "")
         if provider not in self.providers: return f"Proveedor '{provider}' no disponible"
-        return await self.providers[provider].chat(message, system_prompt, on_token=on_token)
+        p = self.providers[provider]
+        conv = ses.conv(provider)
+        reg = self.metricas.nueva(provider, getattr(p, "model", ""), encolado)
+        on_token_ui, on_token = on_token, self._medir_tokens(reg, on_token)
+        # Carrera y "auto" mantienen el mismo historial en todos los proveedores
+        carrera = self._cfg("ia", "carrera", {}).get("activa", False) and len(self.providers) > 1
+        sincronizar = auto or carrera
+
+        # El vector del mensaje se pide ya: lo usan la caché semántica y los recuerdos
+        texto = (message or "").strip()
+        embebiendo = asyncio.ensure_future(self._embeber(texto)) if self.embedder is not None and texto else None
+
+        clave, previos = None, conv.historial.payload()
+        if self.cache_respuestas is not None and texto:
+            # Los recuerdos no entran en la clave: salen del mismo mensaje e historial
+            clave = CacheRespuestas.clave(provider, getattr(p, "model", ""), system_prompt, previos, message)
+            cacheada = self.cache_respuestas.get(clave)
+            if cacheada is not None:
+                self._reproducir(conv, message, cacheada, on_token)
+                if sincronizar: self._copiar_turno(ses, provider, message, cacheada)
+                self._programar_resumen(conv.historial)
+                reg.cache = "exacta"; self.metricas.registrar(reg)
+                return cacheada
+
+        # Caché semántica: parafraseos de preguntas ya respondidas (mensajes con sentido propio)
+        vector, ambito = None, self._ambito_semantico(provider, p, system_prompt, previos)
+        minimo = (self._cfg("ia", "cache_semantica", {}) or {}).get("min_caracteres", 12)
+        if self.cache_semantica is not None and embebiendo is not None and len(texto) >= minimo:
+            vector = await embebiendo
+            if vector is not None and (acierto := self.cache_semantica.buscar(vector, ambito)):
+                self._reproducir(conv, message, acierto[0], on_token)
+                if sincronizar: self._copiar_turno(ses, provider, message, acierto[0])
+                self._programar_resumen(conv.historial)
+                reg.cache = "semantica"; self.metricas.registrar(reg)
+                return acierto[0]
+        if contexto is None: contexto = self._contexto_memoria(ses, texto, embebiendo)
+
+        self._marcar_activa(+1); ses.activas += 1
+        try:
+            if carrera:
+                # Métricas y enrutador van al proveedor que respondió de verdad
+                provider, result, reg = await self._carrera(ses, provider, message, system_prompt,
+                                                            on_token_ui, reg, encolado, contexto)
+                conv = ses.conv(provider)
+            else:
+                result = await p.chat(message, system_prompt, on_token=on_token, registro=reg, conv=conv,
+                                      contexto=contexto)
+            if conv.ultimo_ok:
+                if clave: self.cache_respuestas.put(clave, result)
+                if vector is not None: self.cache_semantica.agregar(vector, result, ambito)
+                # En "auto" el siguiente turno puede ir al otro proveedor: mismo historial en ambos
+                # (la carrera ya lo copia)
+                if auto and not carrera: self._copiar_turno(ses, provider, message, result)
+                if ses.titulo is None and (self._cfg("ia", "trabajos", {}) or {}).get("titulos", True):
+                    self.trabajos.encolar("titulo", (ses, message, result), PRIORIDAD_TITULO, clave=("titulo", ses.id))
+            return result
+        finally:
+            self._marcar_activa(-1); ses.activas -= 1; ses.tocar()
+            reg.cancelado = conv.cancelado
+            reg.error = not conv.ultimo_ok and not conv.cancelado
+            if conv.cancelado: reg.cancelacion_ms = self._medir_cancelacion(ses)
+            self.enrutador.observar(provider, self.metricas.registrar(reg))
+            for c in ses.conversaciones.values(): self._programar_resumen(c.historial)
+
+    # ── Modo carrera (hedged requests) ────────────────────────────────────────
+
+    async def _carrera(self, ses: Sesion, primario: str, message: str, system_prompt: str, on_token: Callable = None,
+                       registro: Optional[RegistroPeticion] = None, encolado: Optional[float] = None,
+                       contexto: str = ""):
+        """Lanza el proveedor elegido y, si no ha dado su primer token tras
+        `hedge_ms` (o falla antes), lanza también el otro. Gana el primero que
+        emite un token: se cancela la tarea del perdedor (cierra su stream) y
+        se concilian los historiales para que ambos registren el mismo turno.
+        Cada rama lleva su RegistroPeticion (`registro` es el del primario); el
+        del perdedor se registra aquí como cancelado o fallido. Devuelve
+        (ganador, respuesta, registro del ganador)."""
+        hedge = float(self._cfg("ia", "carrera", {}).get("hedge_ms", 1500)) / 1000
+        secundario = next((pid for pid in self.providers if pid != primario), None)
+        tareas: Dict[str, asyncio.Task] = {}
+        registros: Dict[str, RegistroPeticion] = {}
+        ganador = None
+        hay_ganador = asyncio.Event()
+
+        def _on_token_de(pid):
+            def _cb(token):
+                nonlocal ganador
+                if token: registros[pid].token()
+                if ganador is None and token:
+                    ganador = pid; hay_ganador.set()
+                if ganador == pid and on_token: on_token(token)
+            return _cb
+
+        def _lanzar(pid):
+            p = self.providers[pid]
+            registros[pid] = (registro if pid == primario and registro is not None
+                              else self.metricas.nueva(pid, getattr(p, "model", ""), encolado))
+            tareas[pid] = asyncio.ensure_future(p.chat(message, system_prompt, on_token=_on_token_de(pid),
+                                                       registro=registros[pid], conv=ses.conv(pid), contexto=contexto))
+
+        _lanzar(primario)
+        espera = asyncio.ensure_future(hay_ganador.wait())
+        try:
+            await asyncio.wait([tareas[primario], espera], timeout=hedge, return_when=asyncio.FIRST_COMPLETED)
+            if ganador is None and secundario: _lanzar(secundario)
+            while ganador is None:
+                vivas = [t for t in tareas.values() if not t.done()]
+                if not vivas: break
+                await asyncio.wait(vivas + [espera], return_when=asyncio.FIRST_COMPLETED)
+        except asyncio.CancelledError:
+            for t in tareas.values(): t.cancel()
+            raise
+        finally:
+            espera.cancel()
+
+        cancelados = set()
+        for pid, t in tareas.items():
+            if pid != ganador and not t.done(): t.cancel(); cancelados.add(pid)
+        resultados = await asyncio.gather(*tareas.values(), return_exceptions=True)
+        por_pid = dict(zip(tareas.keys(), resultados))
+
+        if ganador is None:
+            # Nadie emitió tokens: se devuelve la primera respuesta válida, o el error del primario
+            ganador = next((pid for pid in tareas if ses.conv(pid).ultimo_ok), primario)
+        result = por_pid[ganador]
+        if isinstance(result, BaseException): raise result
+        for pid in tareas:
+            if pid == ganador: continue
+            # Su último envío no llegó a completarse (o no se guardó): no sirve como prefijo
+            ses.conv(pid).ultimo_envio = None
+            reg = registros[pid]
+            reg.cancelado = pid in cancelados
+            reg.error = not reg.cancelado and not ses.conv(pid).ultimo_ok
+            self.enrutador.observar(pid, self.metricas.registrar(reg))
+
+        if ses.conv(ganador).ultimo_ok: self._copiar_turno(ses, ganador, message, result, enviados=tareas)
+        return ganador, result, registros[ganador]
+
+    def _copiar_turno(self, ses: Sesion, origen: str, message: str, result: str, enviados=()):
+        """Registra el turno (pregunta + respuesta de `origen`) en el historial de
+        los demás proveedores de la sesión. `enviados`: los que ya tienen la pregunta."""
+        for pid in self.providers:
+            if pid == origen: continue
+            h = ses.conv(pid).historial
+            if pid not in enviados or not len(h) or h[-1].get("role") != "user":
+                h.append({"role": "user", "content": message})
+            h.append({"role": "assistant", "content": result})
+
+    # ── Proveedor automático ──────────────────────────────────────────────────
+
+    def _contexto_memoria(self, ses: Sesion, texto: str, embebiendo: Optional[asyncio.Future]) -> str:
+        """Recuerdos para el mensaje (solo escritorio). Usa el vector del mensaje si
+        ya está calculado; si no, no se espera: solo BM25."""
+        if self.contexto_memoria is None or ses.id != SESION_ESCRITORIO or not texto: return ""
+        vector = None
+        if embebiendo is not None and embebiendo.done() and not embebiendo.cancelled():
+            embedding = embebiendo.result()
+            if embedding is not None: vector = (self._modelo_embeddings(), embedding)
+        try:
+            return self.contexto_memoria(texto, vector)
+        except Exception as e:
+            log_info(f"Recuerdos no disponibles: {e}")
+            return ""
+
+    def _enrutar(self, ses: Sesion, message: str, system_prompt: str, contexto: str = "") -> str:
+        candidatos = self.estado_proveedores()
+        for pid, estado in candidatos.items():
+            # Ollama aún sin sondear: puede estar, compite con la penalización de frío
+            if not estado["sondeado_en"] and not estado["disponible"]: estado["disponible"] = True
+            conv = ses.conversaciones.get(pid)
+            modelo = getattr(self.providers.get(pid), "model", None)
+            nuevos = estimar_tokens(message, modelo) + estimar_tokens(contexto, modelo)
+            if conv is None or conv.ultimo_envio is None:
+                nuevos += estimar_tokens(system_prompt, modelo) + (conv.historial.total_tokens if conv else 0)
+            elif len(conv.historial):
+                # Prefijo ya procesado: solo lo añadido desde el último envío
+                nuevos += estimar_tokens(conv.historial[-1].get("content", ""), modelo)
+            estado["tokens_prompt"] = nuevos
+        return self.enrutador.elegir(message, candidatos)[0]
+
+    def decisiones_auto(self) -> list:
+        """Últimas decisiones del proveedor automático (para inspección)."""
+        return list(self.enrutador.decisiones)
+
+    def cancelar(self, sesion: str = SESION_ESCRITORIO):
+        """Corta la generación en curso de una sesión: la marca y, en el loop
+        del motor, cierra sus streams (no espera al siguiente fragmento)."""
+        ses = self.sesiones.buscar(sesion)
+        if ses is None: return
+        ses.cancelado_en = time.perf_counter()
+        # Solo los streams que existen ahora: si el usuario vuelve a enviar antes de
+        # que el motor ejecute el aborto, el ControlStream de la petición nueva no se toca
+        controles = []
+        for conv in list(ses.conversaciones.values()):
+            conv.cancelado = True
+            if conv.control is not None: controles.append(conv.control)
+        if controles and self.engine.activo: self.engine.call_soon(self._abortar_streams, controles)
+
+    @staticmethod
+    def _abortar_streams(controles: list):
+        for control in controles: control.abortar()
+
+    def rearmar(self, sesion: str = SESION_ESCRITORIO):
+        """Limpia las marcas de cancelación antes de una petición nueva."""
+        ses = self.sesiones.buscar(sesion)
+        if ses is None: return
+        ses.cancelado_en = None
+        for conv in list(ses.conversaciones.values()): conv.cancelado = False
+
+    def _medir_cancelacion(self, ses: Sesion) -> Optional[float]:
+        # Latencia (ms) desde que el usuario pulsa "detener" hasta que chat() devuelve
+        if ses.cancelado_en is None: return None
+        latencia = time.perf_counter() - ses.cancelado_en
+        ses.cancelado_en = None
+        self.latencias_cancelacion.append(latencia)
+        log_info(f"Generación cancelada en {latencia * 1000:.0f} ms")
+        return round(latencia * 1000, 1)
+
+    def stats_cancelacion(self) -> dict:
+        lat = sorted(self.latencias_cancelacion)
+        if not lat: return {"cancelaciones": 0}
+        return {"cancelaciones": len(lat), "ultima_ms": round(self.latencias_cancelacion[-1] * 1000, 1),
+                "media_ms": round(sum(lat) / len(lat) * 1000, 1), "max_ms": round(lat[-1] * 1000, 1)}
+
+    @staticmethod
+    def _medir_tokens(reg: RegistroPeticion, on_token: Callable = None) -> Callable:
+        def _on_token(token):
+            if token: reg.token()
+            if on_token: on_token(token)
+        return _on_token
+
+    # ── Métricas ──────────────────────────────────────────────────────────────
+
+    def resumen_metricas(self) -> Dict[str, dict]:
+        """Percentiles por proveedor/modelo (espera en cola, conexión, TTFT, tokens/s...)."""
+        return self.metricas.resumen()
+
+    def exportar_metricas(self, ruta: Optional[Path] = None) -> int:
+        """Vuelca los registros nuevos a paths.logs/metricas_ia.jsonl."""
+        ruta = ruta or Path(self._cfg("paths", "logs", "./logs")) / "metricas_ia.jsonl"
+        return self.metricas.exportar(ruta)
+
+    @staticmethod
+    def _reproducir(conv: Conversacion, message: str, respuesta: str, on_token: Callable = None) -> str:
+        """Acierto de caché: deja el historial igual que una respuesta real y
+        reenvía el texto por on_token en fragmentos, como si llegara en streaming."""
+        conv.historial.append({"role": "user", "content": message})
+        conv.historial.append({"role": "assistant", "content": respuesta})
+        conv.ultimo_ok = True
+        if on_token:
+            for fragmento in re.findall(r"\S+\s*|\s+", respuesta): on_token(fragmento)
+        return respuesta
+
+    # ── Resumen rodante en segundo plano ──────────────────────────────────────
+
+    def _marcar_activa(self, delta: int):
+        if self._inactivo is None: self._inactivo = asyncio.Event()
+        # Una petición interactiva expropia a los trabajos de fondo en curso
+        if delta > 0: self.trabajos.interrumpir()
+        self._activas += delta
+        if self._activas <= 0: self._activas = 0; self._inactivo.set()
+        else: self._inactivo.clear()
+
+    async def _esperar_inactivo(self):
+        if self._inactivo is None: self._marcar_activa(0)
+        await self._inactivo.wait()
+
+    def _programar_resumen(self, historial: HistorialConversacion):
+        if not historial.pendientes_resumen or historial.resumiendo: return
+        if not self._cfg("ia", "resumen_automatico", True): return
+        self.trabajos.encolar("resumen", historial, PRIORIDAD_RESUMEN, clave=("resumen", id(historial)))
+
+    async def _resumir_lote(self, historiales: list):
+        for historial in historiales: await self._resumir(historial)
+
+    async def _resumir(self, historial: HistorialConversacion):
+        """Comprime los turnos que salieron de la ventana en el resumen rodante,
+        usando el modelo local (lo lanza la cola de trabajos en las pausas)."""
+        historial.resumiendo = True
+        try:
+            while historial.pendientes_resumen:
+                pendientes = historial.tomar_pendientes()
+                previo = historial.resumen
+                texto = "\n".join(f"{m['role']}: {m['content']}" for m in pendientes)
+                if previo: texto = f"Resumen previo: {previo}\n\n{texto}"
+                try:
+                    ollama = self.providers["ollama"]
+                    resumen = await ollama.completar([{"role": "system", "content": PROMPT_RESUMEN},
+                                                      {"role": "user", "content": texto}])
+                except asyncio.CancelledError:
+                    # Expropiado: los turnos vuelven a quedar pendientes para la próxima pausa
+                    historial.pendientes_resumen = pendientes + historial.pendientes_resumen
+                    raise
+                except Exception:
+                    resumen = ""
+                historial.resumen = (resumen or _resumen_extractivo(previo, pendientes))[:MAX_RESUMEN]
+        finally:
+            historial.resumiendo = False
+
+    # ── Extracción de hechos y títulos (cola de trabajos) ─────────────────────
+
+    def extraer_hechos(self, mensaje_usuario: str, respuesta: str, al_extraer: Callable[[list], None]):
+        """Encola (desde cualquier hilo) la extracción de hechos sobre el usuario de
+        un intercambio. `al_extraer(lista)` se llama en el hilo del motor."""
+        if not mensaje_usuario or not (self._cfg("ia", "trabajos", {}) or {}).get("extraer_hechos", True): return
+        self.engine.call_soon(self.trabajos.encolar, "hechos", (mensaje_usuario, respuesta, al_extraer),
+                              PRIORIDAD_HECHOS)
+
+    def _modelo_fondo(self) -> Optional["OllamaProvider"]:
+        # El trabajo de fondo va solo al modelo local: no gasta cuota de la nube
+        ollama = self.providers.get("ollama")
+        return ollama if ollama is not None and ollama.is_available() else None
+
+    async def _extraer_hechos_lote(self, intercambios: list):
+        ollama = self._modelo_fondo()
+        if ollama is None: return
+        por_destino: Dict[Callable, list] = {}
+        for usuario, respuesta, al_extraer in intercambios:
+            por_destino.setdefault(al_extraer, []).append((usuario, respuesta))
+        for al_extraer, pares in por_destino.items():
+            texto = "\n\n".join(f"Usuario: {u[:600]}\nLune: {r[:600]}" for u, r in pares)
+            salida = await ollama.completar([{"role": "system", "content": PROMPT_HECHOS},
+                                             {"role": "user", "content": texto}])
+            hechos = _lista_json(salida)
+            if hechos: al_extraer(hechos)
+
+    async def _titular_lote(self, pendientes: list):
+        ollama = self._modelo_fondo()
+        if ollama is None: return
+        texto = "\n".join(f"{i}: {m[:200]} → {r[:200]}" for i, (_, m, r) in enumerate(pendientes, 1))
+        salida = await ollama.completar([{"role": "system", "content": PROMPT_TITULOS},
+                                         {"role": "user", "content": texto}])
+        for linea in salida.splitlines():
+            n, _, titulo = linea.partition(":")
+            if n.strip().isdigit() and 1 <= int(n) <= len(pendientes) and titulo.strip():
+                ses = pendientes[int(n) - 1][0]
+                if ses.titulo is None: ses.titulo = titulo.strip().strip('"`*')[:80]
+
+    # ── Embeddings de la memoria (vectores_memoria.py) ────────────────────────
+
+    LOTE_EMBEDDINGS = 64
+
+    def embeber_recuerdos(self, recuerdos: list, al_embeber: Callable):
+        """Encola (desde cualquier hilo) los embeddings de unos recuerdos, en lotes.
+        `al_embeber(ids, matriz, modelo)` se llama en el hilo del motor."""
+        if self.embedder is None or not recuerdos: return
+        for i in range(0, len(recuerdos), self.LOTE_EMBEDDINGS):
+            lote = recuerdos[i:i + self.LOTE_EMBEDDINGS]
+            self.engine.call_soon(self.trabajos.encolar, "embeddings",
+                                  ([r["id"] for r in lote], [r["contenido"] for r in lote], al_embeber),
+                                  PRIORIDAD_EMBEDDINGS)
+
+    async def _embeber_lote(self, pendientes: list):
+        for ids, textos, al_embeber in pendientes:
+            # Sin embedder (Ollama caído): se descartan; el próximo arranque los reencola
+            if time.monotonic() < self._embedder_pausa_hasta: return
+            try:
+                matriz = await self.embedder.embed(textos)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log_info(f"Embeddings de la memoria en pausa: {e}")
+                self._embedder_pausa_hasta = time.monotonic() + 60
+                return
+            al_embeber(ids, matriz, self._modelo_embeddings())
+
+    def estado_trabajos(self) -> dict:
+        return self.trabajos.stats()
+
+    def resumen_sesion(self, sesion: str = SESION_ESCRITORIO) -> str:
+        """Resumen rodante de la conversación (para MemoriaManager.cerrar_sesion)."""
+        ses = self.sesiones.buscar(sesion)
+        if ses is None: return ""
+        return " ".join(c.historial.resumen for c in ses.conversaciones.values() if c.historial.resumen)
+
+    def submit(self, coro: Coroutine) -> Future:
+        """Ejecuta una corutina en el motor persistente (thread-safe)."""
+        return self.engine.submit(coro)
+
+    def submit_chat(self, message: str, system_prompt: str = "", provider: Optional[str] = "openrouter",
+                    on_token: Callable = None, sesion: str = SESION_ESCRITORIO) -> Future:
+        return self.submit(self.chat(message, system_prompt, provider=provider, on_token=on_token,
+                                     encolado=time.perf_counter(), sesion=sesion))
+
+    def shutdown(self):
+        if self.cache_semantica is not None: self.cache_semantica.guardar()
+        self.enrutador.guardar()
+        self.sesiones.guardar_todas()
+        if self.config is not None and (self._cfg("ia", "metricas", {}) or {}).get("exportar", True):
+            self.exportar_metricas()
+        # Cerrar el pool de conexiones dentro del loop antes de detener el motor
+        if self.engine.activo:
+            try: self.engine.submit(_transporte.close()).result(timeout=2)
+            except Exception: pass
+        self.engine.shutdown()
+
+    def clear_history(self, provider: Optional[str] = None, sesion: str = SESION_ESCRITORIO):
+        """Vacía el historial de una sesión (de un proveedor o de todos); las demás no se tocan."""
+        ses = self.sesiones.buscar(sesion)
+        if ses is None: return
+        for pid, conv in ses.conversaciones.items():
+            if provider is None or pid == provider: conv.historial.limpiar()
 
-    def clear_history(self, provider: Optional[str] = None):
-        if provider and provider in self.providers: self.providers[provider].clear_history()
-        else:
-            for p in self.providers.values(): p.clear_history()
\ No newline at end of file
+    def cerrar_sesion(self, sesion: str):
+        """Olvida una conversación por completo (memoria y disco)."""
+        self.sesiones.eliminar(sesion)
\ No newline at end of file
@@ -1,58 +1,83 @@
 """
-ai_worker.py — Hilo que consulta a la IA (OpenRouter/Ollama) sin congelar la UI.
-Inyecta el system prompt, el contexto de memoria y las reglas de herramientas.
+ai_worker.py — Puente entre la UI y el motor de IA (OpenRouter/Ollama).
+Recibe el system prompt ya ensamblado (prompt_sistema.PromptSistema: personaje,
+reglas de herramientas y memoria, cacheados por segmento) y envía el trabajo al motor asíncrono persistente de AIManager (sin crear un
+hilo ni un event loop nuevos por mensaje). Los resultados vuelven como señales
+Qt, que se entregan en el hilo de la UI.
+
+token_received emite solo DELTAS (el texto nuevo), agrupados a una tasa máxima
+de refresco (fps): la UI añade cada lote al final en lugar de recibir el texto
+completo acumulado en cada token.
 """
 import asyncio
+import time
+from concurrent.futures import Future
+from typing import Optional
 
-from PyQt6.QtCore import QThread, pyqtSignal
+from PyQt6.QtCore import QObject, pyqtSignal
 
 from theme import PROVIDER_META
 from utils import log_error
 
 
-class AIWorker(QThread):
+class AIWorker(QObject):
     token_received = pyqtSignal(str)
     response_ready = pyqtSignal(str)
     error_occurred = pyqtSignal(str)
 
-    def __init__(self, ai_manager, message: str, provider_id: str, extra_context: str = ""):
+    def __init__(self, ai_manager, message: str, provider_id: str, system_prompt: Optional[str] = None,
+                 fps: int = 30, sesion: str = "escritorio"):
         super().__init__()
         self.ai_manager    = ai_manager
         self.message       = message
         self.provider_id   = provider_id
-        self.extra_context = extra_context
-        self._buffer       = ""
+        self.system_prompt = system_prompt
+        self.sesion        = sesion        # id de conversación en AIManager.sesiones
+        self._intervalo    = 1.0 / max(1, fps)
+        self._pendiente: list = []     # tokens aún no enviados a la UI
+        self._flush_timer  = None
+        self._future: Optional[Future] = None
+        self._encolado: Optional[float] = None   # para medir la espera en cola (metricas.py)
 
-    def run(self):
-        try:
-            sys_val = PROVIDER_META[self.provider_id]["system"]
-            system_prompt = sys_val() if callable(sys_val) else sys_val
-
-            if self.extra_context:
-                system_prompt = system_prompt + "\n\nCONTEXTO DE MEMORIA DEL USUARIO:\n" + self.extra_context
-
-            system_prompt += (
-                "\n\n=========================================\n"
-                "REGLAS DE HERRAMIENTAS DE ESCRITORIO:\n"
-                "Puedes ejecutar acciones en el PC del usuario si lo consideras necesario. "
-                "Para hacerlo, DEBES incluir uno de los siguientes comandos exactamente al FINAL de tu respuesta:\n\n"
-                "1. Para buscar en Google o Youtube:\n   ABRIR_BUSQUEDA:[términos]\n"
-                "2. Para abrir una URL:\n   ABRIR_URL:[url completa con https://]\n"
-                "3. Para lanzar una app:\n   TOOL:lanzar_app:[nombre_del_programa]\n"
-                "4. Para verificar info del PC:\n   TOOL:sistema_info:\n"
-            )
-
-            def on_token(token):
-                self._buffer += token
-                self.token_received.emit(self._buffer)
-
-            loop = asyncio.new_event_loop(); asyncio.set_event_loop(loop)
-            try:
-                response = loop.run_until_complete(
-                    self.ai_manager.chat(self.message, system_prompt, provider=self.provider_id, on_token=on_token)
-                )
-            finally: loop.close()
+    def start(self):
+        """Encola la petición en el motor y vuelve de inmediato."""
+        self._encolado = time.perf_counter()
+        self._future = self.ai_manager.submit(self._run())
+
+    def isRunning(self) -> bool:
+        return self._future is not None and not self._future.done()
+
+    def _build_system_prompt(self) -> str:
+        if self.system_prompt is not None: return self.system_prompt
+        # Sin prompt ensamblado: solo el del personaje (sin herramientas ni memoria)
+        sys_val = PROVIDER_META[self.provider_id]["system"]
+        return sys_val() if callable(sys_val) else sys_val
 
+    # ── Streaming por deltas con tope de fps ──────────────────────────────────
+    # on_token corre en el loop del motor: se acumulan los tokens y se programa
+    # un único flush por frame, que emite el lote unido como un solo delta.
+
+    def _on_token(self, token: str):
+        if not token: return
+        self._pendiente.append(token)
+        if self._flush_timer is None:
+            self._flush_timer = asyncio.get_running_loop().call_later(self._intervalo, self._flush)
+
+    def _flush(self):
+        if self._flush_timer is not None:
+            self._flush_timer.cancel(); self._flush_timer = None
+        if self._pendiente:
+            delta = "".join(self._pendiente); self._pendiente.clear()
+            self.token_received.emit(delta)
+
+    async def _run(self):
+        try:
+            system_prompt = self._build_system_prompt()
+            response = await self.ai_manager.chat(self.message, system_prompt, provider=self.provider_id,
+                                                  on_token=self._on_token, encolado=self._encolado,
+                                                  sesion=self.sesion)
+            self._flush()
             self.response_ready.emit(response or "Sin respuesta")
         except Exception as e:
+            self._flush()
             log_error(f"AIWorker error: {e}"); self.error_occurred.emit(str(e))
@@ -0,0 +1,467 @@
+"""
+almacen_memoria.py — Persistencia de MemoriaManager (SQLite o JSON).
+================================================================
+MemoriaManager trabaja sobre su dict en memoria (misma estructura que
+memoria.json) y, tras cada mutación, llama a almacen.guardar(datos, cambios)
+con la lista de lo que ha cambiado:
+
+    ("recuerdo", {...})        recuerdo nuevo
+    ("olvidar", id)            recuerdo borrado
+    ("olvidar_todo", None)     todos los recuerdos borrados
+    ("clave", "usuario")       sección de primer nivel modificada
+                               (usuario, datos_clave, resumen_sesion_anterior,
+                               estadisticas...)
+
+  • AlmacenSQLite (por defecto): memoria.db en modo WAL. Los recuerdos van en
+    su propia tabla indexada por id, fecha y tipo; el resto de secciones como
+    JSON en una tabla clave/valor. Cada volcado es una transacción con solo
+    las filas afectadas: contar un mensaje ya no reescribe miles de recuerdos,
+    y un corte a mitad de escritura no deja el archivo a medias.
+    La primera vez migra el memoria.json existente.
+  • AlmacenDiario: memoria.json como instantánea compactada más un diario
+    de solo añadir (memoria.diario, una línea JSON por cambio). Cada volcado
+    añade sus líneas y hace un único fsync: guardar un mensaje cuesta lo mismo
+    con 10 o con 10.000 recuerdos. Al cargar se reproduce el diario sobre la
+    instantánea; cuando pasa de `umbral_bytes` se compacta en un hilo aparte
+    a partir de los archivos, sin tocar el dict de la UI. Reproducir es
+    idempotente, así que un corte a mitad de compactación no duplica ni pierde
+    nada. Cada compactación reescribe memoria.json entero: los cambios que ve
+    el bot la adelantan, pero como mucho una vez cada `exportar_cada_s`, así
+    que el bot los ve con ese retraso y el coste por cambio sigue acotado.
+  • AlmacenJSON: el formato original, memoria.json completo en cada volcado.
+
+Escritura diferida: guardar() solo anota los cambios y marca el almacén como
+sucio. volcar() (MemoriaManager.volcar, que la app llama con un temporizador)
+los escribe de una vez cuando lleva `retardo_s` sin cambios nuevos o
+`max_retraso_s` sucio, así los dos o tres guardados de cada mensaje acaban en
+una sola escritura. cerrar() siempre vuelca. Con retardo_s=0 se escribe en
+cada guardado.
+
+memoria.json sigue siendo el archivo que comparte el bot de Telegram
+(telegram-bot-or/memoria.js): lee nombre, datos_clave, recuerdos y resumen, y
+escribe nombre y datos_clave. Por eso SQLite lo exporta (escritura atómica)
+cuando cambia algo que el bot ve —las estadísticas solas no— y, antes de
+exportar o al cargar, si el bot lo modificó se importan sus dos campos en
+lugar de pisarlos.
+"""
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Iterable, Optional, Tuple
+
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
+
+from utils import log_error, log_info
+
+Cambio = Tuple[str, object]
+
+# Secciones que no interesan al bot: cambiarlas no requiere exportar memoria.json
+SOLO_APP = {"estadisticas"}
+
+
+def reproducir(datos: dict, entradas: Iterable[dict]) -> int:
+    """Aplica entradas del diario sobre `datos` (idempotente). Devuelve cuántas."""
+    recuerdos = datos.setdefault("recuerdos", [])
+    indice = {r.get("id"): i for i, r in enumerate(recuerdos)}
+    n = 0
+    for e in entradas:
+        op = e.get("op")
+        if op == "recuerdo":
+            r = e["v"]
+            i = indice.get(r.get("id"))
+            if i is None:
+                indice[r.get("id")] = len(recuerdos); recuerdos.append(r)
+            else:
+                recuerdos[i] = r
+        elif op == "olvidar":
+            if e["v"] in indice:
+                recuerdos[:] = [r for r in recuerdos if r.get("id") != e["v"]]
+                indice = {r.get("id"): i for i, r in enumerate(recuerdos)}
+        elif op == "olvidar_todo":
+            recuerdos.clear(); indice.clear()
+        elif op == "clave":
+            datos[e["k"]] = e["v"]
+        n += 1
+    return n
+
+
+def leer_diario(ruta: Path) -> list:
+    """Entradas de un diario; una última línea a medias (corte) se ignora."""
+    try:
+        lineas = ruta.read_text("utf-8").splitlines()
+    except OSError:
+        return []
+    entradas = []
+    for linea in lineas:
+        try:
+            entradas.append(json.loads(linea))
+        except ValueError:
+            continue
+    return entradas
+
+
+def escribir_json_atomico(ruta: Path, datos: dict):
+    """Archivo temporal + replace: quien lea nunca ve un JSON a medio escribir."""
+    tmp = ruta.with_name(ruta.name + ".tmp")
+    tmp.write_text(json.dumps(datos, ensure_ascii=False, indent=2), encoding="utf-8")
+    os.replace(tmp, ruta)
+
+
+class AlmacenJSON:
+    """memoria.json completo en cada volcado (formato original)."""
+
+    def __init__(self, ruta_json: Path, retardo_s: float = 0.0, max_retraso_s: float = 10.0):
+        self.ruta_json = Path(ruta_json)
+        self.retardo_s = retardo_s
+        self.max_retraso_s = max_retraso_s
+        self._mtime_propio: Optional[float] = None   # mtime de nuestra última escritura
+        self._pendientes: list = []                  # cambios aún sin escribir
+        self._sucio_desde: Optional[float] = None
+        self._ultimo_cambio = 0.0
+        self.escrituras = 0                          # memoria.json escrito
+        self.solicitudes = 0                         # llamadas a guardar()
+        self.volcados = 0                            # veces que se escribió lo pendiente
+        self.importaciones = 0                       # cambios del bot traídos de memoria.json
+
+    def _leer_json(self) -> Optional[dict]:
+        try:
+            return json.loads(self.ruta_json.read_text("utf-8"))
+        except (OSError, ValueError):
+            return None
+
+    def _mtime_json(self) -> Optional[float]:
+        try:
+            return self.ruta_json.stat().st_mtime
+        except OSError:
+            return None
+
+    def cargar(self) -> Optional[dict]:
+        datos = self._leer_json()
+        self._mtime_propio = self._mtime_json()
+        return datos
+
+    def importar_bot(self, datos: dict) -> bool:
+        """Trae nombre y datos_clave si el bot de Telegram reescribió memoria.json
+        desde nuestra última escritura. Devuelve True si cambió algo."""
+        if not self._cambio_externo(): return False
+        externo = self._leer_json()
+        if not externo: return False
+        cambios = []
+        nombre = (externo.get("usuario") or {}).get("nombre")
+        if nombre and nombre != datos.setdefault("usuario", {}).get("nombre"):
+            datos["usuario"]["nombre"] = nombre
+            cambios.append(("clave", "usuario"))
+        if "datos_clave" in externo and externo["datos_clave"] != datos.get("datos_clave"):
+            datos["datos_clave"] = externo["datos_clave"]
+            cambios.append(("clave", "datos_clave"))
+        if cambios: self.importaciones += 1
+        self._anotar(cambios)
+        return bool(cambios)
+
+    def _cambio_externo(self) -> bool:
+        """True si memoria.json cambió desde nuestra última escritura (y lo da por visto)."""
+        mtime = self._mtime_json()
+        if mtime is None or mtime == self._mtime_propio: return False
+        self._mtime_propio = mtime
+        return True
+
+    # ── Escritura diferida ────────────────────────────────────────────────────
+
+    def _anotar(self, cambios: list):
+        for cambio in cambios:
+            # Una sección modificada dos veces se escribe una sola (con su valor final)
+            if cambio[0] != "clave" or cambio not in self._pendientes: self._pendientes.append(cambio)
+        if cambios and self._sucio_desde is None: self._sucio_desde = time.monotonic()
+
+    @property
+    def sucio(self) -> bool:
+        return bool(self._pendientes)
+
+    def guardar(self, datos: dict, cambios: Iterable[Cambio] = ()):
+        cambios = list(cambios)
+        if not cambios: return
+        self.solicitudes += 1
+        self._ultimo_cambio = time.monotonic()
+        self._anotar(cambios)
+        if self.retardo_s <= 0: self.volcar(datos)
+
+    def volcar(self, datos: dict, forzar: bool = True) -> bool:
+        """Escribe lo pendiente. Sin `forzar`, solo tras `retardo_s` sin cambios
+        (o `max_retraso_s` sucio). Devuelve True si escribió."""
+        if not self._pendientes: return False
+        if not forzar:
+            ahora = time.monotonic()
+            if (ahora - self._ultimo_cambio < self.retardo_s
+                    and ahora - self._sucio_desde < self.max_retraso_s): return False
+        self.importar_bot(datos)          # antes de escribir, para no pisar al bot
+        cambios, self._pendientes, self._sucio_desde = self._pendientes, [], None
+        self._aplicar(datos, cambios)
+        self.volcados += 1
+        return True
+
+    def _aplicar(self, datos: dict, cambios: list):
+        if not self._exportar(datos): self._reencolar(cambios)
+
+    def _reencolar(self, cambios: list):
+        # Escritura fallida: lo pendiente se reintenta en el próximo volcado
+        self._pendientes[:0] = cambios
+        if self._sucio_desde is None: self._sucio_desde = time.monotonic()
+
+    def _exportar(self, datos: dict) -> bool:
+        try:
+            escribir_json_atomico(self.ruta_json, datos)
+        except OSError as e:
+            log_error(f"No se pudo guardar {self.ruta_json.name}: {e}")
+            return False
+        self._mtime_propio = self._mtime_json()
+        self.escrituras += 1
+        return True
+
+    def cerrar(self, datos: dict):
+        if not self.volcar(datos): self._exportar(datos)
+
+    def stats(self) -> dict:
+        return {"motor": "json", "escrituras": self.escrituras, **self._stats_diferida()}
+
+    def _stats_diferida(self) -> dict:
+        return {"solicitudes": self.solicitudes, "volcados": self.volcados,
+                "evitadas": self.solicitudes - self.volcados, "pendientes": len(self._pendientes)}
+
+
+class AlmacenSQLite(AlmacenJSON):
+    """memoria.db (WAL) + exportación de memoria.json para el bot."""
+
+    ESQUEMA = """
+        CREATE TABLE IF NOT EXISTS recuerdos (
+            id        TEXT PRIMARY KEY,
+            fecha     TEXT NOT NULL,
+            tipo      TEXT NOT NULL,
+            contenido TEXT NOT NULL,
+            tags      TEXT NOT NULL DEFAULT '[]'
+        );
+        CREATE INDEX IF NOT EXISTS recuerdos_fecha ON recuerdos(fecha);
+        CREATE INDEX IF NOT EXISTS recuerdos_tipo ON recuerdos(tipo);
+        CREATE TABLE IF NOT EXISTS claves (
+            clave TEXT PRIMARY KEY,
+            valor TEXT NOT NULL
+        );
+    """
+
+    def __init__(self, ruta_db: Path, ruta_json: Path, retardo_s: float = 0.0, max_retraso_s: float = 10.0):
+        super().__init__(ruta_json, retardo_s, max_retraso_s)
+        self.ruta_db = Path(ruta_db)
+        self.transacciones = 0
+        self._db = sqlite3.connect(str(self.ruta_db))
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")   # en WAL sigue siendo consistente tras un corte
+        self._db.executescript(self.ESQUEMA)
+
+    def cargar(self) -> Optional[dict]:
+        if self._db.execute("SELECT 1 FROM claves LIMIT 1").fetchone() is None:
+            datos = super().cargar()
+            if datos: self._migrar(datos)
+            return datos
+        self._mtime_propio = self._db_clave("_mtime_json")
+        datos = {clave: json.loads(valor) for clave, valor in
+                 self._db.execute("SELECT clave, valor FROM claves WHERE clave NOT LIKE '\\_%' ESCAPE '\\'")}
+        datos["recuerdos"] = [
+            {"id": rid, "fecha": fecha, "tipo": tipo, "contenido": contenido, "tags": json.loads(tags)}
+            for rid, fecha, tipo, contenido, tags in
+            self._db.execute("SELECT id, fecha, tipo, contenido, tags FROM recuerdos ORDER BY rowid")]
+        return datos
+
+    def _migrar(self, datos: dict):
+        """Una sola vez: memoria.json → memoria.db."""
+        with self._db:
+            self._db.executemany("INSERT OR REPLACE INTO recuerdos VALUES (?, ?, ?, ?, ?)",
+                                 [self._fila(r) for r in datos.get("recuerdos", [])])
+            for clave in datos:
+                if clave != "recuerdos": self._fijar(clave, datos[clave])
+            self._fijar("_mtime_json", self._mtime_propio)
+        log_info(f"Memoria migrada de {self.ruta_json.name} a {self.ruta_db.name} "
+                 f"({len(datos.get('recuerdos', []))} recuerdos)")
+
+    @staticmethod
+    def _fila(r: dict) -> tuple:
+        return (r["id"], r.get("fecha", ""), r.get("tipo", "general"), r.get("contenido", ""),
+                json.dumps(r.get("tags", []), ensure_ascii=False))
+
+    def _fijar(self, clave: str, valor):
+        self._db.execute("INSERT OR REPLACE INTO claves VALUES (?, ?)",
+                         (clave, json.dumps(valor, ensure_ascii=False)))
+
+    def _db_clave(self, clave: str):
+        fila = self._db.execute("SELECT valor FROM claves WHERE clave = ?", (clave,)).fetchone()
+        return json.loads(fila[0]) if fila else None
+
+    def _aplicar(self, datos: dict, cambios: list):
+        try:
+            with self._db:
+                for tipo, valor in cambios:
+                    if tipo == "recuerdo":
+                        self._db.execute("INSERT OR REPLACE INTO recuerdos VALUES (?, ?, ?, ?, ?)", self._fila(valor))
+                    elif tipo == "olvidar":
+                        self._db.execute("DELETE FROM recuerdos WHERE id = ?", (valor,))
+                    elif tipo == "olvidar_todo":
+                        self._db.execute("DELETE FROM recuerdos")
+                    elif tipo == "clave":
+                        self._fijar(valor, datos.get(valor))
+            self.transacciones += 1
+        except sqlite3.Error as e:
+            log_error(f"No se pudo guardar la memoria en {self.ruta_db.name}: {e}")
+            self._reencolar(cambios)
+            return
+        if any(tipo != "clave" or valor not in SOLO_APP for tipo, valor in cambios):
+            self._exportar(datos)
+
+    def _exportar(self, datos: dict) -> bool:
+        if not super()._exportar(datos): return False
+        try:
+            with self._db: self._fijar("_mtime_json", self._mtime_propio)
+        except sqlite3.Error:
+            pass
+        return True
+
+    def cerrar(self, datos: dict):
+        self.volcar(datos)
+        self._exportar(datos)
+        self._db.close()
+
+    def stats(self) -> dict:
+        return {"motor": "sqlite", "transacciones": self.transacciones, "exportaciones": self.escrituras,
+                **self._stats_diferida()}
+
+
+class AlmacenDiario(AlmacenJSON):
+    """memoria.json (instantánea) + memoria.diario (cambios, solo añadir)."""
+
+    def __init__(self, ruta_json: Path, retardo_s: float = 0.0, max_retraso_s: float = 10.0,
+                 umbral_bytes: int = 256 * 1024, exportar_cada_s: float = 60.0):
+        super().__init__(ruta_json, retardo_s, max_retraso_s)
+        self.umbral_bytes = umbral_bytes
+        self.exportar_cada_s = exportar_cada_s
+        self._ultima_compactacion = time.monotonic()
+        self.ruta_diario = self.ruta_json.with_name(self.ruta_json.stem + ".diario")
+        self.ruta_rotado = self.ruta_json.with_name(self.ruta_json.stem + ".diario.1")   # en compactación
+        self._lock = threading.Lock()        # diario e instantánea, compartidos con el hilo de compactación
+        self._compactador: Optional[threading.Thread] = None
+        self._exportar_pendiente = False
+        self._bytes = 0
+        self.lineas = 0
+        self.fsyncs = 0
+        self.compactaciones = 0
+
+    def cargar(self) -> Optional[dict]:
+        datos = super().cargar()
+        entradas = leer_diario(self.ruta_rotado) + leer_diario(self.ruta_diario)
+        try: self._bytes = self.ruta_diario.stat().st_size
+        except OSError: self._bytes = 0
+        if not entradas: return datos
+        datos = datos or {}
+        reproducir(datos, entradas)
+        return datos
+
+    def _cambio_externo(self) -> bool:
+        # Bajo el lock: la compactación escribe la instantánea y anota su mtime de una vez
+        with self._lock:
+            return super()._cambio_externo()
+
+    @staticmethod
+    def _entrada(datos: dict, cambio: Cambio) -> dict:
+        tipo, valor = cambio
+        if tipo == "clave": return {"op": "clave", "k": valor, "v": datos.get(valor)}
+        return {"op": tipo, "v": valor}
+
+    def _aplicar(self, datos: dict, cambios: list):
+        bloque = "".join(json.dumps(self._entrada(datos, c), ensure_ascii=False) + "\n" for c in cambios)
+        try:
+            with self._lock, open(self.ruta_diario, "a", encoding="utf-8") as f:
+                f.write(bloque)
+                f.flush()
+                os.fsync(f.fileno())          # un fsync por volcado, no por cambio
+        except OSError as e:
+            log_error(f"No se pudo escribir {self.ruta_diario.name}: {e}")
+            self._reencolar(cambios)
+            return
+        self._bytes += len(bloque.encode("utf-8"))
+        self.lineas += len(cambios); self.fsyncs += 1
+        if any(tipo != "clave" or valor not in SOLO_APP for tipo, valor in cambios):
+            self._exportar_pendiente = True
+        self._quizas_compactar()
+
+    def volcar(self, datos: dict, forzar: bool = True) -> bool:
+        escrito = super().volcar(datos, forzar)
+        # Sin cambios nuevos, un cambio para el bot aún pendiente se exporta al cumplir el plazo
+        if not escrito and self._exportar_pendiente: self._quizas_compactar()
+        return escrito
+
+    # ── Compactación ──────────────────────────────────────────────────────────
+
+    def _quizas_compactar(self):
+        exportar = (self._exportar_pendiente
+                    and time.monotonic() - self._ultima_compactacion >= self.exportar_cada_s)
+        if self._bytes > self.umbral_bytes or exportar: self._compactar_en_fondo()
+
+    def _compactar_en_fondo(self):
+        if self._compactador is not None and self._compactador.is_alive(): return   # el próximo volcado reintenta
+        with self._lock:
+            if not self.ruta_rotado.exists():
+                # El diario pasa a .1 y los cambios siguientes van a uno nuevo
+                try:
+                    os.replace(self.ruta_diario, self.ruta_rotado)
+                except OSError:
+                    return
+                self._bytes = 0
+        self._exportar_pendiente = False
+        self._ultima_compactacion = time.monotonic()
+        self._compactador = threading.Thread(target=self._compactar, name="memoria-compactar", daemon=True)
+        self._compactador.start()
+
+    def _compactar(self):
+        """Instantánea + diario rotado → instantánea nueva (desde disco)."""
+        # La lectura y la reproducción van sin el lock (la UI solo añade al diario nuevo);
+        # la escritura y su mtime, juntas bajo el lock: importar_bot no debe ver la
+        # instantánea nueva antes de saber que es nuestra
+        try:
+            base = self._leer_json() or {}
+            reproducir(base, leer_diario(self.ruta_rotado))
+            with self._lock:
+                escribir_json_atomico(self.ruta_json, base)
+                self._mtime_propio = self._mtime_json()
+                self.ruta_rotado.unlink(missing_ok=True)
+            self.compactaciones += 1
+        except OSError as e:
+            log_error(f"No se pudo compactar {self.ruta_diario.name}: {e}")
+
+    def cerrar(self, datos: dict):
+        self.volcar(datos)
+        if self._compactador is not None: self._compactador.join()
+        # Al salir, la instantánea se escribe entera desde memoria y sobran los diarios
+        with self._lock:
+            if super()._exportar(datos):
+                for ruta in (self.ruta_rotado, self.ruta_diario): ruta.unlink(missing_ok=True)
+                self._bytes = 0
+                self.compactaciones += 1
+
+    def stats(self) -> dict:
+        return {"motor": "diario", "lineas": self.lineas, "bytes_diario": self._bytes, "fsyncs": self.fsyncs,
+                "compactaciones": self.compactaciones, **self._stats_diferida()}
+
+
+def crear(ruta_json: Path, motor: str = "sqlite", retardo_s: float = 0.0, max_retraso_s: float = 10.0,
+          umbral_diario_bytes: int = 256 * 1024, exportar_diario_s: float = 60.0) -> AlmacenJSON:
+    """Almacén según config (ia.memoria_motor): "sqlite", "diario" o "json".
+    Sin SQLite disponible se usa el diario."""
+    ruta_json = Path(ruta_json)
+    if motor == "sqlite" and sqlite3 is not None:
+        try:
+            return AlmacenSQLite(ruta_json.with_suffix(".db"), ruta_json, retardo_s, max_retraso_s)
+        except sqlite3.Error as e:
+            log_error(f"Memoria SQLite no disponible, se usa el diario: {e}")
+    if motor == "json": return AlmacenJSON(ruta_json, retardo_s, max_retraso_s)
+    return AlmacenDiario(ruta_json, retardo_s, max_retraso_s, umbral_diario_bytes, exportar_diario_s)
@@ -0,0 +1,157 @@
+"""
+cache_respuestas.py — Caché de respuestas exactas de la IA (LRU + TTL + disco).
+================================================================
+Si el mismo mensaje llega con el mismo proveedor, modelo, system prompt e
+historial recortado, se devuelve la respuesta guardada sin ir a la red.
+
+  • Memoria: OrderedDict con política LRU y tamaño máximo.
+  • TTL: cada entrada caduca tras `ttl` segundos.
+  • Disco (opcional): un .json por entrada en paths.cache/respuestas, para
+    que los aciertos sobrevivan a reinicios. Como mucho `max_disco`
+    archivos: al arrancar y cada BARRIDO_CADA escrituras se borran los
+    caducados y, si aún sobran, los más antiguos.
+  • Contadores de aciertos/fallos para ver si compensa.
+
+La clave combina proveedor, modelo, hash del system prompt y hash de los
+mensajes enviados, así que cualquier cambio de contexto produce otra clave.
+"""
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+
+def _sha1(texto: str) -> str:
+    return hashlib.sha1(texto.encode("utf-8")).hexdigest()
+
+
+class CacheRespuestas:
+    """Caché LRU con caducidad y capa de disco opcional."""
+
+    BARRIDO_CADA = 50
+
+    def __init__(self, max_entradas: int = 256, ttl: float = 86400,
+                 directorio: Optional[Path] = None, max_disco: int = 2000):
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        self.directorio = Path(directorio) if directorio else None
+        self.max_disco = max_disco
+        self._memoria: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self.aciertos = 0
+        self.aciertos_disco = 0
+        self.fallos = 0
+        self._escrituras = 0
+        if self.directorio:
+            self.directorio.mkdir(parents=True, exist_ok=True)
+            self._barrer_disco()
+
+    # ── Clave ─────────────────────────────────────────────────────────────────
+
+    @staticmethod
+    def clave(proveedor: str, modelo: str, system_prompt: str,
+              mensajes: List[Dict], mensaje: str) -> str:
+        historial = json.dumps(mensajes, ensure_ascii=False, separators=(",", ":"))
+        return _sha1("\x1f".join((proveedor, modelo or "", _sha1(system_prompt or ""),
+                                  _sha1(historial), mensaje.strip())))
+
+    # ── Lectura / escritura ───────────────────────────────────────────────────
+
+    def get(self, clave: str) -> Optional[str]:
+        ahora = time.time()
+        entrada = self._memoria.get(clave)
+        if entrada is not None:
+            expira, respuesta = entrada
+            if expira > ahora:
+                self._memoria.move_to_end(clave)
+                self.aciertos += 1
+                return respuesta
+            del self._memoria[clave]
+
+        respuesta = self._leer_disco(clave, ahora)
+        if respuesta is not None:
+            self._guardar_memoria(clave, respuesta, ahora)
+            self.aciertos += 1; self.aciertos_disco += 1
+            return respuesta
+
+        self.fallos += 1
+        return None
+
+    def put(self, clave: str, respuesta: str):
+        if not respuesta: return
+        ahora = time.time()
+        self._guardar_memoria(clave, respuesta, ahora)
+        self._escribir_disco(clave, respuesta, ahora + self.ttl)
+
+    def _guardar_memoria(self, clave: str, respuesta: str, ahora: float):
+        self._memoria[clave] = (ahora + self.ttl, respuesta)
+        self._memoria.move_to_end(clave)
+        while len(self._memoria) > self.max_entradas:
+            self._memoria.popitem(last=False)
+
+    def limpiar(self):
+        self._memoria.clear()
+        if self.directorio:
+            for f in self.directorio.glob("*/*.json"):
+                try: f.unlink()
+                except OSError: pass
+
+    def stats(self) -> dict:
+        total = self.aciertos + self.fallos
+        return {
+            "entradas": len(self._memoria),
+            "aciertos": self.aciertos,
+            "aciertos_disco": self.aciertos_disco,
+            "fallos": self.fallos,
+            "tasa_aciertos": round(self.aciertos / total, 3) if total else 0.0,
+        }
+
+    # ── Capa de disco ─────────────────────────────────────────────────────────
+
+    def _ruta(self, clave: str) -> Path:
+        return self.directorio / clave[:2] / f"{clave}.json"
+
+    def _leer_disco(self, clave: str, ahora: float) -> Optional[str]:
+        if not self.directorio: return None
+        ruta = self._ruta(clave)
+        try:
+            data = json.loads(ruta.read_text("utf-8"))
+        except (OSError, ValueError):
+            return None
+        if data.get("expira", 0) <= ahora:
+            try: ruta.unlink()
+            except OSError: pass
+            return None
+        return data.get("respuesta")
+
+    def _escribir_disco(self, clave: str, respuesta: str, expira: float):
+        if not self.directorio: return
+        ruta = self._ruta(clave)
+        try:
+            ruta.parent.mkdir(exist_ok=True)
+            ruta.write_text(json.dumps({"expira": expira, "respuesta": respuesta}, ensure_ascii=False), encoding="utf-8")
+        except OSError:
+            pass
+        self._escrituras += 1
+        if self._escrituras >= self.BARRIDO_CADA: self._barrer_disco()
+
+    def _barrer_disco(self):
+        """Borra los archivos caducados (por fecha de escritura + ttl) y, si siguen
+        pasando de max_disco, los más antiguos."""
+        self._escrituras = 0
+        ahora = time.time()
+        vivos = []
+        for ruta in self.directorio.glob("*/*.json"):
+            try:
+                escrito = os.stat(ruta).st_mtime
+                if escrito + self.ttl <= ahora: ruta.unlink()
+                else: vivos.append((escrito, ruta))
+            except OSError:
+                pass
+        if len(vivos) <= self.max_disco: return
+        vivos.sort()
+        for _, ruta in vivos[:len(vivos) - self.max_disco]:
+            try: ruta.unlink()
+            except OSError: pass
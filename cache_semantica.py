@@ -0,0 +1,176 @@
+"""
+cache_semantica.py — Caché semántica de respuestas (parafraseos) con NumPy.
+================================================================
+Complementa a cache_respuestas.py: si el usuario pregunta lo mismo con otras
+palabras ("¿qué es un SSD?" / "explícame qué es un disco SSD") se reutiliza la
+respuesta guardada cuando la similitud coseno supera un umbral.
+
+  • Vectores normalizados en una única matriz float32 (n, dim) preasignada:
+    la búsqueda es un solo producto matriz·vector, milisegundos con decenas
+    de miles de entradas.
+  • Cada entrada pertenece a un "ámbito" (proveedor, modelo, embedder, una
+    huella del system prompt y si abre la conversación o la sigue) y solo
+    puede acertar dentro de él. Los ámbitos sin entradas vivas se descartan
+    al guardar.
+  • TTL por entrada y desalojo LRU (la de uso más antiguo) al llenarse.
+  • Persistencia en paths.cache/semantica: vectores.npy + entradas.json, que
+    anota el modelo de embeddings y la dimensión: si no coinciden con los
+    actuales, lo guardado se ignora (vectores de otro espacio no se comparan).
+
+Requiere numpy (si falta, AIManager no crea la caché).
+"""
+import json
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class CacheSemantica:
+    """Caché de respuestas indexada por embeddings del mensaje del usuario."""
+
+    def __init__(self, umbral: float = 0.95, max_entradas: int = 20000, ttl: float = 7 * 86400,
+                 directorio: Optional[Path] = None, modelo: str = ""):
+        self.umbral = umbral
+        self.modelo = modelo                       # id del embedder que produjo los vectores
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        self.directorio = Path(directorio) if directorio else None
+        self._vectores = None                      # (capacidad, dim) float32
+        self._creado = np.zeros(0, dtype=np.float64)
+        self._uso = np.zeros(0, dtype=np.float64)
+        self._ambito = np.zeros(0, dtype=np.int32)
+        self._respuestas: List[str] = []
+        self._ambitos: Dict[str, int] = {}
+        self.n = 0
+        self.aciertos = 0
+        self.fallos = 0
+        self._sin_guardar = 0
+        if self.directorio:
+            self._cargar()
+
+    # ── Búsqueda ──────────────────────────────────────────────────────────────
+
+    def _id_ambito(self, ambito: str) -> int:
+        return self._ambitos.setdefault(ambito, len(self._ambitos))
+
+    def buscar(self, vector, ambito: str) -> Optional[Tuple[str, float]]:
+        """Devuelve (respuesta, similitud) si hay una entrada por encima del umbral."""
+        vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+        if self.n == 0 or ambito not in self._ambitos or vector.shape[0] != self._vectores.shape[1]:
+            self.fallos += 1
+            return None
+        ahora = time.time()
+        sims = self._vectores[:self.n] @ vector
+        invalidas = (self._ambito[:self.n] != self._ambitos[ambito]) | (self._creado[:self.n] + self.ttl <= ahora)
+        sims[invalidas] = -1.0
+        i = int(np.argmax(sims))
+        if sims[i] < self.umbral:
+            self.fallos += 1
+            return None
+        self._uso[i] = ahora
+        self.aciertos += 1
+        return self._respuestas[i], float(sims[i])
+
+    # ── Inserción / desalojo ──────────────────────────────────────────────────
+
+    def agregar(self, vector, respuesta: str, ambito: str):
+        if not respuesta: return
+        vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+        if self._vectores is None or self._vectores.shape[1] != vector.shape[0]:
+            self._reiniciar(vector.shape[0])
+        ahora = time.time()
+        i = self._hueco(ahora)
+        self._vectores[i] = vector
+        self._creado[i] = ahora; self._uso[i] = ahora
+        self._ambito[i] = self._id_ambito(ambito)
+        if i == len(self._respuestas): self._respuestas.append(respuesta)
+        else: self._respuestas[i] = respuesta
+        self._sin_guardar += 1
+        if self._sin_guardar >= 50: self.guardar()
+
+    def _hueco(self, ahora: float) -> int:
+        if self.n < self.max_entradas:
+            if self.n == self._vectores.shape[0]: self._crecer()
+            self.n += 1
+            return self.n - 1
+        # Llena: primero una caducada; si no hay, la de uso más antiguo (LRU)
+        caducadas = np.flatnonzero(self._creado[:self.n] + self.ttl <= ahora)
+        return int(caducadas[0]) if caducadas.size else int(np.argmin(self._uso[:self.n]))
+
+    def _crecer(self):
+        capacidad = min(self.max_entradas, max(256, self._vectores.shape[0] * 2))
+        extra = capacidad - self._vectores.shape[0]
+        self._vectores = np.vstack([self._vectores, np.zeros((extra, self._vectores.shape[1]), dtype=np.float32)])
+        self._creado = np.concatenate([self._creado, np.zeros(extra)])
+        self._uso = np.concatenate([self._uso, np.zeros(extra)])
+        self._ambito = np.concatenate([self._ambito, np.zeros(extra, dtype=np.int32)])
+
+    def _reiniciar(self, dim: int):
+        # Cambió el modelo de embeddings (otra dimensión): lo anterior no sirve.
+        self._vectores = np.zeros((0, dim), dtype=np.float32)
+        self._creado = np.zeros(0); self._uso = np.zeros(0); self._ambito = np.zeros(0, dtype=np.int32)
+        self._respuestas = []; self._ambitos = {}; self.n = 0
+
+    def limpiar(self):
+        if self._vectores is not None: self._reiniciar(self._vectores.shape[1])
+        self.guardar()
+
+    def stats(self) -> dict:
+        total = self.aciertos + self.fallos
+        return {"entradas": self.n, "aciertos": self.aciertos, "fallos": self.fallos,
+                "tasa_aciertos": round(self.aciertos / total, 3) if total else 0.0}
+
+    # ── Persistencia ──────────────────────────────────────────────────────────
+
+    def _podar_ambitos(self):
+        """Quita los ámbitos que ya no usa ninguna entrada y renumera los demás."""
+        usados = np.unique(self._ambito[:self.n])
+        if len(usados) == len(self._ambitos): return
+        nuevo_id = np.full(max(len(self._ambitos), 1), -1, dtype=np.int32)
+        nuevo_id[usados] = np.arange(len(usados), dtype=np.int32)
+        self._ambito[:self.n] = nuevo_id[self._ambito[:self.n]]
+        self._ambitos = {a: int(nuevo_id[i]) for a, i in self._ambitos.items() if nuevo_id[i] >= 0}
+
+    def guardar(self):
+        self._sin_guardar = 0
+        if self._vectores is None: return
+        self._podar_ambitos()
+        if not self.directorio: return
+        try:
+            self.directorio.mkdir(parents=True, exist_ok=True)
+            np.save(self.directorio / "vectores.npy", self._vectores[:self.n])
+            meta = {
+                "modelo": self.modelo, "dim": int(self._vectores.shape[1]),
+                "creado": self._creado[:self.n].tolist(), "uso": self._uso[:self.n].tolist(),
+                "ambito": self._ambito[:self.n].tolist(), "ambitos": self._ambitos,
+                "respuestas": self._respuestas[:self.n],
+            }
+            tmp = self.directorio / "entradas.json.tmp"
+            tmp.write_text(json.dumps(meta, ensure_ascii=False), encoding="utf-8")
+            tmp.replace(self.directorio / "entradas.json")
+        except OSError:
+            pass
+
+    def _cargar(self):
+        try:
+            vectores = np.load(self.directorio / "vectores.npy")
+            meta = json.loads((self.directorio / "entradas.json").read_text("utf-8"))
+        except (OSError, ValueError):
+            return
+        n = min(len(vectores), len(meta.get("respuestas", [])), self.max_entradas)
+        if n == 0 or vectores.ndim != 2: return
+        # Otro modelo de embeddings u otra dimensión: se empieza de cero
+        if meta.get("modelo", "") != self.modelo or meta.get("dim", vectores.shape[1]) != vectores.shape[1]: return
+        self._vectores = np.ascontiguousarray(vectores[:n], dtype=np.float32)
+        self._creado = np.asarray(meta["creado"][:n], dtype=np.float64)
+        self._uso = np.asarray(meta["uso"][:n], dtype=np.float64)
+        self._ambito = np.asarray(meta["ambito"][:n], dtype=np.int32)
+        self._ambitos = dict(meta.get("ambitos", {}))
+        self._respuestas = list(meta["respuestas"][:n])
+        self.n = n
+        self._podar_ambitos()
@@ -0,0 +1,130 @@
+"""
+carga.py — Prueba de carga de AIManager contra el servidor simulado.
+================================================================
+Lanza N sesiones concurrentes (cada una con su historial, como varios
+usuarios de Telegram a la vez) que envían M mensajes seguidos a
+AIManager.chat, y resume el rendimiento con las métricas de metricas.py:
+
+  • rendimiento global: peticiones/s y tokens/s sobre el tiempo de pared
+  • por petición: p50/p90/p99 de espera en cola, conexión, TTFT, duración
+    y tokens/s; errores y cortes inyectados por el servidor
+
+Por defecto arranca servidor_simulado.py en un hilo con las opciones dadas;
+con --url se usa un servidor ya levantado (otro simulado, u Ollama real).
+Las cachés de respuestas y los resúmenes se desactivan para que cada
+petición llegue al servidor.
+
+Uso:
+    python carga.py --sesiones 20 --mensajes 5 --proveedor ollama --tokens-s 80
+    python carga.py --proveedor openrouter --prob-error 0.05 --jsonl logs/carga.jsonl
+"""
+import argparse
+import asyncio
+import copy
+import tempfile
+import time
+from pathlib import Path
+from typing import Optional
+
+from ai_manager import AIManager, OpenRouterProvider
+from config import Config
+from metricas import CAMPOS_PERCENTIL
+import servidor_simulado
+
+
+class ConfigCarga:
+    """Configuración en memoria (DEFAULT_CONFIG + ajustes de la prueba), sin tocar config.json."""
+
+    def __init__(self, sesiones: int, directorio: str):
+        self.config = copy.deepcopy(Config.DEFAULT_CONFIG)
+        ia = self.config["ia"]
+        ia["cache_respuestas"]["activa"] = False
+        ia["cache_semantica"]["activa"] = False
+        ia["resumen_automatico"] = False
+        ia["ollama_precalentar_inicio"] = False
+        ia["metricas"]["max_registros"] = 100_000
+        ia["sesiones"]["max_vivas"] = sesiones + 1
+        self.config["paths"]["cache"] = directorio
+        self.config["paths"]["logs"] = directorio
+
+    def get(self, seccion: str, clave: str, default=None):
+        return self.config.get(seccion, {}).get(clave, default)
+
+
+def preparar(manager: AIManager, proveedor: str, url: str, modelo: str = "simulado"):
+    """Apunta el proveedor elegido al servidor de la prueba."""
+    if proveedor == "ollama":
+        p = manager.providers["ollama"]
+        p.url, p.model = url, modelo
+        p._marcar_cargado()
+    else:
+        p = manager.providers.get("openrouter")
+        if p is None: p = manager.providers["openrouter"] = OpenRouterProvider("simulada", modelo)
+        p.api_key, p.model = p.api_key or "simulada", modelo
+        p.BASE_URL = url.rstrip("/") + "/api/v1/chat/completions"
+
+
+async def _sesion(manager: AIManager, proveedor: str, i: int, mensajes: int):
+    for j in range(mensajes):
+        await manager.chat(f"Mensaje {j + 1} de la sesión {i}: ¿qué tal el día?", "Eres Lune, una asistente.",
+                           provider=proveedor, sesion=f"carga:{i}", encolado=time.perf_counter())
+
+
+async def _carga(manager: AIManager, proveedor: str, sesiones: int, mensajes: int) -> float:
+    inicio = time.perf_counter()
+    await asyncio.gather(*(_sesion(manager, proveedor, i, mensajes) for i in range(sesiones)))
+    return time.perf_counter() - inicio
+
+
+def ejecutar(proveedor: str = "ollama", sesiones: int = 10, mensajes: int = 5,
+             opciones: Optional[servidor_simulado.OpcionesSimulador] = None, url: Optional[str] = None,
+             jsonl: Optional[str] = None) -> dict:
+    """Ejecuta la prueba y devuelve el informe (ver imprimir)."""
+    servidor = None
+    if url is None: servidor, url = servidor_simulado.iniciar(opciones)
+    with tempfile.TemporaryDirectory() as directorio:
+        manager = AIManager(ConfigCarga(sesiones, directorio))
+        try:
+            preparar(manager, proveedor, url)
+            duracion = manager.submit(_carga(manager, proveedor, sesiones, mensajes)).result()
+            registros = [r for r in manager.metricas.registros() if r["proveedor"] == proveedor]
+            resumen = next(iter(manager.resumen_metricas().values()), {})
+            if jsonl: manager.exportar_metricas(Path(jsonl))
+        finally:
+            manager.shutdown()
+            if servidor is not None: servidor.shutdown()
+
+    tokens = sum(r["tokens"] for r in registros)
+    return {
+        "proveedor": proveedor, "url": url, "sesiones": sesiones, "mensajes": mensajes,
+        "duracion_s": round(duracion, 3), "peticiones": len(registros),
+        "errores": sum(1 for r in registros if r["error"]),
+        "peticiones_s": round(len(registros) / duracion, 2) if duracion else None,
+        "tokens": tokens, "tokens_s": round(tokens / duracion, 1) if duracion else None,
+        "percentiles": {c: resumen[c] for c in CAMPOS_PERCENTIL if c in resumen},
+        "servidor": servidor.stats() if servidor is not None else None,
+    }
+
+
+def imprimir(informe: dict):
+    print(f"{informe['proveedor']} · {informe['sesiones']} sesiones × {informe['mensajes']} mensajes "
+          f"→ {informe['peticiones']} peticiones en {informe['duracion_s']} s")
+    print(f"  rendimiento: {informe['peticiones_s']} peticiones/s · {informe['tokens_s']} tokens/s "
+          f"· errores: {informe['errores']}")
+    if informe["servidor"]: print(f"  servidor: {informe['servidor']}")
+    print(f"  {'métrica':<16}{'p50':>10}{'p90':>10}{'p99':>10}")
+    for campo, p in informe["percentiles"].items():
+        print(f"  {campo:<16}{p['p50']:>10}{p['p90']:>10}{p['p99']:>10}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prueba de carga de AIManager")
+    parser.add_argument("--proveedor", choices=["ollama", "openrouter"], default="ollama")
+    parser.add_argument("--sesiones", type=int, default=10, help="sesiones concurrentes")
+    parser.add_argument("--mensajes", type=int, default=5, help="mensajes por sesión, uno tras otro")
+    parser.add_argument("--url", default=None, help="servidor ya levantado (por defecto, uno simulado)")
+    parser.add_argument("--jsonl", default=None, help="exportar los registros por petición")
+    servidor_simulado.agregar_opciones_cli(parser)
+    args = parser.parse_args()
+    imprimir(ejecutar(args.proveedor, args.sesiones, args.mensajes,
+                      servidor_simulado.opciones_desde_args(args), args.url, args.jsonl))
@@ -1,12 +1,16 @@
 """
 chat_widgets.py — Widgets de la conversación: pestañas de proveedor,
 burbujas de mensaje e indicador de "escribiendo…".
+
+La burbuja de una respuesta en streaming usa un QTextEdit de solo lectura:
+cada lote se inserta al final con un QTextCursor y Qt solo vuelve a maquetar
+el último párrafo, en lugar de todo el texto acumulado en cada frame.
 """
 from datetime import datetime
 
-from PyQt6.QtWidgets import QFrame, QVBoxLayout, QHBoxLayout, QLabel
+from PyQt6.QtWidgets import QFrame, QVBoxLayout, QHBoxLayout, QLabel, QTextEdit, QSizePolicy
 from PyQt6.QtCore import Qt, QTimer, pyqtSignal
-from PyQt6.QtGui import QFont
+from PyQt6.QtGui import QFont, QTextCursor
 
 from theme import COLORS, PROVIDER_META, FONT_DISPLAY, FONT_BODY, FONT_MONO
 from icons import icon_pixmap
@@ -45,13 +49,37 @@ class ProviderTab(QFrame):
 
     def set_active(self, active):
         self._active = active; self._apply_style(active)
+    def set_estado(self, texto=None):
+        # Sustituye la descripción por un estado en vivo (None = descripción original)
+        self.desc_lbl.setText(texto or self.meta["desc"])
     def mousePressEvent(self, event):
         self.clicked.emit(self.provider_id)
 
 
+class TextoStreaming(QTextEdit):
+    """Texto de solo lectura que crece por el final; su altura sigue al documento."""
+    def __init__(self, parent=None):
+        super().__init__(parent); self._cola = 0   # caracteres del cursor "▋" al final
+        self.setReadOnly(True); self.setFrameShape(QFrame.Shape.NoFrame); self.setAcceptRichText(False)
+        self.setVerticalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff); self.setHorizontalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
+        self.setSizePolicy(QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Fixed)
+        self.document().setDocumentMargin(0)
+        self.document().documentLayout().documentSizeChanged.connect(lambda size: self.setFixedHeight(int(size.height()) + 2))
+
+    def agregar(self, delta, cursor=""):
+        # Quita el cursor anterior e inserta delta + cursor al final: O(delta), no O(texto)
+        c = QTextCursor(self.document()); c.movePosition(QTextCursor.MoveOperation.End)
+        if self._cola: c.movePosition(QTextCursor.MoveOperation.Left, QTextCursor.MoveMode.KeepAnchor, self._cola)
+        c.insertText(delta + cursor); self._cola = len(cursor)
+
+    def fijar(self, texto):
+        self.setPlainText(texto); self._cola = 0
+
+
 class MessageBubble(QFrame):
-    def __init__(self, text, is_user, provider_id="openrouter", parent=None):
-        super().__init__(parent); self.is_user = is_user; self.provider_id = provider_id; self._build(text)
+    def __init__(self, text, is_user, provider_id="openrouter", parent=None, streaming=False):
+        super().__init__(parent); self.is_user = is_user; self.provider_id = provider_id; self._texto = text
+        self.streaming = streaming and not is_user; self._build(text)
 
     def _build(self, text):
         outer = QHBoxLayout(self); outer.setContentsMargins(12, 4, 12, 4); outer.setSpacing(10)
@@ -72,13 +100,23 @@ class MessageBubble(QFrame):
             bubble.setStyleSheet(f"QFrame{{background:{COLORS['bot_bubble']};border-radius:3px;border:1px solid {COLORS['border']};border-left:3px solid {color};}}")
             bl = QVBoxLayout(bubble); bl.setContentsMargins(15,11,15,11); bl.setSpacing(4)
             sender = QLabel(meta["label"]); sender.setFont(QFont(FONT_MONO, 8, QFont.Weight.Bold)); sender.setStyleSheet(f"color:{color};background:transparent;letter-spacing:1px;"); bl.addWidget(sender)
-            self.text_lbl = QLabel(text); self.text_lbl.setWordWrap(True); self.text_lbl.setTextInteractionFlags(Qt.TextInteractionFlag.TextSelectableByMouse)
-            self.text_lbl.setFont(QFont(FONT_BODY, 11)); self.text_lbl.setStyleSheet(f"color:{COLORS['text']};background:transparent;"); self.text_lbl.setMaximumWidth(520); bl.addWidget(self.text_lbl)
+            if self.streaming: self.text_lbl = TextoStreaming(); self.text_lbl.fijar(text)
+            else: self.text_lbl = QLabel(text); self.text_lbl.setWordWrap(True); self.text_lbl.setTextInteractionFlags(Qt.TextInteractionFlag.TextSelectableByMouse)
+            self.text_lbl.setFont(QFont(FONT_BODY, 11)); self.text_lbl.setStyleSheet(f"color:{COLORS['text']};background:transparent;border:none;"); self.text_lbl.setMaximumWidth(520); bl.addWidget(self.text_lbl)
             ts = QLabel(datetime.now().strftime("%H:%M")); ts.setFont(QFont(FONT_MONO, 8)); ts.setStyleSheet(f"color:{COLORS['text_dim']};background:transparent;"); bl.addWidget(ts)
             outer.addWidget(bubble); outer.addStretch()
 
     def update_text(self, text):
-        self.text_lbl.setText(text)
+        self._texto = text
+        if self.streaming: self.text_lbl.fijar(text)
+        else: self.text_lbl.setText(text)
+
+    def append_text(self, delta, cursor=""):
+        """Streaming: añade un delta al final (se llama como mucho una vez por frame).
+        En una burbuja creada con streaming=True solo se inserta el delta."""
+        self._texto += delta
+        if self.streaming: self.text_lbl.agregar(delta, cursor)
+        else: self.text_lbl.setText(self._texto + cursor)
 
 
 class TypingIndicator(QFrame):
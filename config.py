@@ -10,6 +10,7 @@ class Config:
             "theme": "dark", "language": "es", "window_width": 1100,
             "window_height": 760, "always_on_top": False,
             "start_minimized": False, "show_tray_icon": True, "font_size": 13,
+            "streaming_fps": 30,     # refrescos/seg. máx. de la burbuja al hacer streaming
         },
         "behavior": {
             "auto_respond": False, "show_typing_indicator": True,
@@ -30,6 +31,76 @@ class Config:
             "streaming_tokens": True,            # mostrar respuesta letra por letra
             "minimizar_a_bandeja": True,         # al cerrar, ocultar en la bandeja del sistema
         },
+        # Motor de IA: límites y ajustes de rendimiento de las peticiones.
+        "ia": {
+            # Presupuesto aproximado de tokens del historial que se envía en cada turno
+            "historial_tokens": {"ollama": 2048, "openrouter": 6000},
+            "historial_tokens_modelo": {},       # override por modelo, p.ej. {"llama3": 4096}
+            # Conteo exacto de tokens por familia de modelo: {familia: ruta a tokenizer.json}
+            # (requiere `tokenizers`); sin entrada se usa tiktoken (GPT) o la heurística
+            "tokenizadores": {},
+            # Tokens máximos del bloque de memoria personal en el system prompt
+            "memoria_contexto_tokens": 600,
+            # Recuerdos en el prompt: los más relevantes para el mensaje (BM25 + recencia)
+            # y unos pocos recientes, siempre dentro de memoria_contexto_tokens
+            "memoria_recuerdos": {"relevantes": 8, "recientes": 3},
+            # Almacén de la memoria personal: "sqlite" (memoria.db en WAL, exporta
+            # memoria.json para el bot de Telegram), "diario" (memoria.json + diario de
+            # cambios compactado en segundo plano) o "json" (solo memoria.json)
+            "memoria_motor": "sqlite",
+            # Escritura diferida de la memoria: se vuelca tras retardo_s sin cambios
+            # (o como mucho max_retraso_s después del primero) y siempre al cerrar;
+            # el diario se compacta al pasar de umbral_diario_kb, o antes si hay cambios que ve
+            # el bot de Telegram, pero como mucho una vez cada exportar_diario_s
+            "memoria_escritura": {"retardo_s": 2.0, "max_retraso_s": 10.0, "umbral_diario_kb": 256,
+                                  "exportar_diario_s": 60},
+            # Búsqueda semántica de recuerdos: embeddings (mismo embedder que cache_semantica)
+            # en memoria_vectores.npy mapeado desde disco; "float16" ocupa la mitad pero
+            # busca más despacio. Se usa el vector del mensaje si ya está calculado en el
+            # motor (el de la caché semántica); si no, esos recuerdos salen solo por BM25.
+            "memoria_vectores": {"activa": True, "dtype": "float32", "min_similitud": 0.5},
+            "resumen_automatico": True,          # resumir en 2º plano (Ollama) lo que sale de la ventana
+            # Caché de respuestas idénticas (mismo prompt + historial): evita repetir la petición;
+            # en disco guarda como mucho max_disco respuestas (se barren caducadas y antiguas)
+            "cache_respuestas": {"activa": True, "max_entradas": 256, "ttl_segundos": 86400, "disco": True,
+                                 "max_disco": 2000},
+            # Caché semántica: reutiliza respuestas a preguntas parecidas (embeddings + numpy)
+            "cache_semantica": {
+                "activa": True, "umbral": 0.95, "max_entradas": 20000, "ttl_segundos": 604800,
+                "embedder": "ollama",             # "ollama" (/api/embed) o "hash" (local, sin modelo)
+                "modelo_embeddings": "nomic-embed-text", "min_caracteres": 12,
+            },
+            # Modo carrera: si el proveedor elegido no da su primer token en hedge_ms,
+            # se lanza también el otro y se queda la respuesta que empiece antes.
+            "carrera": {"activa": False, "hedge_ms": 1500},
+            # Ollama: precarga del modelo, tiempo que sigue en memoria y sondeo de salud
+            "ollama_precalentar_inicio": True,
+            "ollama_keep_alive_min": 30,
+            "salud_intervalo_s": 30,
+            # Ollama reutiliza el prefijo del prompt ya procesado (caché KV) si no cambia:
+            # el historial local se recorta por lotes (holgura) para no moverlo en cada turno
+            "prefijo_estable": {"activa": True, "holgura": 0.25},
+            # Instrumentación: buffer circular de peticiones y volcado JSONL a paths.logs al cerrar
+            "metricas": {"max_registros": 2000, "exportar": True},
+            # Sesiones por conversación (escritorio + Telegram): tope LRU en memoria y
+            # segundos sin uso antes de pasarlas a paths.cache/sesiones
+            "sesiones": {"max_vivas": 32, "inactividad_s": 1800},
+            # Proveedor "auto": EWMA de TTFT/tokens por segundo por proveedor (peso alfa),
+            # penalizaciones por modelo frío y por fallos, y cada cuántas decisiones explorar
+            "auto": {"alfa": 0.2, "penalizacion_frio_ms": 8000, "penalizacion_fallo_ms": 20000,
+                     "explorar_cada": 20},
+            # Trabajo de fondo (resúmenes, hechos para la memoria, títulos): solo en pausas
+            # del chat, por lotes y con concurrencia acotada; el chat lo interrumpe
+            "trabajos": {"max_concurrentes": 1, "retardo_inactivo_s": 1.5, "max_lote": 8,
+                         "extraer_hechos": True, "titulos": True},
+            # Red: peticiones simultáneas por host, reintentos con backoff antes del primer
+            # token y espera máxima en cola cuando el host limita (429 / X-RateLimit-*)
+            "red": {
+                "conexiones_por_host": 8,
+                "conexiones_host": {"openrouter.ai": 8, "localhost:11434": 4, "127.0.0.1:11434": 4},
+                "reintentos": 3, "backoff_base_ms": 250, "backoff_max_ms": 4000, "max_espera_limite_s": 60,
+            },
+        },
         # Avatar/expresiones: permite cambiar el "modelo" visual de Lune.
         "avatar": {
             "pack": "default",                   # carpeta lune_face/ por defecto
@@ -0,0 +1,70 @@
+"""
+embeddings.py — Embeddings de texto para la caché semántica y la memoria.
+================================================================
+Un "embedder" es cualquier objeto con:
+    async def embed(self, textos: list[str]) -> np.ndarray   # (n, dim) float32, normalizado
+
+Incluidos:
+  • OllamaEmbedder — usa el endpoint /api/embed de Ollama (p.ej. nomic-embed-text).
+  • EmbedderHash   — local, sin red ni modelo: hashing de palabras y trigramas.
+                     Determinista y barato; sirve de respaldo y para pruebas.
+
+Se puede enchufar cualquier otro (sentence-transformers, un stub en tests…)
+mientras respete esa firma. Requiere numpy; sin numpy, las funciones que
+dependen de embeddings simplemente quedan desactivadas.
+"""
+import hashlib
+import re
+from typing import List
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def normalizar(matriz):
+    """Normaliza cada fila a norma 1 (para que el producto punto sea el coseno)."""
+    normas = np.linalg.norm(matriz, axis=1, keepdims=True)
+    normas[normas == 0] = 1.0
+    return (matriz / normas).astype(np.float32, copy=False)
+
+
+class OllamaEmbedder:
+    """Embeddings vía Ollama (/api/embed). El transporte es el de ai_http."""
+
+    def __init__(self, transporte, url: str, modelo: str = "nomic-embed-text", timeout: float = 10):
+        self.transporte = transporte
+        self.url = url
+        self.modelo = modelo
+        self.timeout = timeout
+
+    async def embed(self, textos: List[str]):
+        data = await self.transporte.post_json(f"{self.url}/api/embed",
+                                               {"model": self.modelo, "input": textos},
+                                               timeout=self.timeout)
+        return normalizar(np.asarray(data["embeddings"], dtype=np.float32))
+
+
+class EmbedderHash:
+    """Embedder local por hashing (bolsa de palabras + trigramas de caracteres)."""
+
+    _PALABRA = re.compile(r"\w+", re.UNICODE)
+
+    def __init__(self, dim: int = 256):
+        self.dim = dim
+
+    def _indice(self, rasgo: str) -> int:
+        return int.from_bytes(hashlib.blake2b(rasgo.encode("utf-8"), digest_size=8).digest(), "little") % self.dim
+
+    def vector(self, texto: str):
+        v = np.zeros(self.dim, dtype=np.float32)
+        for palabra in self._PALABRA.findall(texto.lower()):
+            v[self._indice(palabra)] += 1.0
+            marcada = f"#{palabra}#"
+            for i in range(len(marcada) - 2):
+                v[self._indice(marcada[i:i + 3])] += 0.5
+        return v
+
+    async def embed(self, textos: List[str]):
+        return normalizar(np.stack([self.vector(t) for t in textos]))
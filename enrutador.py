@@ -0,0 +1,184 @@
+"""
+enrutador.py — Proveedor "auto": elige LOCAL o NUBE según la latencia medida.
+================================================================
+Para cada proveedor se mantiene una media móvil exponencial (EWMA) de lo que
+han medido las peticiones reales (metricas.RegistroPeticion):
+
+  • ttft_ms         tiempo hasta el primer token, sin contar el procesado del
+                    prompt cuando el proveedor lo informa aparte (Ollama)
+  • ms_prompt_token coste de procesar cada token nuevo del prompt
+  • tokens_s        velocidad de generación
+  • fallos          tasa de errores (0..1)
+
+Con eso se estima cuánto tardaría cada candidato en responder ESTE mensaje:
+
+    ttft + tokens_prompt · ms_prompt_token + tokens_salida / tokens_s
+         + penalización por modelo frío + penalización por fallos
+
+tokens_prompt es lo que el proveedor tendría que procesar de nuevo (en
+Ollama, lo que no esté ya en su caché de prefijo).
+
+donde tokens_salida se estima por la longitud del mensaje (un saludo corto
+pide una respuesta corta; una pregunta larga o de razonamiento, una larga).
+Gana el menor. Los proveedores caídos no compiten. Cada `explorar_cada`
+decisiones se prueba al otro candidato para que sus medias no se queden viejas.
+
+Las medias se guardan en paths.cache/enrutador.json entre ejecuciones; las
+decisiones van al log (log_info) y a un buffer `decisiones` para inspección.
+"""
+import json
+import re
+import time
+from collections import deque
+from pathlib import Path
+from typing import Deque, Dict, Optional, Tuple
+
+from historial import estimar_tokens
+from utils import log_info
+
+PROVEEDOR_AUTO = "auto"
+
+# Valores de partida mientras no hay medidas reales
+PREVIAS = {
+    "ollama":     {"ttft_ms": 600.0, "tokens_s": 25.0, "ms_prompt_token": 0.5},
+    "openrouter": {"ttft_ms": 1200.0, "tokens_s": 60.0, "ms_prompt_token": 0.0},
+}
+
+# Preguntas que suelen pedir respuestas largas
+_RAZONAMIENTO = re.compile(
+    r"\b(explica|expl[ií]came|por qu[eé]|analiza|compara|paso a paso|c[oó]digo|programa|resume|"
+    r"redacta|escribe|demuestra|calcula|dif(erencia|erencias)|ventajas|desventajas|traduce)\b",
+    re.IGNORECASE)
+
+
+class EstadisticasProveedor:
+    """Medias móviles exponenciales de un proveedor."""
+
+    def __init__(self, previas: Optional[dict] = None):
+        previas = previas or {}
+        self.ttft_ms = float(previas.get("ttft_ms", 1000.0))
+        self.tokens_s = float(previas.get("tokens_s", 30.0))
+        self.ms_prompt_token = float(previas.get("ms_prompt_token", 0.0))
+        self.fallos = 0.0
+        self.muestras = 0
+        self.actualizado = 0.0
+
+    def observar(self, datos: dict, alfa: float):
+        # Las primeras muestras pesan más para olvidar rápido los valores previos
+        a = max(alfa, 1.0 / (self.muestras + 1))
+        self.fallos += a * ((1.0 if datos.get("error") else 0.0) - self.fallos)
+        if not datos.get("error"):
+            prompt_ms = datos.get("prompt_ms") if datos.get("prompt_tokens") else None
+            if datos.get("ttft_ms") is not None:
+                ttft = max(0.0, datos["ttft_ms"] - (prompt_ms or 0.0))
+                self.ttft_ms += a * (ttft - self.ttft_ms)
+            if datos.get("tokens_s"): self.tokens_s += a * (datos["tokens_s"] - self.tokens_s)
+            if prompt_ms is not None:
+                coste = prompt_ms / datos["prompt_tokens"]
+                self.ms_prompt_token += a * (coste - self.ms_prompt_token)
+        self.muestras += 1
+        self.actualizado = time.time()
+
+    def a_dict(self) -> dict:
+        return {"ttft_ms": round(self.ttft_ms, 1), "tokens_s": round(self.tokens_s, 2),
+                "ms_prompt_token": round(self.ms_prompt_token, 4), "fallos": round(self.fallos, 4),
+                "muestras": self.muestras, "actualizado": self.actualizado}
+
+    @classmethod
+    def desde_dict(cls, datos: dict) -> "EstadisticasProveedor":
+        e = cls(datos)
+        e.fallos = float(datos.get("fallos", 0.0))
+        e.muestras = int(datos.get("muestras", 0))
+        e.actualizado = float(datos.get("actualizado", 0.0))
+        return e
+
+
+class EnrutadorLatencia:
+    """Elige el proveedor con menor tiempo de respuesta estimado."""
+
+    def __init__(self, ruta: Optional[Path] = None, alfa: float = 0.2, penalizacion_frio_ms: float = 8000,
+                 penalizacion_fallo_ms: float = 20000, explorar_cada: int = 20, max_decisiones: int = 200):
+        self.ruta = Path(ruta) if ruta else None
+        self.alfa = alfa
+        self.penalizacion_frio_ms = penalizacion_frio_ms
+        self.penalizacion_fallo_ms = penalizacion_fallo_ms
+        self.explorar_cada = explorar_cada
+        self.estadisticas: Dict[str, EstadisticasProveedor] = {}
+        self.decisiones: Deque[dict] = deque(maxlen=max_decisiones)
+        self._contador = 0
+        self.cargar()
+
+    def stats(self, proveedor: str) -> EstadisticasProveedor:
+        e = self.estadisticas.get(proveedor)
+        if e is None: e = self.estadisticas[proveedor] = EstadisticasProveedor(PREVIAS.get(proveedor))
+        return e
+
+    # ── Aprendizaje ───────────────────────────────────────────────────────────
+
+    def observar(self, proveedor: str, datos: dict):
+        """Incorpora una petición terminada (RegistroPeticion.a_dict()).
+        Se ignoran aciertos de caché y cancelaciones: no dicen nada del proveedor."""
+        if datos.get("cache") or datos.get("cancelado"): return
+        self.stats(proveedor).observar(datos, self.alfa)
+
+    # ── Decisión ──────────────────────────────────────────────────────────────
+
+    @staticmethod
+    def tokens_salida(mensaje: str) -> int:
+        """Longitud esperada de la respuesta según el mensaje."""
+        n = estimar_tokens(mensaje)
+        salida = 40 + 2 * n
+        if _RAZONAMIENTO.search(mensaje or ""): salida *= 3
+        return int(min(800, salida))
+
+    def estimar_ms(self, proveedor: str, tokens_prompt: int, tokens_salida: int, caliente: bool = True) -> float:
+        e = self.stats(proveedor)
+        ms = e.ttft_ms + tokens_prompt * e.ms_prompt_token + tokens_salida / max(e.tokens_s, 0.1) * 1000
+        if not caliente: ms += self.penalizacion_frio_ms
+        return ms + e.fallos * self.penalizacion_fallo_ms
+
+    def elegir(self, mensaje: str, candidatos: Dict[str, dict], preferido: str = "openrouter") -> Tuple[str, str]:
+        """`candidatos`: {pid: {"disponible": bool, "caliente": bool, "tokens_prompt": int}}
+        (el estado de AIManager.estado_proveedores más el prompt a procesar). Devuelve (proveedor, motivo)."""
+        vivos = {pid: c for pid, c in candidatos.items() if c.get("disponible")}
+        salida = self.tokens_salida(mensaje)
+        if not vivos:
+            eleccion, motivo, estimaciones = preferido, "ninguno disponible", {}
+        else:
+            estimaciones = {pid: round(self.estimar_ms(pid, c.get("tokens_prompt", 0), salida, c.get("caliente", True)))
+                            for pid, c in vivos.items()}
+            orden = sorted(estimaciones, key=estimaciones.get)
+            eleccion, motivo = orden[0], "menor latencia estimada"
+            self._contador += 1
+            if len(orden) > 1 and self.explorar_cada and self._contador % self.explorar_cada == 0:
+                eleccion, motivo = orden[1], "exploración"
+
+        decision = {"fecha": round(time.time(), 3), "tokens_mensaje": estimar_tokens(mensaje),
+                    "tokens_prompt": {pid: c.get("tokens_prompt", 0) for pid, c in vivos.items()},
+                    "tokens_salida": salida,
+                    "estimado_ms": estimaciones, "elegido": eleccion, "motivo": motivo}
+        self.decisiones.append(decision)
+        log_info(f"Auto → {eleccion} ({motivo}) · estimado {estimaciones} · salida≈{salida} tokens")
+        return eleccion, motivo
+
+    # ── Persistencia ──────────────────────────────────────────────────────────
+
+    def cargar(self):
+        if self.ruta is None or not self.ruta.exists(): return
+        try:
+            datos = json.loads(self.ruta.read_text("utf-8"))
+        except (OSError, ValueError):
+            return
+        for pid, d in (datos.get("proveedores") or {}).items():
+            self.estadisticas[pid] = EstadisticasProveedor.desde_dict(d)
+
+    def guardar(self):
+        if self.ruta is None: return
+        try:
+            self.ruta.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.ruta.with_suffix(".tmp")
+            tmp.write_text(json.dumps({"proveedores": {pid: e.a_dict() for pid, e in self.estadisticas.items()}},
+                                      ensure_ascii=False, indent=2), encoding="utf-8")
+            tmp.replace(self.ruta)
+        except OSError:
+            pass
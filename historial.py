@@ -0,0 +1,120 @@
+"""
+historial.py — Ventana deslizante del historial de conversación por tokens.
+================================================================
+Cada proveedor guarda su conversación en un HistorialConversacion en lugar de
+una lista que crece sin límite. Cada mensaje lleva su conteo de tokens
+(tokens.contar con el modelo del proveedor, calculado una sola vez al
+agregarlo), el total se mantiene de forma
+incremental y, al superar el presupuesto, se descartan los turnos más viejos
+por la izquierda (deque) sin copiar la lista completa en cada turno.
+
+Los turnos descartados no se pierden: quedan en `pendientes_resumen` para que
+un trabajo de fondo los comprima en `resumen`, que se envía como prefijo
+(justo después del system prompt) en cada payload.
+
+Con `holgura` > 0 el recorte se hace por lotes: al pasarse del límite se baja
+de una vez hasta presupuesto·(1-holgura). Así el inicio de la ventana no se
+mueve en cada turno y el prompt conserva un prefijo idéntico durante varios
+turnos, que Ollama puede reutilizar de su caché sin reprocesarlo.
+
+Uso:
+    h = HistorialConversacion(presupuesto_tokens=4000, max_mensajes=100)
+    h.append({"role": "user", "content": "hola"})
+    mensajes = h.payload(system_prompt)   # solo la ventana vigente
+"""
+from collections import deque
+from typing import Deque, Dict, Iterator, List, Optional
+
+from tokens import TOKENS_POR_MENSAJE, contar
+
+
+def estimar_tokens(texto: str, modelo: Optional[str] = None) -> int:
+    """Tokens de un texto para el modelo dado (exacto si hay tokenizador, si no heurística)."""
+    return contar(texto, modelo)
+
+
+class HistorialConversacion:
+    """Historial acotado por tokens y por número de mensajes."""
+
+    def __init__(self, presupuesto_tokens: int = 4000, max_mensajes: int = 100, holgura: float = 0.0,
+                 modelo: Optional[str] = None):
+        self.presupuesto_tokens = presupuesto_tokens
+        self.max_mensajes = max_mensajes
+        self.holgura = holgura                   # fracción extra a recortar de una vez
+        self.modelo = modelo                     # elige el tokenizador (tokens.familia_de)
+        self._mensajes: Deque[Dict] = deque()
+        self._tokens: Deque[int] = deque()      # paralelo a _mensajes
+        self.total_tokens = 0
+        self.descartados = 0                     # mensajes sacados de la ventana
+        self.resumen = ""                        # resumen acumulado de lo descartado
+        self.pendientes_resumen: List[Dict] = [] # descartados aún sin resumir
+        self.resumiendo = False
+
+    # ── Mutación ──────────────────────────────────────────────────────────────
+
+    def append(self, mensaje: Dict):
+        n = contar(mensaje.get("content", ""), self.modelo) + TOKENS_POR_MENSAJE
+        self._mensajes.append(mensaje); self._tokens.append(n)
+        self.total_tokens += n
+        self._recortar()
+
+    def configurar(self, presupuesto_tokens: int = None, max_mensajes: int = None, holgura: float = None,
+                   modelo: str = None):
+        if modelo is not None and modelo != self.modelo:
+            # Otro modelo, otro tokenizador: se recuentan los mensajes de la ventana
+            self.modelo = modelo
+            self._tokens = deque(contar(m.get("content", ""), modelo) + TOKENS_POR_MENSAJE for m in self._mensajes)
+            self.total_tokens = sum(self._tokens)
+        if presupuesto_tokens is not None: self.presupuesto_tokens = presupuesto_tokens
+        if max_mensajes is not None: self.max_mensajes = max_mensajes
+        if holgura is not None: self.holgura = min(0.9, max(0.0, holgura))
+        self._recortar()
+
+    def limpiar(self):
+        self._mensajes.clear(); self._tokens.clear()
+        self.total_tokens = 0
+        self.resumen = ""; self.pendientes_resumen = []
+
+    def tomar_pendientes(self) -> List[Dict]:
+        """Entrega (y vacía) los turnos descartados que faltan por resumir."""
+        pendientes, self.pendientes_resumen = self.pendientes_resumen, []
+        return pendientes
+
+    def _sacar_primero(self) -> Dict:
+        self.total_tokens -= self._tokens.popleft()
+        self.descartados += 1
+        mensaje = self._mensajes.popleft()
+        self.pendientes_resumen.append(mensaje)
+        return mensaje
+
+    def _recortar(self):
+        # Siempre se conserva al menos el último mensaje (el turno en curso).
+        if self.total_tokens > self.presupuesto_tokens or len(self._mensajes) > self.max_mensajes:
+            tope_tokens = int(self.presupuesto_tokens * (1 - self.holgura))
+            tope_mensajes = max(1, int(self.max_mensajes * (1 - self.holgura)))
+            while len(self._mensajes) > 1 and (
+                self.total_tokens > tope_tokens or len(self._mensajes) > tope_mensajes
+            ):
+                self._sacar_primero()
+        # La ventana nunca empieza con una respuesta huérfana del asistente.
+        while len(self._mensajes) > 1 and self._mensajes[0].get("role") == "assistant":
+            self._sacar_primero()
+
+    # ── Lectura ───────────────────────────────────────────────────────────────
+
+    def payload(self, system_prompt: str = "") -> List[Dict]:
+        """Lista de mensajes a enviar: system (si hay) + resumen + la ventana vigente."""
+        mensajes = [{"role": "system", "content": system_prompt}] if system_prompt else []
+        if self.resumen:
+            mensajes.append({"role": "system", "content": "Resumen de la conversación anterior: " + self.resumen})
+        mensajes.extend(self._mensajes)
+        return mensajes
+
+    def __len__(self) -> int:
+        return len(self._mensajes)
+
+    def __iter__(self) -> Iterator[Dict]:
+        return iter(self._mensajes)
+
+    def __getitem__(self, i) -> Dict:
+        return self._mensajes[i]
@@ -0,0 +1,148 @@
+"""
+indice_memoria.py — Índice invertido (BM25) sobre los recuerdos.
+================================================================
+MemoriaManager lo usa para elegir qué recuerdos acompañan al mensaje actual
+(turno de contexto antes del mensaje), en lugar de meter siempre los más
+recientes.
+
+  • Índice invertido término → {doc: frecuencia} sobre contenido y tags,
+    mantenido de forma incremental: agregar() y quitar() tocan solo los
+    términos de ese recuerdo, nunca recorren la colección.
+  • Puntuación BM25 (k1, b) multiplicada por un impulso de recencia que se
+    reduce a la mitad cada `vida_media_dias`:
+        bm25 · (1 + peso_recencia · 0.5^(edad / vida_media))
+  • buscar() solo visita las listas de los términos de la consulta. Las
+    palabras vacías (de, que, el...) no se indexan, así que con 100k
+    recuerdos una consulta típica recorre unos pocos cientos de entradas.
+
+Normalización: minúsculas, sin tildes y plural simple en -s ("cafés" y
+"café" son el mismo término).
+"""
+import heapq
+import math
+import re
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+_PALABRA = re.compile(r"\w+", re.UNICODE)
+_SIN_TILDES = str.maketrans("áéíóúàèìòùäëïöüâêîôûñç", "aeiouaeiouaeiouaeiounc")
+
+PALABRAS_VACIAS = frozenset("""
+    a al algo ante como con de del desde donde el ella ellas ellos en entre era es esa ese eso esta
+    este esto estoy fue ha hay la las le les lo los me mi mis muy mas ni no nos o os para pero
+    por que quien se ser si sin sobre su sus te ti tu tus un una uno unos unas y ya yo
+    the and or of to in is it for on with as at by be this that what you i my me are was do
+""".split())
+
+
+def terminos(texto: str) -> List[str]:
+    """Términos indexables de un texto."""
+    salida = []
+    for palabra in _PALABRA.findall(texto.lower().translate(_SIN_TILDES)):
+        if len(palabra) < 2 or palabra in PALABRAS_VACIAS: continue
+        if len(palabra) > 3 and palabra.endswith("s"): palabra = palabra[:-1]
+        salida.append(palabra)
+    return salida
+
+
+def _marca_tiempo(fecha: str) -> float:
+    try:
+        return datetime.fromisoformat(fecha).timestamp()
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class IndiceBM25:
+    """Índice invertido incremental con ranking BM25 + recencia."""
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75, peso_recencia: float = 0.3,
+                 vida_media_dias: float = 30.0):
+        self.k1 = k1
+        self.b = b
+        self.peso_recencia = peso_recencia
+        self.vida_media_s = vida_media_dias * 86400
+        self._postings: Dict[str, Dict[str, int]] = {}   # término → {id: frecuencia}
+        self._longitud: Dict[str, int] = {}              # id → nº de términos
+        self._terminos: Dict[str, Tuple[str, ...]] = {}  # id → términos distintos (para quitar)
+        self._fecha: Dict[str, float] = {}
+        self._total_terminos = 0
+
+    def __len__(self) -> int:
+        return len(self._longitud)
+
+    def __contains__(self, rid: str) -> bool:
+        return rid in self._longitud
+
+    # ── Mantenimiento ─────────────────────────────────────────────────────────
+
+    def agregar(self, recuerdo: dict):
+        rid = recuerdo["id"]
+        if rid in self._longitud: self.quitar(rid)
+        texto = recuerdo.get("contenido", "") + " " + " ".join(recuerdo.get("tags") or [])
+        frecuencias = Counter(terminos(texto))
+        for termino, n in frecuencias.items():
+            self._postings.setdefault(termino, {})[rid] = n
+        longitud = sum(frecuencias.values())
+        self._longitud[rid] = longitud
+        self._terminos[rid] = tuple(frecuencias)
+        self._fecha[rid] = _marca_tiempo(recuerdo.get("fecha", ""))
+        self._total_terminos += longitud
+
+    def agregar_todos(self, recuerdos: Iterable[dict]):
+        for recuerdo in recuerdos: self.agregar(recuerdo)
+
+    def quitar(self, rid: str):
+        if rid not in self._longitud: return
+        for termino in self._terminos.pop(rid):
+            lista = self._postings.get(termino)
+            if lista is None: continue
+            lista.pop(rid, None)
+            if not lista: del self._postings[termino]
+        self._total_terminos -= self._longitud.pop(rid)
+        self._fecha.pop(rid, None)
+
+    def limpiar(self):
+        self._postings.clear(); self._longitud.clear(); self._terminos.clear(); self._fecha.clear()
+        self._total_terminos = 0
+
+    # ── Consulta ──────────────────────────────────────────────────────────────
+
+    def buscar(self, consulta: str, k: int = 8, ahora: Optional[float] = None) -> List[Tuple[str, float]]:
+        """Los `k` recuerdos más relevantes para `consulta`: [(id, puntuación)]."""
+        n_docs = len(self._longitud)
+        consulta_terminos = set(terminos(consulta))
+        if not n_docs or not consulta_terminos: return []
+        media = self._total_terminos / n_docs or 1.0
+        k1, b = self.k1, self.b
+        puntos: Dict[str, float] = {}
+        for termino in consulta_terminos:
+            lista = self._postings.get(termino)
+            if not lista: continue
+            idf = math.log(1 + (n_docs - len(lista) + 0.5) / (len(lista) + 0.5))
+            longitud = self._longitud
+            for rid, tf in lista.items():
+                norma = tf + k1 * (1 - b + b * longitud[rid] / media)
+                puntos[rid] = puntos.get(rid, 0.0) + idf * tf * (k1 + 1) / norma
+        if not puntos: return []
+        mejores = heapq.nlargest(k * 4, puntos.items(), key=lambda par: par[1])
+        # La recencia reordena entre los mejores por texto (no rescata irrelevantes)
+        ahora = time.time() if ahora is None else ahora
+        vida, peso, fecha = self.vida_media_s, self.peso_recencia, self._fecha
+        con_recencia = [(rid, p * (1 + peso * 0.5 ** (max(0.0, ahora - fecha[rid]) / vida)))
+                        for rid, p in mejores]
+        return heapq.nlargest(k, con_recencia, key=lambda par: par[1])
+
+    def stats(self) -> dict:
+        return {"recuerdos": len(self._longitud), "terminos": len(self._postings)}
+
+
+def fusionar(*rankings: List[str], k: int = 60) -> List[str]:
+    """Fusión por rango recíproco (RRF): combina rankings de ids sin tener que
+    comparar puntuaciones de escalas distintas (BM25 y coseno)."""
+    puntos: Dict[str, float] = {}
+    for ranking in rankings:
+        for posicion, rid in enumerate(ranking):
+            puntos[rid] = puntos.get(rid, 0.0) + 1.0 / (k + posicion + 1)
+    return sorted(puntos, key=puntos.get, reverse=True)
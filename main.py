@@ -25,6 +25,7 @@ from utils import Logger, log_info, log_error
 import datos
 from memoria import MemoriaManager
 from tools import ToolManager
+import prompt_sistema
 from respuestas import BancoRespuestas
 
 from theme import (
@@ -56,7 +57,7 @@ class LuneCDWindow(QMainWindow):
         super().__init__()
         # Config visual/features (config.json) + APIs/personalidad (datos.json)
         self.config           = Config()
-        self.ai_manager       = AIManager()
+        self.ai_manager       = AIManager(self.config)
         self.voice            = VoiceEngine()
         self.current_provider = "openrouter"
         self.ai_worker        = None
@@ -65,8 +66,26 @@ class LuneCDWindow(QMainWindow):
         self._tg_worker       = None
         self.tray             = None
         self._quit_real       = False
-        self.memoria          = MemoriaManager()
+        self.memoria          = MemoriaManager(
+            presupuesto_contexto_tokens=self.config.get("ia", "memoria_contexto_tokens", 600),
+            motor=self.config.get("ia", "memoria_motor", "sqlite"),
+            retardo_escritura_s=self.config.get("ia", "memoria_escritura", {}).get("retardo_s", 2.0),
+            max_retraso_escritura_s=self.config.get("ia", "memoria_escritura", {}).get("max_retraso_s", 10.0),
+            umbral_diario_kb=self.config.get("ia", "memoria_escritura", {}).get("umbral_diario_kb", 256),
+            exportar_diario_s=self.config.get("ia", "memoria_escritura", {}).get("exportar_diario_s", 60),
+            k_relevantes=self.config.get("ia", "memoria_recuerdos", {}).get("relevantes", 8),
+            k_recientes=self.config.get("ia", "memoria_recuerdos", {}).get("recientes", 3),
+            vectores_dtype=(self.config.get("ia", "memoria_vectores", {}).get("dtype", "float32")
+                            if self.config.get("ia", "memoria_vectores", {}).get("activa", True) else None),
+            min_similitud=self.config.get("ia", "memoria_vectores", {}).get("min_similitud", 0.5))
+        self.memoria.extractor = self.ai_manager.extraer_hechos   # hechos en 2º plano (modelo local)
+        # Recuerdos por embeddings: se calculan en 2º plano, solo los que faltan
+        self.memoria.embeber = self.ai_manager.embeber_recuerdos
+        # Los recuerdos de cada mensaje se arman en el motor (AIManager.chat), no en la UI
+        self.ai_manager.contexto_memoria = self.memoria.contexto_para_mensaje
+        self.memoria.indexar_vectores()
         self.tools            = ToolManager()
+        self.prompt_sistema   = prompt_sistema.crear(self.memoria, self.tools)
 
         # Banco de respuestas instantáneas con la personalidad de Lune
         nombre_bot = datos.get_personaje(datos.get_bot().get("personaje_default", "Lune")).get("nombre", "Lune")
@@ -81,6 +100,14 @@ class LuneCDWindow(QMainWindow):
 
         self._init_ui()
         self._build_tray()
+
+        # Sondeo de salud en segundo plano y precarga del modelo local
+        self.ai_manager.iniciar_servicios(precalentar=self.config.get("ia", "ollama_precalentar_inicio", True))
+        self._estado_timer = QTimer(self); self._estado_timer.timeout.connect(self._refrescar_estado_proveedores)
+        self._estado_timer.start(2000)
+        # Escritura diferida de la memoria: vuelca lo acumulado en las pausas
+        self._memoria_timer = QTimer(self); self._memoria_timer.timeout.connect(self.memoria.volcar)
+        self._memoria_timer.start(1000)
         log_info(f"Lune CD v{APP_VERSION} iniciado")
 
     # ── UI ────────────────────────────────────────────────────────────────────
@@ -415,6 +442,16 @@ class LuneCDWindow(QMainWindow):
         self.topbar_title.setStyleSheet(f"color:{meta['color']};background:transparent;letter-spacing:1px;")
         self.topbar_desc.setText("·  "+meta["desc"])
         self._update_send_btn_color(); self.stack.setCurrentIndex(0)
+        if provider_id in ("ollama", "auto"): self.ai_manager.calentar("ollama")
+
+    def _refrescar_estado_proveedores(self):
+        # Solo lee el estado cacheado por AIManager: nunca toca la red desde la UI
+        ollama = self.ai_manager.estado_proveedores().get("ollama")
+        if not ollama or "ollama" not in self.provider_tabs or not ollama["sondeado_en"]: return
+        if not ollama["disponible"]: texto = "Ollama no responde"
+        elif ollama["caliente"]: texto = "Modelo cargado"
+        else: texto = None
+        self.provider_tabs["ollama"].set_estado(texto)
 
     def _update_send_btn_color(self):
         c = PROVIDER_META[self.current_provider]["color"]
@@ -426,8 +463,7 @@ class LuneCDWindow(QMainWindow):
 
     def _stop_generation(self):
         if self.ai_worker and self.ai_worker.isRunning():
-            if self.current_provider in self.ai_manager.providers:
-                self.ai_manager.providers[self.current_provider].cancel_flag = True
+            self.ai_manager.cancelar()
 
             self._set_status("INTERRUMPIDO", COLORS["warning"])
             self.lune_face.set_state("normal")
@@ -471,8 +507,7 @@ class LuneCDWindow(QMainWindow):
         self.input_field.setEnabled(False)
         self.send_btn.hide(); self.stop_btn.show()
 
-        if self.current_provider in self.ai_manager.providers:
-            self.ai_manager.providers[self.current_provider].cancel_flag = False
+        self.ai_manager.rearmar()
 
         self._set_status("PROCESANDO", COLORS["warning"]); self.lune_face.set_state("thinking")
 
@@ -480,22 +515,25 @@ class LuneCDWindow(QMainWindow):
         self.messages_layout.insertWidget(self.messages_layout.count()-1, self._typing_indicator)
         self._scroll_bottom()
 
-        contexto_memoria = self.memoria.obtener_contexto_para_prompt()
-        self.ai_worker = AIWorker(self.ai_manager, text, self.current_provider, extra_context=contexto_memoria)
+        self.ai_worker = AIWorker(self.ai_manager, text, self.current_provider,
+                                  system_prompt=self.prompt_sistema.construir(),
+                                  fps=self.config.get("ui", "streaming_fps", 30))
         if self.config.feature("streaming_tokens", True):
             self.ai_worker.token_received.connect(self._on_token)
         self.ai_worker.response_ready.connect(self._on_response)
         self.ai_worker.error_occurred.connect(self._on_error)
         self.ai_worker.start()
 
-    def _on_token(self, partial):
+    def _on_token(self, delta):
+        # Llega un lote de texto nuevo por frame (no el acumulado): solo se añade.
         if self._typing_indicator and self._current_bubble is None:
             self._typing_indicator.stop(); self._typing_indicator.deleteLater(); self._typing_indicator = None
-            self._current_bubble = MessageBubble(partial+" ▋", is_user=False, provider_id=self.current_provider)
+            self._current_bubble = MessageBubble("", is_user=False, provider_id=self.current_provider, streaming=True)
+            self._current_bubble.append_text(delta, " ▋")
             self.messages_layout.insertWidget(self.messages_layout.count()-1, self._current_bubble)
             self.lune_face.set_state("typing")
         elif self._current_bubble:
-            self._current_bubble.update_text(partial+" ▋")
+            self._current_bubble.append_text(delta, " ▋")
         self._scroll_bottom()
 
     def _on_response(self, response):
@@ -520,7 +558,7 @@ class LuneCDWindow(QMainWindow):
                 tool_bubble = MessageBubble(f"{'✓' if result.ok else '✕'} {result.mensaje}", is_user=False, provider_id=self.current_provider)
                 self.messages_layout.insertWidget(self.messages_layout.count()-1, tool_bubble)
 
-        self.memoria.procesar_respuesta_lune(respuesta_limpia)
+        self.memoria.procesar_respuesta_lune(respuesta_limpia, self.ai_worker.message if self.ai_worker else "")
         emotion = detect_emotion(respuesta_limpia)
         self.lune_face.set_state(emotion, auto_revert_ms=6000)
         self.voice.speak(respuesta_limpia)
@@ -541,7 +579,11 @@ class LuneCDWindow(QMainWindow):
     # ── HELPERS ───────────────────────────────────────────────────────────────
 
     def _scroll_bottom(self):
-        QTimer.singleShot(60, lambda: self.scroll.verticalScrollBar().setValue(self.scroll.verticalScrollBar().maximum()))
+        # Un único timer reutilizado: las ráfagas de llamadas se agrupan en un scroll.
+        if not hasattr(self, "_scroll_timer"):
+            self._scroll_timer = QTimer(self); self._scroll_timer.setSingleShot(True); self._scroll_timer.setInterval(60)
+            self._scroll_timer.timeout.connect(lambda: self.scroll.verticalScrollBar().setValue(self.scroll.verticalScrollBar().maximum()))
+        if not self._scroll_timer.isActive(): self._scroll_timer.start()
 
     def _set_status(self, text, color):
         self.status_label.setText(text); self.status_dot.setStyleSheet(f"color:{color};background:transparent;")
@@ -593,6 +635,8 @@ class LuneCDWindow(QMainWindow):
 
     def _on_keys_saved(self):
         self.ai_manager.reload_provider()
+        # Ajustes escribe datos.json sin pasar por personajes._save: el personaje cacheado caduca aquí
+        self.prompt_sistema.invalidar("personaje")
         self.stack.setCurrentIndex(0)
 
         personaje = datos.get_personaje(datos.get_bot().get("personaje_default", "Lune"))
@@ -651,6 +695,7 @@ class LuneCDWindow(QMainWindow):
         if self.tray is not None and not self._quit_real:
             event.ignore()
             self.hide()
+            if hasattr(self, "memoria"): self.memoria.volcar(forzar=True)
             self.tray.showMessage(
                 "Lune CD", "Sigo aquí en la bandeja. Doble clic para abrirme.",
                 QSystemTrayIcon.MessageIcon.Information, 3000,
@@ -660,8 +705,11 @@ class LuneCDWindow(QMainWindow):
         if hasattr(self, "memoria"):
             stats = self.memoria.get_stats()
             resumen = f"Sesión del {datetime.now().strftime('%d/%m/%Y')}. Mensajes intercambiados hoy: {stats.get('total_mensajes', 0)}."
+            if hasattr(self, "ai_manager") and (conversacion := self.ai_manager.resumen_sesion()):
+                resumen = f"{resumen} {conversacion}"
             self.memoria.cerrar_sesion(resumen)
 
+        if hasattr(self,"ai_manager"): self.ai_manager.shutdown()
         if hasattr(self,"lune_face") and self.lune_face._player: self.lune_face._player.stop()
         if hasattr(self,"_tg_worker") and self._tg_worker and self._tg_worker.isRunning():
             self._tg_worker.stop(); self._tg_worker.wait(3000)
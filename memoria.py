@@ -2,6 +2,9 @@
 memoria.py — Sistema de memoria personal persistente para Lune CD
 ================================================================
 Guarda y recupera información sobre el usuario entre sesiones.
+La persistencia va en almacen_memoria.py: memoria.db (SQLite, por defecto) con
+memoria.json como exportación compartida con el bot de Telegram, memoria.json
+más un diario de cambios, o solo memoria.json. La estructura es la misma:
 
 Estructura de memoria.json:
 {
@@ -31,11 +34,21 @@ Uso desde main.py:
     from memoria import MemoriaManager
     memoria = MemoriaManager()
 
-    # Al inicio de sesión — obtener contexto para el system prompt
-    contexto = memoria.obtener_contexto_para_prompt()
+    # Bloque estable para el system prompt (nombre, datos clave, resumen)
+    bloque = memoria.obtener_contexto_para_prompt()
+    # En cada mensaje — recuerdos relevantes, como turno aparte antes del mensaje
+    # (desde cualquier hilo; vector = (modelo, embedding del mensaje) o None)
+    contexto = memoria.contexto_para_mensaje(mensaje_usuario, vector)
 
-    # Tras cada respuesta — detectar y guardar automáticamente
-    memoria.procesar_respuesta(mensaje_usuario, respuesta_lune)
+    # Tras cada respuesta — extraer hechos en segundo plano (si hay extractor)
+    memoria.extractor = ai_manager.extraer_hechos
+    memoria.procesar_respuesta_lune(respuesta_lune, mensaje_usuario)
+
+    # Búsqueda semántica (vectores_memoria.py): embeddings en segundo plano
+    memoria.embeber = ai_manager.embeber_recuerdos
+    memoria.indexar_vectores()      # solo los recuerdos que aún no tienen vector
+    # El turno de recuerdos lo arma AIManager.chat en el motor, con el vector del mensaje
+    ai_manager.contexto_memoria = memoria.contexto_para_mensaje
 
     # Al cerrar la app
     memoria.cerrar_sesion(resumen_conversacion)
@@ -46,16 +59,28 @@ Comandos del usuario detectados automáticamente:
     "/olvida [id]", "/olvida todo"
 """
 
-import json
+import itertools
+import threading
 import uuid
 import re
+from collections import deque
 from pathlib import Path
 from datetime import datetime, date
-from typing import Optional
+from typing import Callable, Optional
+
+import almacen_memoria
+from indice_memoria import IndiceBM25, fusionar
+from tokens import contar
+from utils import log_error
+from vectores_memoria import IndiceVectorial, np
 
 
 MEMORIA_PATH = Path(__file__).parent / "memoria.json"
 
+# Turno de contexto con los recuerdos para el mensaje actual (AIManager.chat lo
+# coloca tras el historial, justo antes del mensaje del usuario)
+CABECERA_RECUERDOS = "Recuerdos sobre el usuario relacionados con su próximo mensaje (úsalos solo si vienen al caso):\n"
+
 TIPOS_RECUERDO = {
     "hecho":        "·",
     "preferencia":  "·",
@@ -97,28 +122,91 @@ KEYWORDS_PREFERENCIA = [
 class MemoriaManager:
     """Gestor de memoria personal persistente entre sesiones."""
 
-    def __init__(self, path: Path = MEMORIA_PATH):
+    def __init__(self, path: Path = MEMORIA_PATH, presupuesto_contexto_tokens: int = 600, motor: str = "sqlite",
+                 retardo_escritura_s: float = 0.0, max_retraso_escritura_s: float = 10.0,
+                 umbral_diario_kb: int = 256, exportar_diario_s: float = 60.0,
+                 k_relevantes: int = 8, k_recientes: int = 3,
+                 vectores_dtype: Optional[str] = None, min_similitud: float = 0.5):
         self.path = path
+        # Recuerdos en el prompt: los k más relevantes para el mensaje + k recientes
+        self.k_relevantes = k_relevantes
+        self.k_recientes = k_recientes
+        self._indice: Optional[IndiceBM25] = None
+        self._por_id: dict = {}
+        # Índice vectorial junto a memoria.json (None = solo BM25). embeber(recuerdos,
+        # callback) calcula los vectores en segundo plano (AIManager.embeber_recuerdos).
+        self._vectores: Optional[IndiceVectorial] = None
+        if vectores_dtype and np is not None:
+            self._vectores = IndiceVectorial(path.with_suffix(""), vectores_dtype)
+        self.min_similitud = min_similitud
+        self.embeber: Optional[Callable] = None
+        # Los recuerdos se modifican en el hilo de la UI y contexto_para_mensaje() se
+        # llama desde el motor: la lista, el índice BM25 y _por_id van bajo este lock.
+        self._lock_recuerdos = threading.RLock()
+        # Con retardo > 0 los guardados se acumulan hasta volcar() (escritura diferida)
+        self._opciones_almacen = (retardo_escritura_s, max_retraso_escritura_s, umbral_diario_kb * 1024,
+                                  exportar_diario_s)
+        self._almacen = almacen_memoria.crear(path, motor, *self._opciones_almacen)
+        # Tokens máximos de los recuerdos en el turno de contexto de cada mensaje
+        self.presupuesto_contexto_tokens = presupuesto_contexto_tokens
         self._data = self._cargar()
         self._mensajes_sesion: int = 0
         self._recuerdos_nuevos_sesion: list[str] = []
+        # Conteo fijo durante la sesión: si cambiara en cada mensaje, el bloque de
+        # memoria del system prompt también cambiaría y Ollama no podría reutilizar
+        # el prompt ya procesado.
+        self._total_inicio_sesion: int = self._data["estadisticas"].get("total_mensajes", 0)
+        # Extracción de hechos en segundo plano: extractor(mensaje, respuesta, callback)
+        # (AIManager.extraer_hechos). El callback llega desde otro hilo: solo deja los
+        # hechos en la cola y se guardan aquí, en el hilo de la UI.
+        self.extractor: Optional[Callable] = None
+        self._hechos_pendientes: deque = deque()
+        # Aviso cuando cambia lo que va al system prompt (PromptSistema.invalidar);
+        # puede llamarse desde el hilo del motor al llegar hechos extraídos.
+        self.al_cambiar: Optional[Callable[[], None]] = None
         self._registrar_inicio_sesion()
 
     # ── Carga / guardado ─────────────────────────────────────────────────────
 
     def _cargar(self) -> dict:
-        if self.path.exists():
-            try:
-                return json.loads(self.path.read_text("utf-8"))
-            except Exception:
-                pass
-        return self._estructura_vacia()
-
-    def _guardar(self):
-        self.path.write_text(
-            json.dumps(self._data, ensure_ascii=False, indent=2),
-            encoding="utf-8"
-        )
+        try:
+            cargado = self._almacen.cargar()
+        except Exception as e:
+            # memoria.db ilegible: se sigue con memoria.json (la última exportación) y su diario
+            log_error(f"No se pudo leer la memoria ({e}); se usa {self.path.name}")
+            self._almacen = almacen_memoria.crear(self.path, "diario", *self._opciones_almacen)
+            cargado = self._almacen.cargar()
+        data = self._estructura_vacia()
+        if cargado:
+            data.update(cargado)
+            for seccion, defecto in self._estructura_vacia().items():
+                if isinstance(defecto, dict): data[seccion] = {**defecto, **(data.get(seccion) or {})}
+            self._almacen.importar_bot(data)
+        else:
+            self._almacen.guardar(data, [("clave", k) for k in data if k != "recuerdos"])
+        return data
+
+    def _guardar(self, *cambios, contexto: bool = True):
+        """Persiste `cambios` (ver almacen_memoria). `contexto`=False si solo
+        cambian estadísticas que no van al prompt."""
+        self._almacen.guardar(self._data, cambios)
+        if contexto: self._avisar_cambio()
+
+    def volcar(self, forzar: bool = False) -> bool:
+        """Escribe los cambios acumulados si toca (llamar periódicamente desde la
+        UI); `forzar` escribe ya. Devuelve True si escribió algo."""
+        importaciones = self._almacen.importaciones
+        escrito = self._almacen.volcar(self._data, forzar=forzar)
+        # El bot de Telegram cambió nombre o datos_clave: el prompt debe reflejarlo
+        if self._almacen.importaciones != importaciones: self._avisar_cambio()
+        return escrito
+
+    def stats_almacen(self) -> dict:
+        """Motor, escrituras hechas y evitadas por la escritura diferida."""
+        return self._almacen.stats()
+
+    def _avisar_cambio(self):
+        if self.al_cambiar is not None: self.al_cambiar()
 
     def _estructura_vacia(self) -> dict:
         ahora = datetime.now().isoformat()
@@ -140,32 +228,25 @@ class MemoriaManager:
 
     def _registrar_inicio_sesion(self):
         self._data["estadisticas"]["ultima_sesion"] = datetime.now().isoformat()
-        self._guardar()
+        self._guardar(("clave", "estadisticas"), contexto=False)
 
     # ── API pública ───────────────────────────────────────────────────────────
 
     def obtener_contexto_para_prompt(self) -> str:
         """
-        Devuelve un bloque de texto listo para insertar en el system prompt.
-        Resume lo que Lune sabe del usuario sin saturar el contexto.
+        Devuelve un bloque de texto listo para insertar en el system prompt:
+        nombre, datos clave, resumen de la sesión anterior y total de mensajes.
+        No cambia de un mensaje a otro (solo cuando cambia la memoria), así el
+        system prompt y el historial que le sigue siguen siendo un prefijo que
+        Ollama reutiliza. Los recuerdos van aparte: contexto_para_mensaje().
         """
+        self._aplicar_hechos_pendientes()
         partes = []
         usuario = self._data.get("usuario", {})
 
         if nombre := usuario.get("nombre"):
             partes.append(f"El usuario se llama {nombre}.")
 
-        recuerdos = self._data.get("recuerdos", [])
-        if recuerdos:
-            # Últimos 15 recuerdos ordenados por fecha desc
-            recientes = sorted(recuerdos, key=lambda r: r["fecha"], reverse=True)[:15]
-            lineas = []
-            for r in recientes:
-                emoji = TIPOS_RECUERDO.get(r.get("tipo", "general"), "")
-                fecha_corta = r["fecha"][:10]
-                lineas.append(f"  {emoji} [{fecha_corta}] {r['contenido']}")
-            partes.append("Lo que sé sobre el usuario:\n" + "\n".join(lineas))
-
         # Hechos clave:valor (compartidos con el bot de Telegram)
         datos_clave = self._data.get("datos_clave", {})
         if datos_clave:
@@ -176,8 +257,7 @@ class MemoriaManager:
         if resumen:
             partes.append(f"Resumen de la última sesión: {resumen}")
 
-        stats = self._data.get("estadisticas", {})
-        total = stats.get("total_mensajes", 0)
+        total = self._total_inicio_sesion
         if total > 0:
             partes.append(f"Llevamos {total} mensajes intercambiados en total.")
 
@@ -190,6 +270,78 @@ class MemoriaManager:
             + "\n--- FIN MEMORIA ---\n"
         )
 
+    def contexto_para_mensaje(self, consulta: str, vector: Optional[tuple] = None) -> str:
+        """Recuerdos para el mensaje actual (los más relevantes por BM25 +
+        recencia, fusionados con los cercanos por embeddings si llega `vector`
+        = (modelo, embedding del mensaje), y unos pocos recientes), o "" si no
+        hay. Va como turno aparte justo antes del mensaje, no en el system
+        prompt. Se puede llamar desde el hilo del motor."""
+        with self._lock_recuerdos:
+            lineas = self._lineas_recuerdos(consulta, vector)
+        return CABECERA_RECUERDOS + "\n".join(lineas) if lineas else ""
+
+    def _lineas_recuerdos(self, consulta: str, vector: Optional[tuple] = None) -> list:
+        """Recuerdos para el prompt dentro del presupuesto de tokens: primero los
+        relevantes (si hay consulta), luego los más recientes."""
+        recuerdos = self._data.get("recuerdos", [])
+        if not recuerdos: return []
+        relevantes = []
+        if consulta:
+            indice = self._indice_recuerdos()
+            ids = [rid for rid, _ in indice.buscar(consulta, self.k_relevantes)]
+            semanticos = self._buscar_semantico(vector)
+            if semanticos: ids = fusionar(ids, semanticos)
+            # Los del índice vectorial pueden estar ya olvidados (lápida aún en cola)
+            relevantes = [self._por_id[rid] for rid in ids if rid in self._por_id][:self.k_relevantes]
+        vistos = {r["id"] for r in relevantes}
+        # La lista está en orden de llegada: los recientes son los últimos (sin ordenar)
+        n_recientes = self.k_recientes if consulta else len(recuerdos)
+        recientes = [r for r in itertools.islice(reversed(recuerdos), n_recientes + len(vistos))
+                     if r["id"] not in vistos][:n_recientes]
+
+        def _linea(r):
+            emoji = TIPOS_RECUERDO.get(r.get("tipo", "general"), "")
+            return f"  {emoji} [{r['fecha'][:10]}] {r['contenido']}"
+
+        elegidas, usados = {}, 0
+        for r in relevantes + recientes:       # prioridad en el presupuesto
+            linea = _linea(r)
+            usados += contar(linea)
+            if elegidas and usados > self.presupuesto_contexto_tokens: break
+            elegidas[r["id"]] = linea
+        # Recientes delante, relevantes detrás (más cerca del mensaje)
+        return ([elegidas[r["id"]] for r in recientes if r["id"] in elegidas]
+                + [elegidas[r["id"]] for r in relevantes if r["id"] in elegidas])
+
+    def _indice_recuerdos(self) -> IndiceBM25:
+        # Se construye en la primera consulta y luego se mantiene en cada alta/baja
+        if self._indice is None:
+            recuerdos = self._data.get("recuerdos", [])
+            self._indice = IndiceBM25()
+            self._indice.agregar_todos(recuerdos)
+            self._por_id = {r["id"]: r for r in recuerdos}
+        return self._indice
+
+    def _buscar_semantico(self, vector: Optional[tuple]) -> list:
+        """Ids de los recuerdos más cercanos al mensaje por embeddings ([] sin
+        índice o sin vector del mensaje)."""
+        if self._vectores is None or vector is None: return []
+        modelo, embedding = vector
+        return [rid for rid, _ in self._vectores.buscar(embedding, self.k_relevantes, modelo, self.min_similitud)]
+
+    def indexar_vectores(self):
+        """Encola los recuerdos que aún no tienen vector (al arrancar no se
+        recalcula nada de lo que ya está en memoria_vectores.npy)."""
+        if self._vectores is None or self.embeber is None: return
+        with self._lock_recuerdos:
+            faltan = [r for r in self._data.get("recuerdos", []) if not self._vectores.contiene(r["id"])]
+        if faltan: self.embeber(faltan, self._recibir_vectores)
+
+    def _recibir_vectores(self, ids: list, matriz, modelo: str):
+        # Desde el hilo del motor. Si cambió el modelo de embeddings el índice se
+        # vacía: se vuelven a encolar todos los recuerdos.
+        if not self._vectores.agregar(ids, matriz, modelo): self.indexar_vectores()
+
     def procesar_mensaje_usuario(self, mensaje: str) -> Optional[str]:
         """
         Analiza el mensaje del usuario en busca de:
@@ -232,19 +384,38 @@ class MemoriaManager:
                     self._data["usuario"]["nombre"] = nombre
                 tipo = self._detectar_tipo(contenido)
                 rid = self.agregar_recuerdo(contenido, tipo)
-                self._guardar()
+                if "llamo" in patron or "nombre" in patron: self._guardar(("clave", "usuario"))
                 emoji = TIPOS_RECUERDO.get(tipo, "")
                 return f"{emoji} Anotado: *{contenido}*"
 
         return None  # conversación normal
 
-    def procesar_respuesta_lune(self, respuesta: str):
+    def procesar_respuesta_lune(self, respuesta: str, mensaje_usuario: str = ""):
         """
-        Extrae hechos implícitos de la respuesta de Lune
-        (p.ej. si Lune confirma algo, lo guarda como hecho).
+        Extrae hechos implícitos del intercambio (p.ej. gustos o planes que
+        mencionó el usuario) y los guarda como recuerdos. La extracción usa el
+        modelo local en segundo plano; lo ya extraído se guarda aquí.
         Llamar después de recibir cada respuesta completa.
         """
-        self._guardar()
+        if self.extractor is not None and mensaje_usuario:
+            self.extractor(mensaje_usuario, respuesta, self._recibir_hechos)
+        self._aplicar_hechos_pendientes()
+        self._guardar(("clave", "estadisticas"), contexto=False)
+
+    def _recibir_hechos(self, hechos: list):
+        # Desde el hilo del motor: se encolan y se guardan en la próxima lectura
+        if not hechos: return
+        self._hechos_pendientes.extend(hechos)
+        self._avisar_cambio()
+
+    def _aplicar_hechos_pendientes(self):
+        if not self._hechos_pendientes: return
+        conocidos = {r["contenido"].strip().lower() for r in self._data.get("recuerdos", [])}
+        while self._hechos_pendientes:
+            hecho = self._hechos_pendientes.popleft()
+            if hecho.lower() in conocidos: continue
+            conocidos.add(hecho.lower())
+            self.agregar_recuerdo(hecho, tipo=self._detectar_tipo(hecho), tags=["auto"])
 
     def agregar_recuerdo(
         self,
@@ -261,9 +432,14 @@ class MemoriaManager:
             "contenido": contenido,
             "tags": tags or [],
         }
-        self._data["recuerdos"].append(recuerdo)
+        with self._lock_recuerdos:
+            self._data["recuerdos"].append(recuerdo)
+            if self._indice is not None:
+                self._indice.agregar(recuerdo); self._por_id[rid] = recuerdo
         self._recuerdos_nuevos_sesion.append(rid)
-        self._guardar()
+        if self._vectores is not None and self.embeber is not None:
+            self.embeber([recuerdo], self._recibir_vectores)
+        self._guardar(("recuerdo", recuerdo))
         return rid
 
     def cerrar_sesion(self, resumen: str = ""):
@@ -271,10 +447,14 @@ class MemoriaManager:
         Llama esto al cerrar la app.
         Guarda el resumen de la sesión actual como contexto para la próxima.
         """
+        self._aplicar_hechos_pendientes()
         if resumen:
             self._data["resumen_sesion_anterior"] = resumen[:500]
         self._data["estadisticas"]["ultima_sesion"] = datetime.now().isoformat()
-        self._guardar()
+        self._guardar(("clave", "resumen_sesion_anterior"), ("clave", "estadisticas"))
+        self._almacen.cerrar(self._data)
+        if self._vectores is not None:
+            self._vectores.compactar(); self._vectores.cerrar()
 
     def get_nombre_usuario(self) -> Optional[str]:
         return self._data.get("usuario", {}).get("nombre")
@@ -336,17 +516,25 @@ class MemoriaManager:
         if idx is None:
             return f"No encontré ningún recuerdo con *'{fragmento}'*. Usa /memoria para ver los IDs."
 
-        borrado = recuerdos.pop(idx)
-        self._guardar()
+        with self._lock_recuerdos:
+            borrado = recuerdos.pop(idx)
+            if self._indice is not None:
+                self._indice.quitar(borrado["id"]); self._por_id.pop(borrado["id"], None)
+        if self._vectores is not None: self._vectores.borrar(borrado["id"])
+        self._guardar(("olvidar", borrado["id"]))
         return f"Olvidado: *{borrado['contenido']}*"
 
     def _cmd_olvida_todo(self) -> str:
         n = len(self._data.get("recuerdos", [])) + len(self._data.get("datos_clave", {}))
-        self._data["recuerdos"] = []
+        with self._lock_recuerdos:
+            self._data["recuerdos"] = []
+            self._indice = None; self._por_id = {}
+        if self._vectores is not None: self._vectores.vaciar()
         self._data["datos_clave"] = {}
         self._data["usuario"]["nombre"] = None
         self._data["resumen_sesion_anterior"] = ""
-        self._guardar()
+        self._guardar(("olvidar_todo", None), ("clave", "datos_clave"), ("clave", "usuario"),
+                      ("clave", "resumen_sesion_anterior"))
         return f"Memoria borrada. Eliminé {n} datos. Empezamos de cero."
 
     def _detectar_tipo(self, texto: str) -> str:
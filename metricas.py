@@ -0,0 +1,170 @@
+"""
+metricas.py — Instrumentación de latencia y rendimiento de las peticiones de IA.
+================================================================
+Cada petición de chat deja un RegistroPeticion con sus tiempos, medidos con
+time.perf_counter() en los puntos del recorrido:
+
+    AIWorker.start ──espera_cola──▶ AIManager.chat ──conexion──▶ cabeceras HTTP
+        ──ttft──▶ primer token ──...──▶ último token (duracion, tokens/s)
+
+además del tamaño del payload enviado/recibido, la cancelación (y cuánto
+tardó en hacerse efectiva), errores y aciertos de caché.
+
+Los registros van a un buffer circular en memoria (Metricas) que resume por
+proveedor/modelo con percentiles p50/p90/p99 y se exporta en JSONL a
+paths.logs (una línea por petición, solo las nuevas desde la última exportación).
+"""
+import json
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import Deque, Dict, List, Optional
+
+# Métricas con percentiles en el resumen
+CAMPOS_PERCENTIL = ("espera_cola_ms", "conexion_ms", "ttft_ms", "duracion_ms", "tokens_s", "bytes_enviados",
+                    "prompt_tokens", "prompt_ms")
+
+
+def percentil(valores: List[float], p: float) -> Optional[float]:
+    """Percentil por rango más cercano sobre una lista ya ordenada."""
+    if not valores: return None
+    i = min(len(valores) - 1, max(0, int(round(p / 100 * len(valores) + 0.5)) - 1))
+    return valores[i]
+
+
+def _ms(desde: Optional[float], hasta: Optional[float]) -> Optional[float]:
+    if desde is None or hasta is None: return None
+    return round((hasta - desde) * 1000, 1)
+
+
+class RegistroPeticion:
+    """Tiempos y tamaños de una petición de chat (instantes en perf_counter)."""
+
+    def __init__(self, proveedor: str, modelo: str = "", encolado: Optional[float] = None):
+        self.proveedor = proveedor
+        self.modelo = modelo or ""
+        self.fecha = time.time()
+        self.inicio = time.perf_counter()
+        self.encolado = encolado if encolado is not None else self.inicio
+        self.conectado: Optional[float] = None
+        self.primer_token: Optional[float] = None
+        self.fin: Optional[float] = None
+        self.tokens = 0
+        self.bytes_enviados = 0
+        self.bytes_recibidos = 0
+        self.reintentos = 0
+        self.cache: Optional[str] = None          # "exacta" | "semantica"
+        self.cancelado = False
+        self.cancelacion_ms: Optional[float] = None
+        self.error = False
+        # Ollama: estado de la caché de prefijo y prompt realmente procesado
+        self.prefijo: Optional[str] = None        # "reutilizado" | "parcial" | "nuevo"
+        self.prompt_tokens: Optional[int] = None
+        self.prompt_ms: Optional[float] = None
+
+    def token(self):
+        if self.primer_token is None: self.primer_token = time.perf_counter()
+        self.tokens += 1
+
+    def anotar_stream(self, control):
+        """Copia lo que el transporte midió en el ControlStream."""
+        if control is None: return
+        self.conectado = control.conectado_en
+        self.bytes_enviados = control.bytes_enviados
+        self.bytes_recibidos = control.bytes_recibidos
+        self.reintentos = control.reintentos
+
+    def anotar_prompt(self, tokens: Optional[int], duracion_ns: Optional[int]):
+        self.prompt_tokens = tokens
+        self.prompt_ms = round(duracion_ns / 1e6, 1) if duracion_ns else None
+
+    def terminar(self):
+        self.fin = time.perf_counter()
+
+    def a_dict(self) -> dict:
+        fin = self.fin if self.fin is not None else time.perf_counter()
+        generando = fin - self.primer_token if self.primer_token is not None else 0
+        return {
+            "fecha": round(self.fecha, 3), "proveedor": self.proveedor, "modelo": self.modelo,
+            "espera_cola_ms": _ms(self.encolado, self.inicio),
+            "conexion_ms": _ms(self.inicio, self.conectado),
+            "ttft_ms": _ms(self.inicio, self.primer_token),
+            "duracion_ms": _ms(self.inicio, fin),
+            "tokens": self.tokens,
+            # El primer token marca el arranque: la tasa se mide sobre los siguientes
+            "tokens_s": round((self.tokens - 1) / generando, 1)
+                        if self.tokens > 1 and generando > 0 and not self.cache else None,
+            "bytes_enviados": self.bytes_enviados, "bytes_recibidos": self.bytes_recibidos,
+            "reintentos": self.reintentos, "cache": self.cache, "cancelado": self.cancelado,
+            "cancelacion_ms": self.cancelacion_ms, "error": self.error,
+            "prefijo": self.prefijo, "prompt_tokens": self.prompt_tokens, "prompt_ms": self.prompt_ms,
+        }
+
+
+class Metricas:
+    """Buffer circular de registros con resumen por percentiles y exportación JSONL."""
+
+    def __init__(self, max_registros: int = 2000):
+        self._registros: Deque[dict] = deque(maxlen=max_registros)
+        self._lock = threading.Lock()            # se escribe en el motor y se lee desde la UI
+        self._total = 0                          # registros agregados desde el arranque
+        self._exportados = 0                     # de ellos, cuántos ya están en disco
+
+    def nueva(self, proveedor: str, modelo: str = "", encolado: Optional[float] = None) -> RegistroPeticion:
+        return RegistroPeticion(proveedor, modelo, encolado)
+
+    def registrar(self, registro: RegistroPeticion) -> dict:
+        if registro.fin is None: registro.terminar()
+        datos = registro.a_dict()
+        with self._lock:
+            self._registros.append(datos)
+            self._total += 1
+        return datos
+
+    def registros(self) -> List[dict]:
+        with self._lock:
+            return list(self._registros)
+
+    def resumen(self) -> Dict[str, dict]:
+        """Resumen por "proveedor:modelo" con conteos y percentiles."""
+        grupos: Dict[str, List[dict]] = {}
+        for r in self.registros():
+            grupos.setdefault(f"{r['proveedor']}:{r['modelo']}", []).append(r)
+
+        resumen = {}
+        for clave, registros in grupos.items():
+            # Los aciertos de caché no pasan por la red: no cuentan para latencias
+            reales = [r for r in registros if not r["cache"] and not r["error"]]
+            fila = {
+                "peticiones": len(registros),
+                "aciertos_cache": sum(1 for r in registros if r["cache"]),
+                "cancelaciones": sum(1 for r in registros if r["cancelado"]),
+                "errores": sum(1 for r in registros if r["error"]),
+                "reintentos": sum(r.get("reintentos", 0) for r in registros),
+            }
+            prefijos = [r["prefijo"] for r in reales if r.get("prefijo")]
+            if prefijos: fila["prefijo_reutilizado"] = round(prefijos.count("reutilizado") / len(prefijos), 3)
+            for campo in CAMPOS_PERCENTIL:
+                valores = sorted(r[campo] for r in reales if r[campo] is not None)
+                if valores:
+                    fila[campo] = {"p50": percentil(valores, 50), "p90": percentil(valores, 90),
+                                   "p99": percentil(valores, 99)}
+            resumen[clave] = fila
+        return resumen
+
+    def exportar(self, ruta: Path) -> int:
+        """Añade al JSONL los registros aún no exportados; devuelve cuántos."""
+        with self._lock:
+            nuevos = min(self._total - self._exportados, len(self._registros))
+            pendientes = list(self._registros)[len(self._registros) - nuevos:] if nuevos else []
+            self._exportados = self._total
+        if not pendientes: return 0
+        ruta = Path(ruta)
+        try:
+            ruta.parent.mkdir(parents=True, exist_ok=True)
+            with open(ruta, "a", encoding="utf-8") as f:
+                f.writelines(json.dumps(r, ensure_ascii=False) + "\n" for r in pendientes)
+        except OSError:
+            return 0
+        return len(pendientes)
@@ -27,11 +27,14 @@ import json
 import base64
 import struct
 from pathlib import Path
-from typing import List, Dict, Optional
+from typing import Callable, List, Dict, Optional
 
 _ROOT = Path(__file__).parent
 _PATH = _ROOT / "datos.json"
 
+# Avisos tras cada guardado (p.ej. invalidar el system prompt cacheado)
+_al_guardar: List[Callable[[], None]] = []
+
 
 # ── Carga / guardado de datos.json ──────────────────────────────────────────────
 
@@ -44,6 +47,12 @@ def _load() -> dict:
 
 def _save(data: dict):
     _PATH.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+    for aviso in _al_guardar: aviso()
+
+
+def al_guardar(aviso: Callable[[], None]):
+    """Registra una función a llamar cada vez que cambian los personajes."""
+    _al_guardar.append(aviso)
 
 
 # ── API pública ─────────────────────────────────────────────────────────────────
@@ -0,0 +1,180 @@
+"""
+planificador.py — Turnos por host, reintentos y límites de peticiones (429).
+================================================================
+TransporteHTTP pide turno aquí antes de cada petición:
+
+  • Pool explícito por host: como mucho N peticiones a la vez contra cada
+    host (conexiones_host, p.ej. Ollama local 4, openrouter.ai 8). Las demás
+    esperan su turno en cola, en orden de llegada.
+  • Límite de peticiones: se leen Retry-After y X-RateLimit-Remaining/Reset
+    de cada respuesta. Si el host avisa de que no quedan peticiones (o
+    responde 429), las siguientes se encolan hasta el reinicio en lugar de
+    fallar; solo se rinden si la espera pasaría de max_espera_limite_s.
+  • Reintentos antes del primer token: ante un corte de conexión, 429 o
+    502/503/504 se repite la petición (aún no se ha entregado nada, así que
+    es idempotente para quien la consume) con backoff exponencial y jitter
+    completo: espera aleatoria en [0, min(backoff_max, base·2^intento)].
+
+Todo corre en el loop del motor (AIEngine): sin locks, con asyncio.
+"""
+import asyncio
+import random
+import time
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+# Códigos que merece la pena reintentar (el servidor no llegó a procesar la petición)
+REINTENTABLES = {429, 502, 503, 504}
+
+
+class ErrorLimite(Exception):
+    """El host limita las peticiones y la espera supera el máximo configurado."""
+
+    def __init__(self, host: str, espera_s: float):
+        super().__init__(f"{host} limita las peticiones: reintenta en {espera_s:.0f} s")
+        self.host = host
+        self.espera_s = espera_s
+
+
+def host_de(url: str) -> str:
+    return urlsplit(url).netloc.lower()
+
+
+def segundos_hasta(valor: Optional[str], ahora: Optional[float] = None) -> Optional[float]:
+    """Interpreta Retry-After / X-RateLimit-Reset: segundos, época en s o ms, o fecha HTTP."""
+    if not valor: return None
+    ahora = time.time() if ahora is None else ahora
+    try:
+        n = float(valor)
+    except ValueError:
+        try: return max(0.0, parsedate_to_datetime(valor).timestamp() - ahora)
+        except (TypeError, ValueError): return None
+    if n > 1e12: return max(0.0, n / 1000 - ahora)     # época en milisegundos (OpenRouter)
+    if n > 1e9: return max(0.0, n - ahora)             # época en segundos
+    return max(0.0, n)                                 # segundos de espera
+
+
+class EstadoHost:
+    """Turnos y límite de peticiones de un host."""
+
+    def __init__(self, host: str, conexiones: int):
+        self.host = host
+        self.conexiones = conexiones
+        self.en_curso = 0
+        self.en_cola = 0
+        self.bloqueado_hasta = 0.0        # time.monotonic() hasta el que no se envía nada
+        self.restantes: Optional[int] = None
+        self.limitadas = 0                # respuestas 429 recibidas
+        self._libre: Optional[asyncio.Condition] = None
+
+    def _condicion(self) -> asyncio.Condition:
+        # Perezosa: se crea dentro del loop del motor
+        if self._libre is None: self._libre = asyncio.Condition()
+        return self._libre
+
+    def stats(self) -> dict:
+        return {"conexiones": self.conexiones, "en_curso": self.en_curso, "en_cola": self.en_cola,
+                "restantes": self.restantes, "limitadas": self.limitadas,
+                "bloqueado_s": round(max(0.0, self.bloqueado_hasta - time.monotonic()), 1)}
+
+
+class Turno:
+    """Hueco concedido por el planificador; liberar() al terminar la petición."""
+
+    def __init__(self, planificador: "Planificador", estado: EstadoHost):
+        self._planificador = planificador
+        self.estado = estado
+        self._liberado = False
+
+    def liberar(self):
+        if self._liberado: return
+        self._liberado = True
+        self._planificador._liberar(self.estado)
+
+
+class Planificador:
+    def __init__(self, conexiones_por_host: int = 8, conexiones_host: Optional[Dict[str, int]] = None,
+                 reintentos: int = 3, backoff_base_ms: float = 250, backoff_max_ms: float = 4000,
+                 max_espera_limite_s: float = 60):
+        self.hosts: Dict[str, EstadoHost] = {}
+        self.configurar(conexiones_por_host, conexiones_host, reintentos, backoff_base_ms,
+                        backoff_max_ms, max_espera_limite_s)
+
+    def configurar(self, conexiones_por_host: int = 8, conexiones_host: Optional[Dict[str, int]] = None,
+                   reintentos: int = 3, backoff_base_ms: float = 250, backoff_max_ms: float = 4000,
+                   max_espera_limite_s: float = 60):
+        self.conexiones_por_host = max(1, int(conexiones_por_host))
+        self.conexiones_host = {h.lower(): max(1, int(n)) for h, n in (conexiones_host or {}).items()}
+        self.reintentos = max(0, int(reintentos))
+        self.backoff_base_ms = backoff_base_ms
+        self.backoff_max_ms = backoff_max_ms
+        self.max_espera_limite_s = max_espera_limite_s
+        for estado in self.hosts.values(): estado.conexiones = self.conexiones_de(estado.host)
+
+    def conexiones_de(self, host: str) -> int:
+        return self.conexiones_host.get(host, self.conexiones_por_host)
+
+    def estado(self, url: str) -> EstadoHost:
+        host = host_de(url)
+        e = self.hosts.get(host)
+        if e is None: e = self.hosts[host] = EstadoHost(host, self.conexiones_de(host))
+        return e
+
+    # ── Turnos ────────────────────────────────────────────────────────────────
+
+    async def turno(self, url: str) -> Turno:
+        """Espera hueco libre en el host y a que su límite de peticiones lo permita."""
+        e = self.estado(url)
+        libre = e._condicion()
+        e.en_cola += 1
+        try:
+            async with libre:
+                while True:
+                    espera = e.bloqueado_hasta - time.monotonic()
+                    if espera > self.max_espera_limite_s: raise ErrorLimite(e.host, espera)
+                    if espera <= 0 and e.en_curso < e.conexiones: break
+                    try:
+                        await asyncio.wait_for(libre.wait(), timeout=espera if espera > 0 else None)
+                    except asyncio.TimeoutError:
+                        pass
+                e.en_curso += 1
+        finally:
+            e.en_cola -= 1
+        return Turno(self, e)
+
+    def _liberar(self, e: EstadoHost):
+        e.en_curso -= 1
+        libre = e._condicion()
+
+        async def _avisar():
+            async with libre: libre.notify()
+        asyncio.ensure_future(_avisar())
+
+    # ── Respuestas ────────────────────────────────────────────────────────────
+
+    def anotar(self, url: str, status: int, cabeceras) -> Optional[float]:
+        """Lee las cabeceras de límite de la respuesta. Devuelve cuántos segundos
+        hay que esperar antes de volver a pedir (None si no hace falta)."""
+        e = self.estado(url)
+        restantes = cabeceras.get("X-RateLimit-Remaining") if cabeceras else None
+        try: e.restantes = int(float(restantes)) if restantes is not None else e.restantes
+        except ValueError: pass
+        espera = None
+        if status == 429:
+            e.limitadas += 1
+            espera = segundos_hasta(cabeceras.get("Retry-After")) if cabeceras else None
+            if espera is None and cabeceras: espera = segundos_hasta(cabeceras.get("X-RateLimit-Reset"))
+        elif e.restantes == 0 and cabeceras:
+            espera = segundos_hasta(cabeceras.get("X-RateLimit-Reset"))
+        if espera:
+            e.bloqueado_hasta = max(e.bloqueado_hasta, time.monotonic() + espera)
+        return espera
+
+    def backoff(self, intento: int) -> float:
+        """Segundos a esperar antes del reintento `intento` (0, 1, ...): jitter completo."""
+        tope = min(self.backoff_max_ms, self.backoff_base_ms * (2 ** intento))
+        return random.uniform(0, tope) / 1000
+
+    def stats(self) -> Dict[str, dict]:
+        return {host: e.stats() for host, e in self.hosts.items()}
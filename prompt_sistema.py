@@ -0,0 +1,105 @@
+"""
+prompt_sistema.py — System prompt por segmentos cacheados.
+================================================================
+El system prompt de cada mensaje se compone de tres segmentos, siempre en el
+mismo orden, de lo más estable a lo más variable:
+
+    personaje  →  reglas de herramientas  →  memoria del usuario
+
+Cada segmento se calcula una vez y se guarda hasta que algo lo invalida:
+
+  • personaje     personajes._save (cambio de personaje activo, edición,
+                  importación) avisa mediante personajes.al_guardar.
+  • herramientas  texto fijo de tools.REGLAS_PROMPT; invalidar("herramientas")
+                  si cambia el registro de herramientas.
+  • memoria       MemoriaManager.al_cambiar al guardar un recuerdo, aplicar
+                  hechos extraídos, olvidar o cerrar la sesión. Solo lleva lo
+                  estable (nombre, datos clave, resumen de la sesión anterior).
+
+construir() devuelve el prompt ya ensamblado sin leer datos.json ni volver a
+concatenar nada mientras no haya invalidaciones. El system prompt es el primer
+mensaje y el historial va detrás: Ollama solo reutiliza lo ya procesado si el
+system prompt es idéntico byte a byte. Por eso nada que dependa del mensaje
+actual entra aquí: los recuerdos relevantes para cada mensaje van en un turno
+aparte tras el historial, justo antes del mensaje del usuario (ver
+MemoriaManager.contexto_para_mensaje y el parámetro `contexto` de
+AIManager.chat). Un cambio en la memoria sí altera el system prompt y obliga a
+reprocesar el prompt completo, pero eso pasa pocas veces por sesión.
+
+Uso:
+    prompt = prompt_sistema.crear(memoria, tools)
+    system_prompt = prompt.construir()
+"""
+import threading
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+import personajes
+
+CABECERA_MEMORIA = "\n\nCONTEXTO DE MEMORIA DEL USUARIO:\n"
+
+
+class PromptSistema:
+    """Segmentos con caché e invalidación explícita, ensamblados en orden fijo."""
+
+    def __init__(self, fuentes: Sequence[Tuple[str, Callable[[], str]]]):
+        self._fuentes = list(fuentes)
+        self._textos: Dict[str, Optional[str]] = {nombre: None for nombre, _ in self._fuentes}
+        self._prompt: Optional[str] = None
+        self._version = 0
+        # Las invalidaciones pueden llegar desde otro hilo (hechos extraídos en el motor)
+        self._lock = threading.Lock()
+        self.reconstrucciones: Dict[str, int] = {nombre: 0 for nombre, _ in self._fuentes}
+
+    def invalidar(self, *segmentos: str):
+        """Marca segmentos para recalcular (todos si no se indica ninguno)."""
+        with self._lock:
+            for nombre in segmentos or list(self._textos):
+                if nombre in self._textos: self._textos[nombre] = None
+            self._prompt = None
+            self._version += 1
+
+    def segmento(self, nombre: str) -> str:
+        fuente = dict(self._fuentes)[nombre]
+        # Segundo intento si se invalidó mientras se calculaba: la propia fuente
+        # puede provocarlo (la memoria guarda al aplicar hechos pendientes).
+        for _ in range(2):
+            with self._lock:
+                texto, version = self._textos[nombre], self._version
+            if texto is not None: return texto
+            texto = fuente() or ""
+            self.reconstrucciones[nombre] += 1
+            with self._lock:
+                if version == self._version:
+                    self._textos[nombre] = texto
+                    break
+        return texto
+
+    def construir(self) -> str:
+        with self._lock:
+            prompt, version = self._prompt, self._version
+        if prompt is not None: return prompt
+        prompt = "".join(self.segmento(nombre) for nombre, _ in self._fuentes)
+        with self._lock:
+            if version == self._version: self._prompt = prompt
+        return prompt
+
+    def stats(self) -> dict:
+        return {"en_cache": [n for n, t in self._textos.items() if t is not None],
+                "reconstrucciones": dict(self.reconstrucciones)}
+
+
+def crear(memoria, tools) -> PromptSistema:
+    """PromptSistema de la app de escritorio, enganchado a sus invalidaciones."""
+
+    def _memoria() -> str:
+        contexto = memoria.obtener_contexto_para_prompt()
+        return CABECERA_MEMORIA + contexto if contexto else ""
+
+    prompt = PromptSistema([
+        ("personaje", lambda: personajes.build_system_prompt(personajes.get_activo())),
+        ("herramientas", tools.reglas_prompt),
+        ("memoria", _memoria),
+    ])
+    personajes.al_guardar(lambda: prompt.invalidar("personaje"))
+    memoria.al_cambiar = lambda: prompt.invalidar("memoria")
+    return prompt
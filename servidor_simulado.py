@@ -0,0 +1,299 @@
+"""
+servidor_simulado.py — Servidor LLM local de pruebas (Ollama + OpenRouter).
+================================================================
+Sustituto local para medir ai_manager.py sin red ni modelos reales (CI,
+benchmarks reproducibles). Solo usa la biblioteca estándar y habla los dos
+protocolos que consume la app:
+
+  • Ollama:      POST /api/chat (NDJSON en streaming o JSON completo),
+                 POST /api/generate (precarga), POST /api/embed, GET /api/tags
+  • OpenRouter:  POST /api/v1/chat/completions (SSE estilo OpenAI, con
+                 comentarios keep-alive y `data: [DONE]`)
+
+Todo es configurable con OpcionesSimulador: tokens por segundo, retardo del
+primer token, tokens por respuesta y caracteres por token (tamaño del
+payload), errores inyectados (HTTP de error o corte a mitad del stream) y
+un límite de peticiones por ventana que responde 429 con Retry-After y
+cabeceras X-RateLimit-* (como OpenRouter).
+El texto y los fallos salen de un generador con semilla: la misma
+configuración produce siempre la misma secuencia.
+
+Uso:
+    python servidor_simulado.py --puerto 11434 --tokens-s 40 --primer-token-ms 300
+    servidor, url = iniciar(OpcionesSimulador(tokens_s=200))   # en un hilo (ver carga.py)
+"""
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Tuple
+
+_PALABRAS = ["Hola", "claro", "Lune", "te", "ayudo", "con", "eso", "ahora", "mismo", "vale", "listo", "bien"]
+
+
+class OpcionesSimulador:
+    """Comportamiento del servidor simulado."""
+
+    def __init__(self, tokens_s: float = 50.0, primer_token_ms: float = 200.0, tokens: int = 60,
+                 caracteres_token: int = 4, prob_error: float = 0.0, codigo_error: int = 500,
+                 prob_corte: float = 0.0, semilla: int = 1234, modelo: str = "simulado",
+                 limite_peticiones: int = 0, ventana_s: float = 10.0):
+        self.tokens_s = tokens_s                  # 0 = sin pausa entre tokens
+        self.primer_token_ms = primer_token_ms
+        self.tokens = tokens                      # tokens por respuesta
+        self.caracteres_token = caracteres_token
+        self.prob_error = prob_error              # responde codigo_error antes de empezar
+        self.codigo_error = codigo_error
+        self.prob_corte = prob_corte              # corta la conexión a mitad del stream
+        self.limite_peticiones = limite_peticiones  # de chat por ventana_s (0 = sin límite)
+        self.ventana_s = ventana_s
+        self.semilla = semilla
+        self.modelo = modelo
+
+
+class _Manejador(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"            # keep-alive, como los servidores reales
+    server: "ServidorSimulado"
+
+    def log_message(self, *args): pass
+
+    # ── Utilidades ────────────────────────────────────────────────────────────
+
+    def _cabeceras_limite(self):
+        for nombre, valor in getattr(self, "_limite", {}).items(): self.send_header(nombre, valor)
+
+    def _json(self, codigo: int, datos: dict):
+        cuerpo = json.dumps(datos, ensure_ascii=False).encode("utf-8")
+        self.send_response(codigo)
+        self._cabeceras_limite()
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(cuerpo)))
+        self.end_headers()
+        try:
+            self.wfile.write(cuerpo)
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True         # el cliente canceló
+
+    def _leer(self) -> dict:
+        n = int(self.headers.get("Content-Length") or 0)
+        try:
+            return json.loads(self.rfile.read(n) or b"{}")
+        except ValueError:
+            return {}
+
+    def _abrir_stream(self, tipo: str):
+        self.send_response(200)
+        self._cabeceras_limite()
+        self.send_header("Content-Type", tipo)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def _fragmento(self, datos: bytes):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(datos), datos))
+        self.wfile.flush()
+
+    def _cerrar_stream(self):
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def _cortar(self):
+        # Conexión caída a mitad de respuesta: sin el fragmento final de chunked
+        self.server.cortes += 1
+        self.close_connection = True
+
+    # ── Rutas ─────────────────────────────────────────────────────────────────
+
+    def do_GET(self):
+        if self.path.startswith("/api/tags"):
+            self._json(200, {"models": [{"name": self.server.opciones.modelo}]})
+        elif self.path.startswith("/api/version"):
+            self._json(200, {"version": "simulado"})
+        else:
+            self._json(404, {"error": "ruta desconocida"})
+
+    def do_POST(self):
+        cuerpo = self._leer()
+        rng = self.server.nuevo_rng()
+        op = self.server.opciones
+        if self.path.startswith("/api/embed"):
+            entradas = cuerpo.get("input")
+            entradas = entradas if isinstance(entradas, list) else [entradas or ""]
+            return self._json(200, {"embeddings": [_vector(str(t)) for t in entradas]})
+        if self.path.startswith("/api/generate"):
+            return self._json(200, {"model": op.modelo, "response": "", "done": True})
+
+        openai = self.path.rstrip("/").endswith("/chat/completions")
+        if not openai and not self.path.startswith("/api/chat"):
+            return self._json(404, {"error": "ruta desconocida"})
+        self._limite, limitada = self.server.contar_peticion()
+        if limitada:
+            return self._json(429, {"error": {"message": "Rate limit exceeded", "code": 429}})
+        if rng.random() < op.prob_error:
+            self.server.errores += 1
+            return self._json(op.codigo_error, {"error": {"message": "error simulado", "code": op.codigo_error}})
+
+        mensajes = cuerpo.get("messages") or []
+        prompt_tokens = max(1, sum(len(str(m.get("content", ""))) for m in mensajes) // 4)
+        tokens = [_token(rng, op.caracteres_token) for _ in range(op.tokens)]
+        corte = rng.randrange(1, max(2, len(tokens))) if rng.random() < op.prob_corte else None
+
+        if cuerpo.get("stream") is False:
+            time.sleep(op.primer_token_ms / 1000)
+            texto = "".join(tokens)
+            if openai:
+                return self._json(200, {"choices": [{"message": {"role": "assistant", "content": texto}}]})
+            return self._json(200, {"model": op.modelo, "message": {"role": "assistant", "content": texto},
+                                    "done": True, "prompt_eval_count": prompt_tokens, "eval_count": len(tokens)})
+
+        try:
+            if openai: self._stream_sse(tokens, corte, prompt_tokens)
+            else: self._stream_ndjson(tokens, corte, prompt_tokens)
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True         # el cliente canceló
+
+    def _ritmo(self, inicio: float, i: int):
+        # Reparto uniforme sobre un reloj absoluto (sin deriva acumulada)
+        op = self.server.opciones
+        objetivo = inicio + op.primer_token_ms / 1000 + (i / op.tokens_s if op.tokens_s > 0 else 0)
+        espera = objetivo - time.perf_counter()
+        if espera > 0: time.sleep(espera)
+
+    def _stream_ndjson(self, tokens, corte: Optional[int], prompt_tokens: int):
+        op = self.server.opciones
+        inicio = time.perf_counter()
+        self._abrir_stream("application/x-ndjson")
+        for i, token in enumerate(tokens):
+            if i == corte: return self._cortar()
+            self._ritmo(inicio, i)
+            self._fragmento(json.dumps({"model": op.modelo, "message": {"role": "assistant", "content": token},
+                                        "done": False}, ensure_ascii=False).encode("utf-8") + b"\n")
+        total_ns = int((time.perf_counter() - inicio) * 1e9)
+        self._fragmento(json.dumps({"model": op.modelo, "message": {"role": "assistant", "content": ""},
+                                    "done": True, "done_reason": "stop", "total_duration": total_ns,
+                                    "prompt_eval_count": prompt_tokens,
+                                    "prompt_eval_duration": int(op.primer_token_ms * 1e6),
+                                    "eval_count": len(tokens)}).encode("utf-8") + b"\n")
+        self._cerrar_stream()
+
+    def _stream_sse(self, tokens, corte: Optional[int], prompt_tokens: int):
+        op = self.server.opciones
+        inicio = time.perf_counter()
+        self._abrir_stream("text/event-stream")
+        self._fragmento(b": OPENROUTER PROCESSING\n\n")
+        for i, token in enumerate(tokens):
+            if i == corte: return self._cortar()
+            self._ritmo(inicio, i)
+            evento = {"id": "gen-simulado", "object": "chat.completion.chunk", "model": op.modelo,
+                      "choices": [{"index": 0, "delta": {"role": "assistant", "content": token}}]}
+            self._fragmento(b"data: " + json.dumps(evento, ensure_ascii=False).encode("utf-8") + b"\n\n")
+        final = {"id": "gen-simulado", "object": "chat.completion.chunk", "model": op.modelo,
+                 "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+                 "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens)}}
+        self._fragmento(b"data: " + json.dumps(final).encode("utf-8") + b"\n\n")
+        self._fragmento(b"data: [DONE]\n\n")
+        self._cerrar_stream()
+
+
+def _token(rng: random.Random, caracteres: int) -> str:
+    palabra = rng.choice(_PALABRAS)
+    return " " + (palabra * (caracteres // len(palabra) + 1))[:max(1, caracteres - 1)]
+
+
+def _vector(texto: str, dim: int = 64) -> list:
+    # Embedding determinista a partir del hash del texto
+    semilla = hashlib.sha1(texto.encode("utf-8")).digest()
+    rng = random.Random(semilla)
+    return [rng.uniform(-1, 1) for _ in range(dim)]
+
+
+class ServidorSimulado(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, direccion: Tuple[str, int], opciones: Optional[OpcionesSimulador] = None):
+        super().__init__(direccion, _Manejador)
+        self.opciones = opciones or OpcionesSimulador()
+        self._lock = threading.Lock()
+        self.peticiones = 0
+        self.errores = 0
+        self.cortes = 0
+        self.limitadas = 0
+        self._ventana = []                     # instantes de las peticiones de chat recientes
+
+    def nuevo_rng(self) -> random.Random:
+        # Una secuencia por petición, derivada de la semilla y del orden de llegada
+        with self._lock:
+            self.peticiones += 1
+            n = self.peticiones
+        return random.Random(self.opciones.semilla * 1_000_003 + n)
+
+    @property
+    def url(self) -> str:
+        host, puerto = self.server_address[:2]
+        return f"http://{host}:{puerto}"
+
+    def contar_peticion(self) -> Tuple[dict, bool]:
+        """Aplica el límite por ventana; devuelve (cabeceras X-RateLimit-*, limitada)."""
+        op = self.opciones
+        if op.limite_peticiones <= 0: return {}, False
+        ahora = time.time()
+        with self._lock:
+            self._ventana = [t for t in self._ventana if t > ahora - op.ventana_s]
+            limitada = len(self._ventana) >= op.limite_peticiones
+            if limitada: self.limitadas += 1
+            else: self._ventana.append(ahora)
+            reinicio = self._ventana[0] + op.ventana_s if self._ventana else ahora
+            restantes = op.limite_peticiones - len(self._ventana)
+        cabeceras = {"X-RateLimit-Limit": str(op.limite_peticiones), "X-RateLimit-Remaining": str(restantes),
+                     "X-RateLimit-Reset": str(int(reinicio * 1000))}
+        if limitada: cabeceras["Retry-After"] = str(max(1, round(reinicio - ahora)))
+        return cabeceras, limitada
+
+    def stats(self) -> dict:
+        return {"peticiones": self.peticiones, "errores": self.errores, "cortes": self.cortes,
+                "limitadas": self.limitadas}
+
+
+def iniciar(opciones: Optional[OpcionesSimulador] = None, host: str = "127.0.0.1",
+            puerto: int = 0) -> Tuple[ServidorSimulado, str]:
+    """Arranca el servidor en un hilo demonio (puerto 0 = uno libre). Parar con servidor.shutdown()."""
+    servidor = ServidorSimulado((host, puerto), opciones)
+    threading.Thread(target=servidor.serve_forever, name="servidor-simulado", daemon=True).start()
+    return servidor, servidor.url
+
+
+def agregar_opciones_cli(parser):
+    """Opciones comunes del simulador (también las usa carga.py)."""
+    parser.add_argument("--tokens-s", type=float, default=50.0, help="tokens por segundo (0 = sin pausa)")
+    parser.add_argument("--primer-token-ms", type=float, default=200.0)
+    parser.add_argument("--tokens", type=int, default=60, help="tokens por respuesta")
+    parser.add_argument("--caracteres-token", type=int, default=4)
+    parser.add_argument("--prob-error", type=float, default=0.0)
+    parser.add_argument("--codigo-error", type=int, default=500)
+    parser.add_argument("--prob-corte", type=float, default=0.0)
+    parser.add_argument("--semilla", type=int, default=1234)
+    parser.add_argument("--limite-peticiones", type=int, default=0, help="peticiones de chat por ventana (0 = sin límite)")
+    parser.add_argument("--ventana-s", type=float, default=10.0)
+
+
+def opciones_desde_args(args) -> OpcionesSimulador:
+    return OpcionesSimulador(tokens_s=args.tokens_s, primer_token_ms=args.primer_token_ms, tokens=args.tokens,
+                             caracteres_token=args.caracteres_token, prob_error=args.prob_error,
+                             codigo_error=args.codigo_error, prob_corte=args.prob_corte, semilla=args.semilla,
+                             limite_peticiones=args.limite_peticiones, ventana_s=args.ventana_s)
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Servidor LLM simulado (Ollama + OpenRouter)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--puerto", type=int, default=11434)
+    agregar_opciones_cli(parser)
+    args = parser.parse_args()
+    servidor = ServidorSimulado((args.host, args.puerto), opciones_desde_args(args))
+    print(f"Servidor simulado en {servidor.url}  (Ollama: /api/chat · OpenRouter: /api/v1/chat/completions)")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        print(f"\n{servidor.stats()}")
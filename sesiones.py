@@ -0,0 +1,205 @@
+"""
+sesiones.py — Registro de sesiones de conversación para AIManager.
+================================================================
+Cada conversación (el chat de escritorio, cada usuario de Telegram...) es una
+Sesion con su propio estado por proveedor (Conversacion): historial, marca de
+cancelación, stream en curso y resultado de la última respuesta. Nada de eso
+se comparte entre sesiones, así que varias pueden generar a la vez.
+
+RegistroSesiones las indexa por id de conversación:
+  • LRU con tope de sesiones vivas en memoria; al pasarse, la menos usada se
+    guarda en disco y sale de memoria.
+  • Las inactivas más de `inactividad_s` también se pasan a disco.
+  • Al volver a usarse, una sesión en disco se recarga tal cual (ventana,
+    resumen rodante y contador de descartados).
+  • Las sesiones "fijas" (la de escritorio) nunca se desalojan, y tampoco
+    una sesión con peticiones en curso.
+
+Disco: paths.cache/sesiones/<hash del id>.json, escrito de forma atómica.
+"""
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional
+
+from historial import HistorialConversacion
+
+SESION_ESCRITORIO = "escritorio"
+
+
+class Conversacion:
+    """Estado de una sesión con un proveedor: historial y petición en curso."""
+
+    def __init__(self, historial: Optional[HistorialConversacion] = None):
+        self.historial = historial or HistorialConversacion()
+        self.cancelado = False
+        self.ultimo_ok = False            # la última respuesta terminó bien
+        self.control = None               # ai_http.ControlStream del stream en curso
+        self.ultimo_envio: Optional[list] = None   # último prompt completo (caché de prefijo de Ollama)
+
+    def abortar(self):
+        """Cancelación dura de la petición en curso. Llamar en el loop del motor."""
+        self.cancelado = True
+        if self.control is not None: self.control.abortar()
+
+
+class Sesion:
+    """Una conversación: su estado por proveedor y su uso."""
+
+    def __init__(self, sid: str, nueva_conversacion: Callable[[str, str], Conversacion]):
+        self.id = sid
+        self.conversaciones: Dict[str, Conversacion] = {}
+        self.ultimo_uso = time.time()
+        self.activas = 0                  # peticiones en curso (no se desaloja mientras > 0)
+        self.titulo: Optional[str] = None # lo pone un trabajo de fondo tras el primer turno
+        self.cancelado_en: Optional[float] = None
+        self._nueva_conversacion = nueva_conversacion
+
+    def conv(self, proveedor: str) -> Conversacion:
+        c = self.conversaciones.get(proveedor)
+        if c is None:
+            c = self.conversaciones[proveedor] = self._nueva_conversacion(self.id, proveedor)
+        return c
+
+    def tocar(self):
+        self.ultimo_uso = time.time()
+
+    # ── Serialización ─────────────────────────────────────────────────────────
+
+    def a_dict(self) -> dict:
+        return {
+            "id": self.id, "ultimo_uso": self.ultimo_uso, "titulo": self.titulo,
+            "proveedores": {
+                pid: {"mensajes": list(c.historial), "resumen": c.historial.resumen,
+                      "pendientes_resumen": c.historial.pendientes_resumen,
+                      "descartados": c.historial.descartados}
+                for pid, c in self.conversaciones.items()
+            },
+        }
+
+    def cargar_dict(self, data: dict):
+        self.ultimo_uso = data.get("ultimo_uso", self.ultimo_uso)
+        self.titulo = data.get("titulo")
+        for pid, d in (data.get("proveedores") or {}).items():
+            h = self.conv(pid).historial
+            for m in d.get("mensajes", []): h.append(m)
+            h.resumen = d.get("resumen", "")
+            h.pendientes_resumen = list(d.get("pendientes_resumen", [])) + h.pendientes_resumen
+            h.descartados = d.get("descartados", 0)
+
+
+class RegistroSesiones:
+    """Sesiones por id de conversación, con tope LRU y desalojo a disco."""
+
+    def __init__(self, nueva_conversacion: Callable[[str, str], Conversacion], max_vivas: int = 32,
+                 inactividad_s: float = 1800, directorio: Optional[Path] = None):
+        self._nueva_conversacion = nueva_conversacion
+        self.max_vivas = max_vivas
+        self.inactividad_s = inactividad_s
+        self.directorio = Path(directorio) if directorio else None
+        self._vivas: "OrderedDict[str, Sesion]" = OrderedDict()
+        self._fijas = set()
+        self.desalojadas = 0
+        self.recargadas = 0
+
+    def obtener(self, sid: str = SESION_ESCRITORIO) -> Sesion:
+        """Devuelve la sesión (de memoria, de disco o nueva) y la marca como usada."""
+        sesion = self._vivas.get(sid)
+        if sesion is None:
+            sesion = Sesion(sid, self._nueva_conversacion)
+            data = self._leer(sid)
+            if data is not None:
+                sesion.cargar_dict(data); self.recargadas += 1
+            self._vivas[sid] = sesion
+            self._aplicar_tope(sid)
+        self._vivas.move_to_end(sid)
+        sesion.tocar()
+        return sesion
+
+    def fijar(self, sid: str) -> Sesion:
+        """Sesión que nunca se desaloja (la del chat de escritorio)."""
+        self._fijas.add(sid)
+        return self.obtener(sid)
+
+    def buscar(self, sid: str) -> Optional[Sesion]:
+        """Sesión viva o None, sin tocar el orden LRU (seguro desde el hilo de la UI)."""
+        return self._vivas.get(sid)
+
+    def existe(self, sid: str) -> bool:
+        return sid in self._vivas or (self._ruta(sid) is not None and self._ruta(sid).exists())
+
+    def vivas(self) -> Iterator[Sesion]:
+        return iter(list(self._vivas.values()))
+
+    def ids(self) -> List[str]:
+        return list(self._vivas.keys())
+
+    def eliminar(self, sid: str):
+        """Borra la sesión de memoria y de disco (las fijas solo se vacían)."""
+        if sid in self._fijas:
+            for c in self._vivas[sid].conversaciones.values(): c.historial.limpiar()
+            return
+        self._vivas.pop(sid, None)
+        ruta = self._ruta(sid)
+        if ruta is not None:
+            try: ruta.unlink()
+            except OSError: pass
+
+    # ── Desalojo ──────────────────────────────────────────────────────────────
+
+    def _desalojable(self, sesion: Sesion) -> bool:
+        return sesion.id not in self._fijas and sesion.activas == 0
+
+    def _desalojar(self, sesion: Sesion):
+        self._escribir(sesion)
+        del self._vivas[sesion.id]
+        self.desalojadas += 1
+
+    def _aplicar_tope(self, nueva: Optional[str] = None):
+        # De la menos a la más usada, saltando fijas, ocupadas y la recién creada
+        # (si todas están ocupadas se supera el tope temporalmente)
+        for sesion in list(self._vivas.values()):
+            if len(self._vivas) <= self.max_vivas: break
+            if sesion.id != nueva and self._desalojable(sesion): self._desalojar(sesion)
+
+    def desalojar_inactivas(self) -> int:
+        limite = time.time() - self.inactividad_s
+        inactivas = [s for s in self._vivas.values() if s.ultimo_uso < limite and self._desalojable(s)]
+        for sesion in inactivas: self._desalojar(sesion)
+        antes = self.desalojadas
+        self._aplicar_tope()      # las que superaron el tope mientras estaban ocupadas
+        return len(inactivas) + self.desalojadas - antes
+
+    def guardar_todas(self):
+        for sesion in self._vivas.values():
+            if sesion.id not in self._fijas: self._escribir(sesion)
+
+    def stats(self) -> dict:
+        return {"vivas": len(self._vivas), "desalojadas": self.desalojadas, "recargadas": self.recargadas}
+
+    # ── Disco ─────────────────────────────────────────────────────────────────
+
+    def _ruta(self, sid: str) -> Optional[Path]:
+        if not self.directorio: return None
+        return self.directorio / (hashlib.sha1(sid.encode("utf-8")).hexdigest()[:20] + ".json")
+
+    def _leer(self, sid: str) -> Optional[dict]:
+        ruta = self._ruta(sid)
+        if ruta is None: return None
+        try:
+            return json.loads(ruta.read_text("utf-8"))
+        except (OSError, ValueError):
+            return None
+
+    def _escribir(self, sesion: Sesion):
+        ruta = self._ruta(sesion.id)
+        if ruta is None: return
+        try:
+            ruta.parent.mkdir(parents=True, exist_ok=True)
+            tmp = ruta.with_suffix(".tmp")
+            tmp.write_text(json.dumps(sesion.a_dict(), ensure_ascii=False), encoding="utf-8")
+            tmp.replace(ruta)
+        except OSError:
+            pass
@@ -0,0 +1,227 @@
+"""
+stream_parser.py — Parsers incrementales de streams NDJSON (Ollama) y SSE (OpenRouter).
+================================================================
+Trabajan directamente sobre los bloques de bytes que llegan del socket:
+
+  • Sin decodificar cada línea a str: se recorren con bytes.find() y se
+    entregan como memoryview (sin copiar) al decodificador JSON.
+  • Líneas partidas entre dos lecturas: solo el trozo final incompleto se
+    guarda y se une con el bloque siguiente.
+  • Keep-alives y comentarios SSE (": OPENROUTER PROCESSING"), líneas vacías
+    y campos event:/id:/retry: se descartan mirando el primer byte.
+  • JSON rápido: orjson si está instalado (acepta memoryview tal cual); si no,
+    json de la biblioteca estándar.
+
+Uso:
+    parser = ParserNDJSON()            # o ParserSSE()
+    async for bloque in transporte.stream_chunks(url, payload):
+        for evento in parser.feed(bloque): ...
+        if parser.terminado: break      # [DONE] en SSE
+
+Micro-benchmark (coste de parseo por token, sobre streams grabados o sintéticos):
+    python stream_parser.py [grabacion.ndjson|grabacion.sse ...]
+Para grabar un stream real:  curl -N <url> -d @peticion.json > grabacion.sse
+"""
+import json
+from typing import Iterator, List
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+if orjson is not None:
+    loads = orjson.loads
+    JSONError = orjson.JSONDecodeError
+else:
+    def loads(datos):
+        return json.loads(bytes(datos) if isinstance(datos, memoryview) else datos)
+    JSONError = json.JSONDecodeError
+
+_LF = b"\n"
+_CR = 0x0D
+_DOS_PUNTOS = 0x3A
+_DATA = b"data:"
+_DONE = b"[DONE]"
+
+
+class _ParserLineas:
+    """Base: corta bloques de bytes en líneas (memoryview) sin copiarlas."""
+
+    def __init__(self):
+        self._resto = b""          # línea incompleta del bloque anterior
+        self.lineas = 0
+        self.descartadas = 0       # keep-alives, comentarios, JSON inválido
+
+    def _lineas(self, bloque) -> Iterator[memoryview]:
+        datos = self._resto + bloque if self._resto else bloque
+        vista = memoryview(datos)
+        inicio = 0
+        while True:
+            fin = datos.find(_LF, inicio)
+            if fin < 0: break
+            corte = fin - 1 if fin > inicio and datos[fin - 1] == _CR else fin
+            self.lineas += 1
+            yield vista[inicio:corte]
+            inicio = fin + 1
+        self._resto = bytes(vista[inicio:]) if inicio < len(datos) else b""
+
+    def _decodificar(self, datos):
+        try:
+            return loads(datos)
+        except JSONError:
+            self.descartadas += 1
+            return None
+
+
+class ParserNDJSON(_ParserLineas):
+    """Un objeto JSON por línea (stream de /api/chat de Ollama)."""
+
+    terminado = False
+
+    def feed(self, bloque: bytes) -> List[dict]:
+        eventos = []
+        for linea in self._lineas(bloque):
+            if not linea: continue
+            evento = self._decodificar(linea)
+            if evento is not None: eventos.append(evento)
+        return eventos
+
+    def cerrar(self) -> List[dict]:
+        """Procesa la última línea si el stream terminó sin salto de línea."""
+        if not self._resto: return []
+        resto, self._resto = self._resto, b""
+        return self.feed(resto + _LF)
+
+
+class ParserSSE(_ParserLineas):
+    """Server-Sent Events con datos JSON (stream de OpenRouter / OpenAI).
+
+    Cada evento se despacha al llegar su línea en blanco; varias líneas
+    data: de un mismo evento se unen con salto de línea, como pide el
+    estándar. `data: [DONE]` marca `terminado`."""
+
+    def __init__(self):
+        super().__init__()
+        self.terminado = False
+        self._datos: List[bytes] = []   # solo para eventos de varias líneas
+
+    def feed(self, bloque: bytes) -> List[dict]:
+        eventos = []
+        pendiente = None                # memoryview de la única línea data: del evento
+        for linea in self._lineas(bloque):
+            if not linea:
+                # Fin de evento
+                if self._datos:
+                    if pendiente is not None: self._datos.append(bytes(pendiente))
+                    pendiente = b"\n".join(self._datos); self._datos = []
+                if pendiente is not None:
+                    self._despachar(pendiente, eventos)
+                    pendiente = None
+                continue
+            if linea[0] == _DOS_PUNTOS:
+                self.descartadas += 1   # comentario / keep-alive
+                continue
+            if linea[:5] != _DATA: continue   # event:, id:, retry:
+            valor = linea[6:] if len(linea) > 5 and linea[5] == 0x20 else linea[5:]
+            if pendiente is not None: self._datos.append(bytes(pendiente))
+            pendiente = valor
+        # Evento aún sin línea en blanco: se conserva para el bloque siguiente
+        if pendiente is not None: self._datos.append(bytes(pendiente))
+        return eventos
+
+    def _despachar(self, datos, eventos: list):
+        if datos == _DONE:
+            self.terminado = True
+            return
+        evento = self._decodificar(datos)
+        if evento is not None: eventos.append(evento)
+
+    def cerrar(self) -> List[dict]:
+        """Despacha lo que quede si el stream se cortó sin línea en blanco final."""
+        eventos = []
+        if self._resto:
+            resto, self._resto = self._resto, b""
+            eventos += self.feed(resto + _LF)
+        if self._datos:
+            datos = b"\n".join(self._datos); self._datos = []
+            self._despachar(datos, eventos)
+        return eventos
+
+
+# ── Micro-benchmark ───────────────────────────────────────────────────────────
+
+def _stream_sintetico(formato: str, tokens: int = 2000) -> bytes:
+    palabras = ["Hola", " ¿qué", " tal?", " Soy", " Lune", ",", " tu", " asistente", " híbrida", "."]
+    partes = []
+    for i in range(tokens):
+        t = palabras[i % len(palabras)]
+        if formato == "sse":
+            if i % 50 == 0: partes.append(": OPENROUTER PROCESSING\n\n")
+            partes.append("data: " + json.dumps({"id": "gen-1", "object": "chat.completion.chunk", "model": "m",
+                                                 "choices": [{"index": 0, "delta": {"content": t}}]},
+                                                ensure_ascii=False) + "\n\n")
+        else:
+            partes.append(json.dumps({"model": "m", "created_at": "2024-01-01T00:00:00Z",
+                                      "message": {"role": "assistant", "content": t}, "done": False},
+                                     ensure_ascii=False) + "\n")
+    partes.append("data: [DONE]\n\n" if formato == "sse" else json.dumps({"done": True}) + "\n")
+    return "".join(partes).encode("utf-8")
+
+
+def _trocear(datos: bytes, tam: int = 117) -> List[bytes]:
+    # Tamaño de bloque impar para que muchas líneas queden partidas entre lecturas
+    return [datos[i:i + tam] for i in range(0, len(datos), tam)]
+
+
+def _legado(formato: str, bloques: List[bytes]) -> int:
+    """Parseo anterior: decodificar cada línea a str + json.loads (referencia)."""
+    n, resto = 0, b""
+    for bloque in bloques:
+        *lineas, resto = (resto + bloque).split(b"\n")
+        for linea in lineas:
+            if not linea: continue
+            texto = linea.decode("utf-8")
+            if formato == "sse":
+                if not texto.startswith("data: "): continue
+                texto = texto[6:]
+                if texto.strip() == "[DONE]": break
+            try: json.loads(texto); n += 1
+            except json.JSONDecodeError: pass
+    return n
+
+
+def _benchmark(rutas: List[str]):
+    import time
+    streams = []
+    for ruta in rutas:
+        with open(ruta, "rb") as f: datos = f.read()
+        streams.append((ruta, "sse" if b"data:" in datos[:200] else "ndjson", datos))
+    if not streams:
+        streams = [("sintético ollama", "ndjson", _stream_sintetico("ndjson")),
+                   ("sintético openrouter", "sse", _stream_sintetico("sse"))]
+
+    print(f"JSON: {'orjson' if orjson else 'json (stdlib)'}")
+    for nombre, formato, datos in streams:
+        bloques = _trocear(datos)
+        repeticiones = 20
+
+        t = time.perf_counter()
+        for _ in range(repeticiones): tokens = _legado(formato, bloques)
+        t_legado = time.perf_counter() - t
+
+        t = time.perf_counter()
+        for _ in range(repeticiones):
+            parser = ParserSSE() if formato == "sse" else ParserNDJSON()
+            tokens_nuevo = sum(len(parser.feed(b)) for b in bloques) + len(parser.cerrar())
+        t_nuevo = time.perf_counter() - t
+
+        por_token = lambda seg: seg / max(1, tokens_nuevo * repeticiones) * 1e9
+        print(f"{nombre}: {tokens_nuevo} eventos ({tokens} antes), {len(bloques)} bloques · "
+              f"anterior {por_token(t_legado):.0f} ns/token · nuevo {por_token(t_nuevo):.0f} ns/token")
+
+
+if __name__ == "__main__":
+    import sys
+    _benchmark(sys.argv[1:])
@@ -112,4 +112,13 @@ PROVIDER_META = {
         "desc": "Offline · sin red",
         "system": _get_system_prompt,
     },
+    "auto": {
+        "label": "LUNE AI · AUTO",
+        "icon": "✦",
+        "svg": "bolt",
+        "color": COLORS["yellow"],
+        "dark": COLORS["yellow_dark"],
+        "desc": "Local o nube según la latencia",
+        "system": _get_system_prompt,
+    },
 }
@@ -0,0 +1,156 @@
+"""
+tokens.py — Conteo de tokens rápido, por familia de modelo y memoizado.
+================================================================
+Historial, presupuesto del prompt, bloque de memoria y enrutador necesitan
+saber cuántos tokens ocupa un texto. contar(texto, modelo) devuelve:
+
+  • El conteo exacto si hay un tokenizador registrado para la familia del
+    modelo: tiktoken para GPT/OpenAI (si está instalado) o un tokenizer.json
+    de Hugging Face con la librería `tokenizers` (llama, mistral, qwen...).
+    registrar_tokenizador(familia, funcion) permite añadir otros.
+  • Si no, una estimación heurística: palabras cortas = 1 token, las largas
+    se parten cada ~4 letras, cada número cada 3 cifras y cada signo de
+    puntuación/emoji cuenta aparte. Se acerca bastante más que len/4 en
+    español y no necesita nada instalado.
+
+Los resultados se memoizan en un LRU con clave (familia, hash del texto,
+longitud): el hash de un str se calcula una vez y queda guardado en el
+propio objeto, así que volver a contar el mismo mensaje o recuerdo cuesta
+una búsqueda en un dict.
+"""
+import re
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Dict, Optional
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+try:
+    from tokenizers import Tokenizer
+except ImportError:
+    Tokenizer = None
+
+# Sobrecoste fijo por mensaje (rol, separadores de la plantilla del modelo)
+TOKENS_POR_MENSAJE = 4
+
+# Familia por nombre de modelo (se busca la primera coincidencia, en orden)
+FAMILIAS = (
+    ("openai", ("gpt", "o1", "o3", "o4", "openai/", "chatgpt")),
+    ("llama", ("llama", "dolphin-llama", "codellama")),
+    ("mistral", ("mistral", "mixtral", "dolphin-mistral", "nous-hermes")),
+    ("qwen", ("qwen",)),
+    ("gemma", ("gemma",)),
+    ("phi", ("phi",)),
+    ("deepseek", ("deepseek",)),
+    ("claude", ("claude", "anthropic/")),
+)
+
+_PIEZAS = re.compile(r"[^\W\d_]+|\d+|\S", re.UNICODE)
+
+_tokenizadores: Dict[str, Callable[[str], int]] = {}
+_cache: "OrderedDict[tuple, int]" = OrderedDict()
+_lock = threading.Lock()          # se cuenta desde la UI y desde el motor
+MAX_CACHE = 20000
+
+
+def familia_de(modelo: Optional[str]) -> str:
+    """"heuristica" si no se reconoce el modelo."""
+    nombre = (modelo or "").lower()
+    for familia, claves in FAMILIAS:
+        if any(c in nombre for c in claves): return familia
+    return "heuristica"
+
+
+def heuristica(texto: str) -> int:
+    n = 0
+    for pieza in _PIEZAS.findall(texto):
+        c = pieza[0]
+        if c.isdigit(): n += (len(pieza) + 2) // 3
+        elif c.isalpha(): n += 1 + (len(pieza) - 1) // 4 if len(pieza) > 4 else 1
+        else: n += 1 if ord(c) < 0x2000 else 2    # emojis y símbolos raros: varios bytes
+    return n
+
+
+def registrar_tokenizador(familia: str, contar_exacto: Callable[[str], int]):
+    """Conteo exacto para una familia; invalida lo memoizado de esa familia."""
+    _tokenizadores[familia] = contar_exacto
+    with _lock:
+        for clave in [k for k in _cache if k[0] == familia]: del _cache[clave]
+
+
+def cargar_tokenizer_json(familia: str, ruta) -> bool:
+    """Registra un tokenizer.json de Hugging Face (requiere `tokenizers`)."""
+    if Tokenizer is None or not Path(ruta).exists(): return False
+    try:
+        tok = Tokenizer.from_file(str(ruta))
+    except Exception:
+        return False
+    registrar_tokenizador(familia, lambda texto: len(tok.encode(texto, add_special_tokens=False).ids))
+    return True
+
+
+def configurar(tokenizadores: Optional[Dict[str, str]] = None):
+    """`tokenizadores`: {familia: ruta a tokenizer.json} (config ia.tokenizadores)."""
+    for familia, ruta in (tokenizadores or {}).items(): cargar_tokenizer_json(familia, ruta)
+
+
+def contar(texto: str, modelo: Optional[str] = None) -> int:
+    if not texto: return 0
+    familia = familia_de(modelo)
+    contar_exacto = _tokenizadores.get(familia)
+    if contar_exacto is None: familia = "heuristica"
+    clave = (familia, hash(texto), len(texto))
+    with _lock:
+        n = _cache.get(clave)
+        if n is not None:
+            _cache.move_to_end(clave)
+            return n
+    try:
+        n = contar_exacto(texto) if contar_exacto is not None else heuristica(texto)
+    except Exception:
+        n = heuristica(texto)
+    with _lock:
+        _cache[clave] = n
+        if len(_cache) > MAX_CACHE: _cache.popitem(last=False)
+    return n
+
+
+def contar_mensaje(mensaje: dict, modelo: Optional[str] = None) -> int:
+    return contar(mensaje.get("content", ""), modelo) + TOKENS_POR_MENSAJE
+
+
+def contar_mensajes(mensajes, modelo: Optional[str] = None) -> int:
+    return sum(contar_mensaje(m, modelo) for m in mensajes)
+
+
+def stats() -> dict:
+    return {"memoizados": len(_cache), "exactos": sorted(_tokenizadores)}
+
+
+# tiktoken trae sus tablas (se descargan una vez y quedan en caché local)
+if tiktoken is not None:
+    try:
+        _enc = tiktoken.get_encoding("o200k_base")
+        registrar_tokenizador("openai", lambda texto: len(_enc.encode(texto, disallowed_special=())))
+    except Exception:
+        pass
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+    muestra = " ".join(sys.argv[1:]) or ("Hola, ¿qué tal? Soy Lune 🌙 y hoy es 2024-05-17; "
+                                         "el presupuesto es de 1.250 tokens por conversación.")
+    for modelo in ("gpt-4o", "dolphin-mistral", "desconocido"):
+        print(f"{modelo:<16} familia={familia_de(modelo):<10} tokens={contar(muestra, modelo)}  "
+              f"(len/4={(len(muestra) + 3) // 4})")
+    t = time.perf_counter()
+    for i in range(20000): heuristica(muestra)
+    frio = (time.perf_counter() - t) / 20000 * 1e6
+    t = time.perf_counter()
+    for i in range(20000): contar(muestra)
+    print(f"heurística sin caché {frio:.1f} µs · memoizado {(time.perf_counter() - t) / 20000 * 1e6:.2f} µs")
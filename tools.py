@@ -25,6 +25,20 @@ except ImportError:
     psutil = None
 
 
+# Instrucciones para que el modelo pida acciones de escritorio (parsear_respuesta_ia).
+# Va en el system prompt tras el personaje (prompt_sistema.py).
+REGLAS_PROMPT = (
+    "\n\n=========================================\n"
+    "REGLAS DE HERRAMIENTAS DE ESCRITORIO:\n"
+    "Puedes ejecutar acciones en el PC del usuario si lo consideras necesario. "
+    "Para hacerlo, DEBES incluir uno de los siguientes comandos exactamente al FINAL de tu respuesta:\n\n"
+    "1. Para buscar en Google o Youtube:\n   ABRIR_BUSQUEDA:[términos]\n"
+    "2. Para abrir una URL:\n   ABRIR_URL:[url completa con https://]\n"
+    "3. Para lanzar una app:\n   TOOL:lanzar_app:[nombre_del_programa]\n"
+    "4. Para verificar info del PC:\n   TOOL:sistema_info:\n"
+)
+
+
 class ToolResult:
     """Contenedor para el resultado de ejecutar una herramienta."""
     def __init__(self, ok: bool, mensaje: str, datos: dict = None):
@@ -231,6 +245,10 @@ class ToolManager:
         ram = psutil.virtual_memory().percent
         return ToolResult(True, f"**Estado del PC**: CPU {cpu}% | RAM {ram}%")
 
+    def reglas_prompt(self) -> str:
+        """Bloque de reglas de herramientas para el system prompt."""
+        return REGLAS_PROMPT
+
     def listar_disponibles(self) -> str:
         todas = {
             "buscar_web": "Buscar en Google o YouTube",
@@ -0,0 +1,171 @@
+"""
+trabajos.py — Cola con prioridad para el trabajo de IA en segundo plano.
+================================================================
+Resúmenes rodantes, extracción de hechos para la memoria y títulos de
+conversación no deben competir con el chat: se encolan aquí y AIManager los
+ejecuta solo cuando no hay peticiones interactivas.
+
+  • Prioridad: menor número = antes (resumen < hechos < título < embeddings
+    de recuerdos). Dentro de la misma prioridad, por orden de llegada.
+  • Inactividad: un lote solo arranca tras `retardo_inactivo_s` sin chat.
+  • Lotes: los trabajos pendientes del mismo tipo salen juntos (hasta
+    `max_lote`) y su manejador los resuelve con una sola llamada al modelo
+    cuando puede. Un trabajo con la misma clave que otro pendiente lo
+    sustituye (p.ej. dos resúmenes del mismo historial).
+  • Concurrencia acotada: como mucho `max_concurrentes` lotes a la vez.
+  • Expropiación: al llegar una petición interactiva, interrumpir() cancela
+    los lotes en curso (se cierra su conexión y Ollama deja de generar) y sus
+    trabajos vuelven a la cola para la próxima pausa.
+
+Todo corre en el loop del motor (AIEngine).
+"""
+import asyncio
+import heapq
+import itertools
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional
+
+from utils import log_error
+
+PRIORIDAD_RESUMEN = 10
+PRIORIDAD_HECHOS = 20
+PRIORIDAD_TITULO = 30
+PRIORIDAD_EMBEDDINGS = 40
+
+
+class Trabajo:
+    """Unidad de trabajo de fondo."""
+
+    def __init__(self, tipo: str, datos: Any, prioridad: int, clave: Optional[Hashable] = None):
+        self.tipo = tipo
+        self.datos = datos
+        self.prioridad = prioridad
+        self.clave = clave
+        self.encolado = time.monotonic()
+        self.interrupciones = 0
+        self.vigente = True                    # False si otro con la misma clave lo sustituyó
+
+
+class ColaTrabajos:
+    def __init__(self, esperar_inactivo: Callable[[], Awaitable[None]], hay_activas: Callable[[], bool],
+                 max_concurrentes: int = 1, retardo_inactivo_s: float = 1.5, max_lote: int = 8,
+                 max_interrupciones: int = 5):
+        self._esperar_inactivo = esperar_inactivo
+        self._hay_activas = hay_activas
+        self.max_concurrentes = max(1, max_concurrentes)
+        self.retardo_inactivo_s = retardo_inactivo_s
+        self.max_lote = max(1, max_lote)
+        self.max_interrupciones = max_interrupciones
+        self._manejadores: Dict[str, Callable[[List[Any]], Awaitable[None]]] = {}
+        self._heap: list = []
+        self._orden = itertools.count()
+        self._por_clave: Dict[Hashable, Trabajo] = {}
+        self._en_curso: Dict[asyncio.Task, List[Trabajo]] = {}
+        self._hay_trabajo: Optional[asyncio.Event] = None
+        self._bucle: Optional[asyncio.Task] = None
+        self.completados = 0
+        self.interrumpidos = 0
+        self.descartados = 0
+
+    def registrar(self, tipo: str, manejador: Callable[[List[Any]], Awaitable[None]]):
+        """`manejador(lista_de_datos)` procesa un lote de trabajos del tipo dado."""
+        self._manejadores[tipo] = manejador
+
+    # ── Encolar ───────────────────────────────────────────────────────────────
+
+    def encolar(self, tipo: str, datos: Any, prioridad: int, clave: Optional[Hashable] = None):
+        """Añade un trabajo (llamar desde el loop del motor)."""
+        if clave is not None:
+            previo = self._por_clave.get(clave)
+            if previo is not None: previo.vigente = False
+        self._poner(Trabajo(tipo, datos, prioridad, clave))
+
+    def _poner(self, trabajo: Trabajo):
+        if trabajo.clave is not None: self._por_clave[trabajo.clave] = trabajo
+        heapq.heappush(self._heap, (trabajo.prioridad, next(self._orden), trabajo))
+        self._despertar()
+
+    def _despertar(self):
+        if self._hay_trabajo is None: self._hay_trabajo = asyncio.Event()
+        self._hay_trabajo.set()
+        if self._bucle is None or self._bucle.done():
+            self._bucle = asyncio.get_running_loop().create_task(self._despachar())
+
+    def _sacar_lote(self) -> List[Trabajo]:
+        """Primer trabajo por prioridad y, con él, los pendientes de su tipo."""
+        primero = None
+        while self._heap and primero is None:
+            trabajo = heapq.heappop(self._heap)[2]
+            if trabajo.vigente: primero = trabajo
+        if primero is None: return []
+        lote, resto = [primero], []
+        while self._heap and len(lote) < self.max_lote:
+            entrada = heapq.heappop(self._heap)
+            trabajo = entrada[2]
+            if not trabajo.vigente: continue
+            if trabajo.tipo == primero.tipo: lote.append(trabajo)
+            else: resto.append(entrada)
+        for entrada in resto: heapq.heappush(self._heap, entrada)
+        for trabajo in lote:
+            if trabajo.clave is not None and self._por_clave.get(trabajo.clave) is trabajo:
+                del self._por_clave[trabajo.clave]
+        return lote
+
+    # ── Despacho ──────────────────────────────────────────────────────────────
+
+    async def _esperar_pausa(self):
+        # Inactivo y sin peticiones nuevas durante el retardo completo
+        while True:
+            await self._esperar_inactivo()
+            await asyncio.sleep(self.retardo_inactivo_s)
+            if not self._hay_activas(): return
+
+    async def _despachar(self):
+        while True:
+            if not self._heap:
+                self._hay_trabajo.clear()
+                await self._hay_trabajo.wait()
+            await self._esperar_pausa()
+            while self._heap and len(self._en_curso) < self.max_concurrentes and not self._hay_activas():
+                lote = self._sacar_lote()
+                if not lote: break
+                tarea = asyncio.get_running_loop().create_task(self._ejecutar(lote))
+                self._en_curso[tarea] = lote
+                tarea.add_done_callback(self._terminado)
+            if self._en_curso and (len(self._en_curso) >= self.max_concurrentes or not self._heap):
+                await asyncio.wait(list(self._en_curso), return_when=asyncio.FIRST_COMPLETED)
+
+    async def _ejecutar(self, lote: List[Trabajo]):
+        manejador = self._manejadores.get(lote[0].tipo)
+        if manejador is None:
+            self.descartados += len(lote)
+            return
+        try:
+            await manejador([t.datos for t in lote])
+            self.completados += len(lote)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.descartados += len(lote)
+            log_error(f"Trabajo de fondo '{lote[0].tipo}': {e}")
+
+    def _terminado(self, tarea: asyncio.Task):
+        lote = self._en_curso.pop(tarea, [])
+        if not tarea.cancelled(): return
+        # Expropiado: vuelve a la cola salvo que ya lo sustituyera otro más nuevo
+        self.interrumpidos += 1
+        for trabajo in lote:
+            trabajo.interrupciones += 1
+            if trabajo.interrupciones > self.max_interrupciones:
+                self.descartados += 1
+            elif trabajo.clave is None or trabajo.clave not in self._por_clave:
+                self._poner(trabajo)
+
+    def interrumpir(self):
+        """Cede el paso a una petición interactiva: cancela los lotes en curso."""
+        for tarea in list(self._en_curso): tarea.cancel()
+
+    def stats(self) -> dict:
+        return {"pendientes": sum(1 for _, _, t in self._heap if t.vigente), "en_curso": len(self._en_curso),
+                "completados": self.completados, "interrumpidos": self.interrumpidos,
+                "descartados": self.descartados}
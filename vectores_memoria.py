@@ -0,0 +1,223 @@
+"""
+vectores_memoria.py — Índice vectorial de los recuerdos en un .npy mapeado.
+================================================================
+Búsqueda semántica para la memoria personal, junto a memoria.json:
+
+    memoria_vectores.npy    matriz (capacidad, dim) float32 o float16, abierta
+                            con np.load(mmap_mode="r+"): al arrancar no se lee
+                            entera ni se recalcula ningún embedding
+    memoria_vectores.ids    diario de filas: "+id" por cada vector añadido,
+                            "-id" al olvidarlo (lápida; la fila queda muerta)
+    memoria_vectores.json   dimensión, tipo, modelo de embeddings y capacidad
+
+  • agregar(ids, matriz, modelo): escribe las filas en el mapa, las vuelca a
+    disco y después anota los ids (si se corta a medias, una fila sin id no
+    cuenta). Al llenarse, la capacidad se duplica copiando a un archivo nuevo.
+  • borrar(id): lápida en memoria y en el diario; compactar() reescribe sin
+    las filas muertas cuando pasan de la mitad.
+  • buscar(vector, k): un producto matriz·vector con NumPy sobre las filas en
+    uso, lápidas a -inf y argpartition para el top-k. En float16 se convierte
+    por bloques (NumPy no acelera matmul en float16): ocupa la mitad, pero
+    busca más despacio.
+  • Si cambia el modelo de embeddings (o su dimensión) el índice se vacía y
+    MemoriaManager vuelve a encolar los recuerdos.
+
+Todas las operaciones toman un lock: se añade desde el hilo del motor (trabajo
+de fondo "embeddings") y se busca desde la UI. Requiere numpy.
+"""
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from utils import log_error
+
+
+class IndiceVectorial:
+    """Vectores normalizados de recuerdos, mapeados desde disco."""
+
+    BLOQUE = 16384          # filas por bloque al convertir float16 → float32
+
+    def __init__(self, ruta_base: Path, dtype: str = "float32", capacidad_inicial: int = 1024):
+        base = Path(ruta_base)
+        self.ruta_npy = base.with_name(base.name + "_vectores.npy")
+        self.ruta_ids = base.with_name(base.name + "_vectores.ids")
+        self.ruta_meta = base.with_name(base.name + "_vectores.json")
+        self.dtype = np.dtype(dtype)
+        self.capacidad_inicial = capacidad_inicial
+        self._lock = threading.Lock()
+        self._matriz = None                     # np.memmap (capacidad, dim)
+        self.dim: Optional[int] = None
+        self.modelo: Optional[str] = None
+        self._ids: List[str] = []               # fila → id
+        self._fila: Dict[str, int] = {}         # id → fila viva
+        self._vivas = np.zeros(0, dtype=bool)
+        self._olvidados: set = set()            # borrados antes de tener vector
+        self.busquedas = 0
+        self._cargar()
+
+    # ── Carga / disco ─────────────────────────────────────────────────────────
+
+    def _cargar(self):
+        try:
+            meta = json.loads(self.ruta_meta.read_text("utf-8"))
+            matriz = np.load(self.ruta_npy, mmap_mode="r+")
+            lineas = self.ruta_ids.read_text("utf-8").splitlines()
+        except (OSError, ValueError):
+            return
+        if matriz.ndim != 2 or str(matriz.dtype) != meta.get("dtype") or matriz.dtype != self.dtype:
+            return                              # otro tipo configurado: se reconstruye
+        self._matriz, self.dim, self.modelo = matriz, matriz.shape[1], meta.get("modelo")
+        self._vivas = np.zeros(matriz.shape[0], dtype=bool)
+        for linea in lineas:
+            signo, rid = linea[:1], linea[1:]
+            if signo == "+" and len(self._ids) < matriz.shape[0]:
+                self._fila[rid] = len(self._ids); self._vivas[len(self._ids)] = True
+                self._ids.append(rid)
+            elif signo == "-" and rid in self._fila:
+                self._vivas[self._fila.pop(rid)] = False
+
+    def _crear(self, dim: int, modelo: str, capacidad: int):
+        self._cerrar_mapa()
+        for ruta in (self.ruta_npy, self.ruta_ids): ruta.unlink(missing_ok=True)
+        self.ruta_npy.parent.mkdir(parents=True, exist_ok=True)
+        self._matriz = np.lib.format.open_memmap(self.ruta_npy, mode="w+", dtype=self.dtype, shape=(capacidad, dim))
+        self.dim, self.modelo = dim, modelo
+        self._ids, self._fila, self._vivas = [], {}, np.zeros(capacidad, dtype=bool)
+        self.ruta_ids.write_text("", encoding="utf-8")
+        self._guardar_meta()
+
+    def _guardar_meta(self):
+        tmp = self.ruta_meta.with_name(self.ruta_meta.name + ".tmp")
+        tmp.write_text(json.dumps({"dim": self.dim, "dtype": str(self.dtype), "modelo": self.modelo,
+                                   "capacidad": int(self._matriz.shape[0])}), encoding="utf-8")
+        os.replace(tmp, self.ruta_meta)
+
+    def _cerrar_mapa(self):
+        if self._matriz is not None:
+            self._matriz.flush()
+            del self._matriz                    # Windows no deja reemplazar un archivo mapeado
+            self._matriz = None
+
+    def _crecer(self, minimo: int):
+        """Duplica la capacidad: copia a un .npy nuevo y lo pone en su sitio."""
+        capacidad = max(minimo, self._matriz.shape[0] * 2)
+        tmp = self.ruta_npy.with_name(self.ruta_npy.name + ".tmp")
+        nueva = np.lib.format.open_memmap(tmp, mode="w+", dtype=self.dtype, shape=(capacidad, self.dim))
+        n = len(self._ids)
+        nueva[:n] = self._matriz[:n]
+        nueva.flush(); del nueva
+        self._cerrar_mapa()
+        os.replace(tmp, self.ruta_npy)
+        self._matriz = np.load(self.ruta_npy, mmap_mode="r+")
+        self._vivas = np.concatenate([self._vivas, np.zeros(capacidad - len(self._vivas), dtype=bool)])
+        self._guardar_meta()
+
+    # ── Escritura ─────────────────────────────────────────────────────────────
+
+    def agregar(self, ids: Sequence[str], matriz, modelo: str) -> bool:
+        """Añade vectores (filas normalizadas). Devuelve False si el modelo o la
+        dimensión no coinciden con el índice: se vacía y hay que reindexar."""
+        matriz = np.asarray(matriz, dtype=np.float32)
+        if matriz.ndim != 2 or len(ids) != len(matriz): return True
+        with self._lock:
+            try:
+                if self._matriz is None or matriz.shape[1] != self.dim or modelo != self.modelo:
+                    reiniciar = self._matriz is not None
+                    self._crear(matriz.shape[1], modelo, max(self.capacidad_inicial, len(ids)))
+                    if reiniciar:
+                        self._olvidados.clear()     # se reindexa desde los recuerdos que quedan
+                        return False
+                nuevos = [(rid, v) for rid, v in zip(ids, matriz)
+                          if rid not in self._fila and rid not in self._olvidados]
+                # Un olvidado solo se salta una vez: su lote ya llegó
+                self._olvidados.difference_update(ids)
+                if not nuevos: return True
+                n = len(self._ids)
+                if n + len(nuevos) > self._matriz.shape[0]: self._crecer(n + len(nuevos))
+                self._matriz[n:n + len(nuevos)] = np.stack([v for _, v in nuevos]).astype(self.dtype)
+                self._matriz.flush()
+                with open(self.ruta_ids, "a", encoding="utf-8") as f:
+                    f.write("".join(f"+{rid}\n" for rid, _ in nuevos))
+                for i, (rid, _) in enumerate(nuevos):
+                    self._fila[rid] = n + i; self._vivas[n + i] = True
+                    self._ids.append(rid)
+            except OSError as e:
+                log_error(f"Índice vectorial de la memoria: {e}")
+        return True
+
+    def borrar(self, rid: str):
+        with self._lock:
+            fila = self._fila.pop(rid, None)
+            if fila is None:
+                self._olvidados.add(rid)        # aún en cola para embeberse
+                return
+            self._vivas[fila] = False
+            try:
+                with open(self.ruta_ids, "a", encoding="utf-8") as f: f.write(f"-{rid}\n")
+            except OSError:
+                pass
+
+    def vaciar(self):
+        with self._lock:
+            self._cerrar_mapa()
+            for ruta in (self.ruta_npy, self.ruta_ids, self.ruta_meta): ruta.unlink(missing_ok=True)
+            self.dim = self.modelo = None
+            self._ids, self._fila, self._vivas = [], {}, np.zeros(0, dtype=bool)
+            self._olvidados = set()
+
+    def compactar(self, forzar: bool = False):
+        """Reescribe sin lápidas si las filas muertas son más de la mitad."""
+        with self._lock:
+            n = len(self._ids)
+            if self._matriz is None or not n or (not forzar and len(self._fila) * 2 >= n): return
+            vivas = np.flatnonzero(self._vivas[:n])
+            vectores = np.array(self._matriz[vivas])
+            ids = [self._ids[i] for i in vivas]
+            self._crear(self.dim, self.modelo, max(self.capacidad_inicial, len(ids) * 2))
+            if ids:
+                self._matriz[:len(ids)] = vectores; self._matriz.flush()
+                self.ruta_ids.write_text("".join(f"+{rid}\n" for rid in ids), encoding="utf-8")
+                self._ids = ids; self._fila = {rid: i for i, rid in enumerate(ids)}
+                self._vivas[:len(ids)] = True
+
+    def cerrar(self):
+        with self._lock: self._cerrar_mapa()
+
+    # ── Consulta ──────────────────────────────────────────────────────────────
+
+    def contiene(self, rid: str) -> bool:
+        return rid in self._fila
+
+    def buscar(self, vector, k: int = 8, modelo: Optional[str] = None,
+               min_similitud: float = 0.0) -> List[Tuple[str, float]]:
+        """Los `k` recuerdos más parecidos (coseno) a `vector`: [(id, similitud)]."""
+        with self._lock:
+            n = len(self._ids)
+            if self._matriz is None or not self._fila or (modelo is not None and modelo != self.modelo): return []
+            q = np.asarray(vector, dtype=np.float32).reshape(-1)
+            if q.shape[0] != self.dim: return []
+            self.busquedas += 1
+            if self.dtype == np.float32:
+                sims = self._matriz[:n] @ q
+            else:
+                sims = np.empty(n, dtype=np.float32)
+                for i in range(0, n, self.BLOQUE):
+                    fin = min(i + self.BLOQUE, n)
+                    sims[i:fin] = self._matriz[i:fin].astype(np.float32) @ q
+            sims = np.where(self._vivas[:n], sims, -np.inf)
+            k = min(k, len(self._fila))
+            top = np.argpartition(-sims, k - 1)[:k]
+            top = top[np.argsort(-sims[top])]
+            return [(self._ids[i], float(sims[i])) for i in top if sims[i] >= min_similitud]
+
+    def stats(self) -> dict:
+        return {"vivos": len(self._fila), "filas": len(self._ids), "dim": self.dim, "dtype": str(self.dtype),
+                "modelo": self.modelo, "capacidad": 0 if self._matriz is None else int(self._matriz.shape[0]),
+                "busquedas": self.busquedas}